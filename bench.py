@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки Excel- и PDF-инструментов агента.
+
+Использование:
+  python bench.py               — все бенчмарки
+  python bench.py styles        — только указанный
+  python bench.py styles 20000  — с другим числом строк
+
+Файлы пишутся во временную папку и удаляются после замера.
+"""
+
+import sys
+import time
+import tempfile
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+
+import claude_agent_v3 as agent
+
+DEFAULT_ROWS = 50_000
+COLUMNS = 8
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def _fmt_size(n: int) -> str:
+    return f"{n / 1024:.0f} КБ" if n < 1024 * 1024 else f"{n / 1024 / 1024:.1f} МБ"
+
+
+def _report(title: str, rows: list) -> None:
+    print(f"\n{title}")
+    width = max(len(r[0]) for r in rows)
+    for name, *values in rows:
+        print(f"  {name.ljust(width)}  " + "  ".join(str(v).rjust(12) for v in values))
+
+
+# ============ STYLES ============
+
+def _sample_sheet(n_rows: int):
+    wb = Workbook()
+    ws = wb.active
+    ws.append([f"Колонка {i}" for i in range(1, COLUMNS + 1)])
+    for r in range(n_rows):
+        ws.append([r * c + 0.5 if c % 2 else f"текст {r % 97}" for c in range(COLUMNS)])
+    return wb, ws
+
+
+def _style_per_cell(wb, ws) -> None:
+    """Как было: новые Font/PatternFill/Border на каждую ячейку."""
+    for cell in ws[1]:
+        cell.font = Font(bold=True, color="FFFFFF")
+        cell.fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
+        cell.alignment = Alignment(horizontal="center", vertical="center")
+    thin = Border(left=Side(style="thin"), right=Side(style="thin"),
+                  top=Side(style="thin"), bottom=Side(style="thin"))
+    for row in ws.iter_rows():
+        for cell in row:
+            cell.border = thin
+
+
+def _style_named(wb, ws) -> None:
+    """Сейчас: именованные стили, назначение диапазонами."""
+    agent._style_range(ws, agent._register_style(wb, "body"), 2, ws.max_row)
+    agent._style_range(ws, agent._register_style(wb, "header"), 1, 1)
+
+
+def bench_styles(n_rows: int) -> None:
+    rows = [("", "стили, с", "сохранение, с", "файл", "styles.xml")]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, apply in (("по ячейкам", _style_per_cell), ("NamedStyle", _style_named)):
+            wb, ws = _sample_sheet(n_rows)
+            path = Path(tmp) / f"{name}.xlsx"
+            style_time, _ = _timed(lambda: apply(wb, ws))
+            save_time, _ = _timed(lambda: wb.save(path))
+            with zipfile.ZipFile(path) as zf:
+                styles_size = zf.getinfo("xl/styles.xml").file_size
+            rows.append((name, f"{style_time:.2f}", f"{save_time:.2f}",
+                         _fmt_size(path.stat().st_size), _fmt_size(styles_size)))
+    _report(f"Оформление листа {n_rows} × {COLUMNS}", rows)
+
+
+# ============ FORMULAS ============
+
+def bench_formulas(n_rows: int) -> None:
+    """Лист с n_rows формулами C = A*B и итогом SUM(C:C)."""
+    n_rows = max(n_rows, 100_000)
+    wb = Workbook()
+    ws = wb.active
+    for r in range(1, n_rows + 1):
+        ws.append([r, r % 7, f"=A{r}*B{r}"])
+    ws["D1"] = "=SUM(C:C)"
+
+    full, engine = _timed(lambda: agent._recalculate_workbook(wb))
+    ws["A500"] = 1
+    edit, _ = _timed(lambda: agent._recalculate_workbook(wb, {(ws.title, 500, 1)}))
+    dirty = engine.last_stats["calculated"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "formulas.xlsx"
+        save, _ = _timed(lambda: wb.save(path))
+        write, written = _timed(lambda: agent._write_cached_values(path, engine))
+
+    _report(f"Формулы: {n_rows + 1} на листе", [
+        ("", "время, с", "ячеек"),
+        ("граф + полный пересчёт", f"{full:.2f}", n_rows + 1),
+        ("правка A500", f"{edit:.3f}", dirty),
+        ("сохранение openpyxl", f"{save:.2f}", ""),
+        ("запись значений в XML", f"{write:.2f}", written),
+    ])
+
+
+# ============ PIVOT FILES ============
+
+def bench_pivot_files(n_rows: int, n_files: int = 12) -> None:
+    """Сводная по n_files CSV-выгрузкам: последовательно и в пуле процессов."""
+    rng = np.random.default_rng(0)
+    rows = [("", "время, с")]
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(n_files):
+            path = Path(tmp) / f"region_{i:02d}.csv"
+            pd.DataFrame({
+                "Регион": rng.choice(["Север", "Юг", "Запад", "Восток"], n_rows),
+                "Товар": rng.choice([f"Товар {k}" for k in range(50)], n_rows),
+                "Сумма": rng.normal(1000, 200, n_rows).round(2),
+            }).to_csv(path, index=False)
+            paths.append(path)
+
+        threshold = agent.PARALLEL_MIN_BYTES
+        for name, min_bytes in (("последовательно", float("inf")),
+                                (f"пул, {agent.PROCESS_POOL_WORKERS} проц.", 0)):
+            agent.PARALLEL_MIN_BYTES = min_bytes
+            elapsed, _ = _timed(lambda: agent._multi_file_pivot(
+                paths, ["Регион"], ["Товар"], {"Сумма": ["sum"]}, True, True))
+            rows.append((name, f"{elapsed:.2f}"))
+        agent.PARALLEL_MIN_BYTES = threshold
+    _report(f"Сводная по {n_files} файлам × {n_rows} строк", rows)
+
+
+# ============ READERS ============
+
+def bench_readers(n_rows: int) -> None:
+    """Чтение одного и того же xlsx движками openpyxl и calamine."""
+    engines = ["openpyxl"] + (["calamine"] if agent.CALAMINE_AVAILABLE else [])
+    rows = [("", "строки, с", "таблица, с")]
+    default = agent.EXCEL_READER_ENGINE
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "readers.xlsx"
+        wb, _ = _sample_sheet(n_rows)
+        wb.save(path)
+        for engine in engines:
+            agent.EXCEL_READER_ENGINE = engine
+            stream, _ = _timed(lambda: sum(1 for _ in agent._iter_sheet_rows(path)))
+            table, _ = _timed(lambda: agent._read_table_raw(path))
+            rows.append((engine, f"{stream:.2f}", f"{table:.2f}"))
+        agent.EXCEL_READER_ENGINE = default
+    if not agent.CALAMINE_AVAILABLE:
+        rows.append(("calamine", "не установлен", ""))
+    _report(f"Чтение листа {n_rows} × {COLUMNS}", rows)
+
+
+# ============ PDF ============
+
+def _sample_pdf(path: Path, pages: int) -> None:
+    import pymupdf
+    doc = pymupdf.open()
+    for p in range(pages):
+        page = doc.new_page()
+        for line in range(50):
+            # Встроенный шрифт Helvetica без кириллицы — текст латиницей
+            page.insert_text((40, 40 + line * 15), f"Page {p + 1}, line {line + 1}: "
+                             f"revenue {p * line * 1.5:.2f}, region {line % 7}")
+    doc.save(path)
+    doc.close()
+
+
+def bench_pdf(n_rows: int) -> None:
+    """Извлечение текста pdf_read: последовательно и в пуле процессов.
+
+    Страниц — до n_rows // 100 (500 по умолчанию)."""
+    if not agent.PDF_AVAILABLE:
+        print("\nPDF: PyMuPDF не установлен")
+        return
+    pool_name = f"пул, {agent.PROCESS_POOL_WORKERS} проц."
+    rows = [("страниц", "последовательно, с", f"{pool_name}, с", "ускорение")]
+    threshold = agent.PDF_PARALLEL_MIN_PAGES
+    agent.PDF_PARALLEL_MIN_PAGES = 0
+    agent._get_process_pool().submit(int).result()  # запуск процессов — не в замер
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in sorted({25, 100, max(n_rows // 100, 25)}):
+            path = Path(tmp) / f"pages_{pages}.pdf"
+            _sample_pdf(path, pages)
+            serial, expected = _timed(lambda: agent._pdf_pages_text(path, 0, pages))
+            pooled, texts = _timed(lambda: agent._pdf_text(path, pages))
+            assert texts == expected
+            rows.append((str(pages), f"{serial:.2f}", f"{pooled:.2f}", f"×{serial / pooled:.1f}"))
+    agent.PDF_PARALLEL_MIN_PAGES = threshold
+    _report("Текст PDF по страницам", rows)
+
+
+BENCHMARKS = {
+    "styles": bench_styles,
+    "formulas": bench_formulas,
+    "pivot_files": bench_pivot_files,
+    "readers": bench_readers,
+    "pdf": bench_pdf,
+}
+
+
+if __name__ == "__main__":
+    names = [a for a in sys.argv[1:] if not a.isdigit()] or list(BENCHMARKS)
+    counts = [int(a) for a in sys.argv[1:] if a.isdigit()]
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"Неизвестный бенчмарк: {name}. Доступные: {', '.join(BENCHMARKS)}")
+            sys.exit(1)
+        BENCHMARKS[name](counts[0] if counts else DEFAULT_ROWS)
@@ -1473,12 +1473,14 @@ class ChatApp(_DnDBase):
     def _cmd(self, text):
         c = text.lower().strip()
         cmds = {
-            "/help": lambda: self._sys_msg("/help • /files • /clear • /settings • /model • /dir • /export"),
+            "/help": lambda: self._sys_msg("/help • /files • /clear • /settings • /model • /dir • /export • /cache"),
             "/clear": lambda: [w.destroy() for w in self.chat_scroll.winfo_children()] or self._show_welcome(),
             "/settings": self._open_settings,
             "/model": lambda: self._sys_msg(f"Модель: {self.settings.get('model','?')}"),
             "/dir": lambda: self._sys_msg(f"📂 {self._get_output_dir()}"),
             "/export": self._export_chat,
+            "/cache": self._show_cache,
+            "/cache clear": lambda: self._show_cache(clear=True),
         }
         if c in cmds: cmds[c](); return True
         if c == "/files":
@@ -1492,6 +1494,13 @@ class ChatApp(_DnDBase):
             return True
         return False
 
+    def _show_cache(self, clear=False):
+        try:
+            from claude_agent_v3 import frame_cache_usage
+            self._sys_msg(frame_cache_usage(clear=clear))
+        except ImportError: self._sys_msg("⚠️ Не найден claude_agent_v3.py")
+        except Exception as e: self._sys_msg(f"Ошибка: {e}")
+
     # ==================== AGENT ====================
 
     def _init_agent(self):
@@ -1562,4 +1571,6 @@ class ChatApp(_DnDBase):
 
 
 if __name__ == "__main__":
+    # Нужно для пула процессов агента в собранном (PyInstaller) приложении
+    import multiprocessing; multiprocessing.freeze_support()
     ChatApp().mainloop()
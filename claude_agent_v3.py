@@ -6,7 +6,7 @@ Claude-подобный агент на LangChain 1.0
 
 v3 — Доработки:
   1. Безопасность: sandbox для bash и python (whitelist, ограничения)
-  2. _normalize_merged_cells работает с копией, не портит оригинал
+  2. merged cells заполняются на лету при потоковом чтении, оригинал не меняется
   3. Поиск файлов в нескольких директориях (OUTPUT_DIR, WORK_DIR, абс. путь)
   4. excel_from_csv: авто-определение кодировки и разделителя
   5. extract_multilevel_headers: защита от «рваных» заголовков
@@ -22,17 +22,41 @@ v3 — Доработки:
 import os
 import re
 import sys
-import shutil
 import subprocess
+import csv
 import json
 import logging
+import math
+import bisect
+import weakref
 import uuid
+import hashlib
+import sqlite3
+import time
 import atexit
+import multiprocessing
+import threading
+import zipfile
+import zlib
+import struct
+import random
+import tempfile
+import itertools
+import decimal
+import io
+import codecs
+import mmap
 import ipaddress
+import xml.etree.ElementTree as ET
 from pathlib import Path
-from datetime import datetime
-from typing import Any, Dict, Optional
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import copy
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
 from urllib.parse import urlparse
+from xml.sax.saxutils import escape as xml_escape
 
 from dotenv import load_dotenv
 
@@ -45,13 +69,37 @@ from langgraph.checkpoint.memory import MemorySaver
 # Excel библиотеки
 try:
     import openpyxl
-    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
-    from openpyxl.utils import get_column_letter
+    from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
+    from openpyxl.styles.cell_style import StyleArray
+    from openpyxl.utils import get_column_letter, column_index_from_string, range_boundaries
+    from openpyxl.utils.datetime import to_excel, from_excel
+    from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+    from openpyxl.formula.translate import Translator
+    from openpyxl.formula.tokenizer import Tokenizer, Token
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.reader.excel import ExcelReader
+    from openpyxl.worksheet._read_only import ReadOnlyWorksheet
+    import numpy as np
     import pandas as pd
     EXCEL_AVAILABLE = True
 except ImportError:
     EXCEL_AVAILABLE = False
 
+# Колоночный кэш таблиц (опционально)
+try:
+    import pyarrow as pa
+    import pyarrow.feather as pa_feather
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+
+# Быстрое чтение Excel на Rust (опционально)
+try:
+    from python_calamine import CalamineWorkbook
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
 # PDF библиотеки
 try:
     import pymupdf  # PyMuPDF (fitz)
@@ -110,6 +158,26 @@ OUTPUT_DIR.mkdir(exist_ok=True)
 WORK_DIR = BASE_DIR / "work"
 WORK_DIR.mkdir(exist_ok=True)
 
+# Служебный кэш (скрыт от list_files, т.к. начинается с точки)
+CACHE_DIR = WORK_DIR / ".cache"
+
+# --- Excel: потоковое чтение ---
+EXCEL_PREVIEW_ROWS = 20
+# Форматы, которые openpyxl умеет читать потоково (read_only)
+EXCEL_STREAMABLE_SUFFIXES = {".xlsx", ".xlsm", ".xltx", ".xltm"}
+# Движок чтения книг: auto (calamine, если установлен), calamine или openpyxl
+EXCEL_READER_ENGINE = os.getenv("EXCEL_READER_ENGINE", "auto").strip().lower()
+# Листы с XML больше этого порога не пересчитываются построчно —
+# количество строк берётся из <dimension> (приблизительно)
+EXCEL_EXACT_COUNT_MAX_BYTES = int(os.getenv("EXCEL_EXACT_COUNT_MAX_MB", "40")) * 1024 * 1024
+# Бюджет памяти для кэша загруженных книг и DataFrame
+EXCEL_CACHE_BUDGET_BYTES = int(os.getenv("EXCEL_CACHE_MB", "512")) * 1024 * 1024
+# Лимит дискового кэша разобранных таблиц (Feather) в CACHE_DIR/frames
+FRAME_CACHE_MAX_BYTES = int(os.getenv("FRAME_CACHE_MB", "2048")) * 1024 * 1024
+# Бюджет памяти на одну таблицу для сводных, профиля и конвертации:
+# таблицы больше него обрабатываются по частям со сбросом на диск
+DATA_MEMORY_BUDGET_BYTES = int(os.getenv("DATA_MEMORY_BUDGET_MB", "1024")) * 1024 * 1024
+
 # --- Безопасность: ограничения для bash ---
 BASH_BLOCKED_PATTERNS = [
     r"\brm\s+-rf\s+/",           # rm -rf /
@@ -189,11 +257,39 @@ SYSTEM_PROMPT = f"""Ты полезный AI-ассистент с доступ
 
 EXCEL:
 - Если файл содержит многоуровневые заголовки или объединённые ячейки:
-  используй excel_read_structured
+  используй excel_read_structured; число строк шапки он определяет сам —
+  передавай header_rows, только если автоопределение ошиблось
 - Если заголовки плоские:
   используй excel_read
+- excel_read показывает первые строки; дальше листай по курсору из ответа
+  (excel_read(cursor=...)) или offset/limit — не перечитывай файл через python_execute
+- В книге несколько листов — передай sheet_name="all" (или JSON-список листов)
+  в excel_read / excel_read_structured, а не читай листы по одному
+- Данные, которые собираются по ходу работы (парсинг, поиск), дописывай
+  через excel_append_rows — не пересоздавай файл excel_create и не пиши
+  построчно через excel_edit_cell
+- Чтобы изменить больше одной ячейки, используй excel_edit_cells (один вызов
+  вместо многих excel_edit_cell)
+- Формулы (SUM, AVERAGE, MIN, MAX, COUNT, COUNTA, IF, IFERROR, AND, OR, NOT,
+  VLOOKUP, ROUND, ABS, CONCATENATE, арифметика) считаются сразу при записи —
+  excel_read покажет значения, пересчитывать через python_execute не нужно
+- Для фильтрации, выборки колонок, группировки и подсчётов по Excel/CSV
+  используй excel_query (не python_execute); длинный результат — постранично (offset)
+- Чтобы найти файл с нужными данными ("где колонка Выручка?"), вызови
+  catalog_search — не открывай каждый файл через excel_read
+- Соединить две таблицы по ключу (клиенты + заказы) — table_join; он
+  справляется с выгрузками больше памяти, не пиши merge через python_execute
+- Большие CSV (логи, выгрузки) смотри через csv_read (строки, начало и конец)
+  и csv_stats (пустые, уникальные, min/max, квантили) — не конвертируй их
+  в Excel ради просмотра или статистики
 - Для создания сводных таблиц (группировка + агрегация):
-  используй excel_create_pivot
+  используй excel_create_pivot; таблицы больше бюджета памяти он считает по частям
+  (median там недоступна — бери mean или sum)
+- Несколько показателей в одной сводной (сумма и среднее выручки, число
+  заказов) — один вызов excel_create_pivot с aggregates, а не несколько файлов
+- Несколько выгрузок одной структуры сводятся одним вызовом: передай в
+  excel_create_pivot glob-шаблон ("sales_*.xlsx") или JSON-список файлов —
+  не склеивай их через python_execute
 - Многоуровневые заголовки объединяй через " | "
 
 PDF:
@@ -236,13 +332,16 @@ WORD (DOCX):
 
 # ============ HELPERS: FILE RESOLUTION ============
 
-def _resolve_file(filename: str, must_exist: bool = True) -> Optional[Path]:
+def _resolve_file(filename: str, must_exist: bool = True, flush_appends: bool = True) -> Optional[Path]:
     """
     Ищет файл в нескольких директориях:
     1. OUTPUT_DIR
     2. WORK_DIR
     3. Абсолютный путь (если указан)
 
+    Строки из буфера excel_append_rows сначала дописываются в файл
+    (flush_appends=False — не трогать буфер).
+
     Возвращает Path или None если файл не найден.
     """
     candidates = [
@@ -256,6 +355,8 @@ def _resolve_file(filename: str, must_exist: bool = True) -> Optional[Path]:
         candidates.insert(0, abs_path)
 
     for p in candidates:
+        if flush_appends and _has_pending_appends(p):
+            _flush_appends(p)
         if p.exists():
             return p
 
@@ -266,6 +367,38 @@ def _resolve_file(filename: str, must_exist: bool = True) -> Optional[Path]:
     return None
 
 
+def _resolve_files(spec: str) -> List[Path]:
+    """Список файлов по JSON-списку имён или glob-шаблону ("sales_*.xlsx").
+
+    Шаблон ищется в OUTPUT_DIR и WORK_DIR (абсолютный — как есть),
+    одно имя без шаблона — как в _resolve_file. Ненайденные имена списка
+    вызывают FileNotFoundError.
+    """
+    spec = spec.strip()
+    if spec.startswith("["):
+        names = json.loads(spec)
+        paths = [_resolve_file(str(name)) for name in names]
+        missing = [str(name) for name, path in zip(names, paths) if not path]
+        if missing:
+            raise FileNotFoundError(f"Файлы не найдены: {', '.join(missing)}")
+        return list(dict.fromkeys(paths))
+
+    if not any(ch in spec for ch in "*?["):
+        path = _resolve_file(spec)
+        return [path] if path else []
+
+    pattern = Path(spec)
+    if pattern.is_absolute():
+        matches = pattern.parent.glob(pattern.name)
+    else:
+        matches = itertools.chain(OUTPUT_DIR.glob(pattern.name), WORK_DIR.glob(pattern.name))
+    paths = sorted({p for p in matches if p.is_file()})
+    for path in paths:
+        if _has_pending_appends(path):
+            _flush_appends(path)
+    return paths
+
+
 # ============ HELPERS: SECURITY ============
 
 def _is_safe_url(url: str) -> Optional[str]:
@@ -322,407 +455,4539 @@ def _check_python_safety(code: str) -> Optional[str]:
     return None
 
 
-# ============ EXCEL TOOLS ============
+# ============ HELPERS: PROCESS POOL ============
+
+# Общий пул процессов для тяжёлого разбора (листы, файлы, страницы PDF).
+# Создаётся лениво и переиспользуется: запуск процессов — самая дорогая часть.
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool() -> ProcessPoolExecutor:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS)
+        return _process_pool
+
+
+def _shutdown_process_pool() -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+atexit.register(_shutdown_process_pool)
+
+
+def _pool_result(future, fallback):
+    """Результат задачи пула; если пул сломан (BrokenProcessPool и т.п.) —
+    выполняет fallback() в текущем процессе."""
+    try:
+        return future.result()
+    except Exception as e:
+        logger.warning(f"Пул процессов: задача не выполнена ({e}), выполняю в текущем процессе")
+        return fallback()
+
+
+# ============ EXCEL: ДВИЖОК ЧТЕНИЯ ============
+#
+# Чтение книг (строки листа, сводки по листам, таблицы для pandas) выбирает
+# движок через _reader_engine: python-calamine разбирает xlsx/xls/xlsb/ods
+# на Rust в разы быстрее openpyxl, openpyxl остаётся запасным вариантом.
+# Запись книг и формулы — всегда openpyxl.
+
+CALAMINE_SUFFIXES = EXCEL_STREAMABLE_SUFFIXES | {".xls", ".xlsb", ".ods"}
+
+if EXCEL_READER_ENGINE == "calamine" and not CALAMINE_AVAILABLE:
+    logger.warning("EXCEL_READER_ENGINE=calamine, но python-calamine не установлен — чтение через openpyxl")
+
+
+def _reader_engine(filepath: Path) -> str:
+    """Движок чтения файла: "calamine" или "openpyxl" (с учётом EXCEL_READER_ENGINE)."""
+    if (
+        CALAMINE_AVAILABLE
+        and EXCEL_READER_ENGINE != "openpyxl"
+        and filepath.suffix.lower() in CALAMINE_SUFFIXES
+    ):
+        return "calamine"
+    return "openpyxl"
+
+
+def _pandas_engine(filepath: Path) -> Optional[str]:
+    """engine для pd.read_excel: calamine или выбор pandas по расширению (None)."""
+    return "calamine" if _reader_engine(filepath) == "calamine" else None
 
-def _normalize_merged_cells(filepath: Path) -> Path:
+
+def _row_readable(filepath: Path) -> bool:
+    """Можно ли читать лист построчно (_iter_sheet_rows), а не только через pandas."""
+    return (
+        filepath.suffix.lower() in EXCEL_STREAMABLE_SUFFIXES
+        or _reader_engine(filepath) == "calamine"
+    )
+
+
+def _calamine_value(value):
+    """Значение ячейки calamine в виде, как его отдаёт openpyxl.
+
+    Пустые ячейки приходят как "" — здесь это None; целые числа хранятся
+    в файле как float — возвращаем int (openpyxl и pandas делают так же);
+    даты без времени — datetime.
     """
-    Безопасно убирает merged cells, работая с КОПИЕЙ файла.
-    Возвращает путь к нормализованной копии (или оригинал, если merged cells нет).
+    if value == "":
+        return None
+    if type(value) is float and value.is_integer():
+        return int(value)
+    if type(value) is date:
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def _calamine_sheet(filepath: Path, sheet_name: Optional[str] = None):
+    """Лист книги calamine (без sheet_name — первый)."""
+    wb = CalamineWorkbook.from_path(str(filepath))
+    names = list(wb.sheet_names)
+    if not names:
+        raise ValueError(f"В книге {filepath.name} нет листов")
+    if sheet_name is None:
+        return wb.get_sheet_by_name(names[0])
+    if sheet_name not in names:
+        raise ValueError(f"Лист не найден: {sheet_name}. Доступные листы: {', '.join(names)}")
+    return wb.get_sheet_by_name(sheet_name)
+
+
+def _calamine_merged_ranges(sheet) -> list:
+    """merged cells листа calamine в формате _xlsx_merged_ranges (1-based).
+
+    Старые версии python-calamine диапазоны не отдают — тогда пусто.
     """
-    try:
-        wb = openpyxl.load_workbook(filepath)
-        ws = wb.active
+    ranges = getattr(sheet, "merged_cell_ranges", None) or []
+    return [
+        (min_col + 1, min_row + 1, max_col + 1, max_row + 1)
+        for (min_row, min_col), (max_row, max_col) in ranges
+    ]
 
-        merged_list = list(ws.merged_cells.ranges)
 
-        if not merged_list:
-            wb.close()
-            return filepath  # Нет merged cells — возвращаем оригинал
+def _calamine_rows(filepath: Path, sheet_name: Optional[str] = None):
+    """Строки листа через calamine с A1 — как iter_rows(values_only=True) openpyxl.
 
-        # Есть merged cells — работаем с копией
-        tmp_path = filepath.with_suffix(".normalized.xlsx")
-        shutil.copy2(filepath, tmp_path)
+    skip_empty_area=False сохраняет ведущие пустые строки и колонки: от них
+    зависят номера строк merged cells и определение шапки. Хвостовые пустые
+    ячейки отрезаются — openpyxl тоже отдаёт строку только до последней
+    записанной ячейки. calamine всё равно держит лист в памяти целиком,
+    значения переводятся построчно.
+    """
+    sheet = _calamine_sheet(filepath, sheet_name)
+    if filepath.suffix.lower() in EXCEL_STREAMABLE_SUFFIXES:
+        merged = _xlsx_merged_ranges(filepath, sheet_name)
+    else:
+        merged = _calamine_merged_ranges(sheet)
 
-        wb_tmp = openpyxl.load_workbook(tmp_path)
-        ws_tmp = wb_tmp.active
+    def rows():
+        for raw in sheet.to_python(skip_empty_area=False):
+            row = [_calamine_value(v) for v in raw]
+            while row and row[-1] is None:
+                row.pop()
+            yield tuple(row)
 
-        merged_list_tmp = list(ws_tmp.merged_cells.ranges)
+    return _fill_merged_rows(rows(), merged) if merged else rows()
 
-        # Собираем данные
-        cells_data = []
-        for merged in merged_list_tmp:
-            min_row, min_col, max_row, max_col = merged.bounds
-            value = ws_tmp.cell(row=min_row, column=min_col).value
-            cells_data.append((merged, value, min_row, min_col, max_row, max_col))
 
-        # Разъединяем
-        for merged, _, _, _, _, _ in cells_data:
-            try:
-                ws_tmp.unmerge_cells(str(merged))
-            except Exception:
-                pass
+# ============ EXCEL: ПОТОКОВОЕ ЧТЕНИЕ ============
+
+_MERGE_CELL_RE = re.compile(
+    rb'<(?:\w+:)?mergeCell\b[^>]*?\bref="([A-Z]+[0-9]+(?::[A-Z]+[0-9]+)?)"'
+)
+_DIMENSION_RE = re.compile(rb'<(?:\w+:)?dimension\b[^>]*?\bref="([A-Z]+[0-9]+:[A-Z]+[0-9]+)"')
+
 
-        # Заполняем значениями
-        for _, value, min_row, min_col, max_row, max_col in cells_data:
-            for r in range(min_row, max_row + 1):
-                for c in range(min_col, max_col + 1):
-                    ws_tmp.cell(row=r, column=c, value=value)
+if EXCEL_AVAILABLE:
+    class _ReadOnlySheet(ReadOnlyWorksheet):
+        """ReadOnlyWorksheet, который ищет <dimension> только в начале XML листа.
 
-        wb_tmp.save(tmp_path)
+        Штатный _get_size при отсутствии <dimension> (его не пишут write-only
+        книги, в том числе наши excel_create / excel_from_csv) разбирает лист
+        целиком — и так для каждого листа при каждой загрузке книги.
+        Диапазон из одной ячейки ("A1") считается неизвестным.
+        """
+
+        def _get_size(self):
+            with self._get_source() as src:
+                head = src.read(64 * 1024)
+            m = _DIMENSION_RE.search(head)
+            if m:
+                self._min_column, self._min_row, self._max_column, self._max_row = \
+                    range_boundaries(m.group(1).decode("ascii"))
+
+    class _ReadOnlyReader(ExcelReader):
+        """ExcelReader для read_only-загрузки с листами _ReadOnlySheet."""
+
+        def read_worksheets(self):
+            for sheet, rel in self.parser.find_sheets():
+                if rel.target not in self.valid_files:
+                    continue
+                if "chartsheet" in rel.Type:
+                    self.read_chartsheet(sheet, rel)
+                    continue
+                ws = _ReadOnlySheet(self.wb, sheet.name, rel.target, self.shared_strings)
+                ws.sheet_state = sheet.state
+                self.wb._sheets.append(ws)
+
+
+def _load_read_only(filepath: Path):
+    """Книга в режиме read_only + data_only (значения формул из кэша файла)."""
+    reader = _ReadOnlyReader(filepath, read_only=True, data_only=True, keep_links=False)
+    reader.read()
+    return reader.wb
+
+
+def _xlsx_sheet_members(filepath: Path) -> Dict[str, str]:
+    """Имена листов → пути XML внутри xlsx-архива (в порядке книги)."""
+    with zipfile.ZipFile(filepath) as zf:
+        wb_xml = ET.fromstring(zf.read("xl/workbook.xml"))
+        rels_xml = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+
+    targets = {rel.get("Id"): rel.get("Target", "") for rel in rels_xml}
+
+    members: Dict[str, str] = {}
+    for el in wb_xml.iter():
+        if not el.tag.endswith("}sheet"):
+            continue
+        rel_id = next((v for k, v in el.attrib.items() if k.endswith("}id")), None)
+        target = targets.get(rel_id, "")
+        if not target:
+            continue
+        # Target бывает относительным ("worksheets/sheet1.xml") или абсолютным ("/xl/...")
+        member = target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+        members[el.get("name")] = member
+    return members
+
+
+def _xlsx_sheet_member(filepath: Path, sheet_name: Optional[str] = None) -> str:
+    """Путь XML листа внутри архива. Без sheet_name — первый лист."""
+    members = _xlsx_sheet_members(filepath)
+    if not members:
+        raise ValueError(f"В книге {filepath.name} нет листов")
+    if sheet_name is None:
+        return next(iter(members.values()))
+    if sheet_name not in members:
+        raise ValueError(
+            f"Лист не найден: {sheet_name}. Доступные листы: {', '.join(members)}"
+        )
+    return members[sheet_name]
+
+
+def _xlsx_merged_ranges(filepath: Path, sheet_name: Optional[str] = None) -> list:
+    """Диапазоны merged cells листа: [(min_col, min_row, max_col, max_row), ...].
+
+    Не загружает книгу: сканирует сырой XML листа регуляркой кусками по 1 MB,
+    поэтому память не зависит от размера листа.
+    """
+    member = _xlsx_sheet_member(filepath, sheet_name)
+    ranges = []
+    tail = b""
+    with zipfile.ZipFile(filepath) as zf, zf.open(member) as fh:
+        while True:
+            chunk = fh.read(1 << 20)
+            if not chunk:
+                break
+            buf = tail + chunk
+            last_end = 0
+            for m in _MERGE_CELL_RE.finditer(buf):
+                ranges.append(range_boundaries(m.group(1).decode("ascii")))
+                last_end = m.end()
+            # Хвост на случай, если тег разрезан границей чанка
+            tail = buf[max(last_end, len(buf) - 512):]
+    return ranges
+
+
+def _fill_merged_rows(rows, merged_ranges):
+    """Заполняет merged cells значением левой верхней ячейки на лету.
+
+    Диапазоны превращаются в карту «строка начала → диапазоны»; значение
+    якоря берётся, когда поток доходит до первой строки диапазона, и
+    протягивается вниз/вправо до его конца. Память — O(число диапазонов).
+    """
+    starts: Dict[int, list] = {}
+    for min_col, min_row, max_col, max_row in merged_ranges:
+        starts.setdefault(min_row, []).append((min_col, max_col, max_row))
+
+    active = []  # (min_col, max_col, max_row, value)
+    for row_idx, row in enumerate(rows, 1):
+        for min_col, max_col, max_row in starts.pop(row_idx, ()):
+            value = row[min_col - 1] if min_col - 1 < len(row) else None
+            active.append((min_col, max_col, max_row, value))
+
+        if active:
+            row = list(row)
+            width = max(a[1] for a in active)
+            if len(row) < width:
+                row.extend([None] * (width - len(row)))
+            for min_col, max_col, _, value in active:
+                row[min_col - 1:max_col] = [value] * (max_col - min_col + 1)
+            row = tuple(row)
+            active = [a for a in active if a[2] > row_idx]
+
+        yield row
+
+
+def _iter_sheet_rows(filepath: Path, sheet_name: Optional[str] = None):
+    """Потоковые строки листа (кортежи значений) с заполненными merged cells."""
+    if _reader_engine(filepath) == "calamine":
+        yield from _calamine_rows(filepath, sheet_name)
+        return
+    merged = _xlsx_merged_ranges(filepath, sheet_name)
+    wb = _load_read_only(filepath)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+        # Как и pandas, не доверяем <dimension> при полном чтении
+        ws.reset_dimensions()
+        rows = ws.iter_rows(values_only=True)
+        yield from (_fill_merged_rows(rows, merged) if merged else rows)
+    finally:
         wb.close()
-        wb_tmp.close()
-        return tmp_path
 
-    except Exception as e:
-        logger.warning(f"Предупреждение при нормализации: {e}")
-        return filepath  # Возвращаем оригинал если что-то пошло не так
+
+def _sheet_frame(filepath: Path, sheet_name: Optional[str] = None, skiprows: int = 0) -> "pd.DataFrame":
+    """DataFrame из потока строк листа (без заголовка, пустые строки отброшены)."""
+    records = [
+        row for row_idx, row in enumerate(_iter_sheet_rows(filepath, sheet_name))
+        if row_idx >= skiprows and not _is_empty_row(row)
+    ]
+    return pd.DataFrame.from_records(records) if records else pd.DataFrame()
 
 
-def _cleanup_normalized(tmp_path: Path, original_path: Path) -> None:
-    """Удаляет временный нормализованный файл, если он отличается от оригинала."""
-    if tmp_path != original_path and tmp_path.exists():
-        try:
-            tmp_path.unlink()
-        except Exception:
-            pass
+def _dedupe_headers(values) -> list:
+    """Имена колонок по правилам pandas: пустые → "Unnamed: i", дубли → "X.1"."""
+    headers = []
+    seen: Dict[str, int] = {}
+    for idx, value in enumerate(values):
+        name = str(value).strip() if value is not None and str(value).strip() else f"Unnamed: {idx}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        headers.append(name)
+    return headers
 
 
-@tool
-def excel_create(filename: str, data: str, sheet_name: str = "Sheet1") -> str:
-    """Создать Excel файл с данными.
+def _is_empty_row(row) -> bool:
+    return all(v is None or v == "" for v in row)
 
-    Args:
-        filename: Имя файла (будет создан в outputs/)
-        data: JSON-массив строк, например: [["Имя", "Возраст"], ["Анна", 25]]
-        sheet_name: Имя листа (по умолчанию Sheet1)
+
+def _stream_sheet_summary(
+    filepath: Path,
+    sheet_name: Optional[str] = None,
+    preview_rows: int = EXCEL_PREVIEW_ROWS,
+) -> Dict[str, Any]:
+    """Превью, колонки и число строк листа за один потоковый проход.
+
+    Книга открывается в режиме read_only, строки идут через
+    iter_rows(values_only=True), в памяти держатся только первые
+    preview_rows строк. Merged cells заполняются на лету. Для больших листов (XML > EXCEL_EXACT_COUNT_MAX_BYTES)
+    проход останавливается после превью, а число строк берётся из <dimension>.
+    calamine разбирает лист целиком сразу, поэтому с ним счёт всегда точный.
     """
-    if not EXCEL_AVAILABLE:
-        return "Ошибка: openpyxl не установлен"
+    if _reader_engine(filepath) == "calamine":
+        title = sheet_name or _sheet_names(filepath)[0]
+        return _summarize_rows(_iter_sheet_rows(filepath, sheet_name), title, True, None, preview_rows)
 
+    member = _xlsx_sheet_member(filepath, sheet_name)
+    with zipfile.ZipFile(filepath) as zf:
+        xml_size = zf.getinfo(member).file_size
+    merged = _xlsx_merged_ranges(filepath, sheet_name)
+
+    wb = _load_read_only(filepath)
     try:
-        rows = json.loads(data)
-        wb = openpyxl.Workbook()
-        ws = wb.active
-        ws.title = sheet_name
-
-        for row_idx, row_data in enumerate(rows, 1):
-            for col_idx, value in enumerate(row_data, 1):
-                ws.cell(row=row_idx, column=col_idx, value=value)
-
-        # Автоширина колонок
-        for column in ws.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column)
-            for cell in column:
-                if cell.value:
-                    max_length = max(max_length, len(str(cell.value)))
-            ws.column_dimensions[column_letter].width = min(max_length + 2, 50)
+        ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+        # Без <dimension> (max_row is None) приблизительная оценка невозможна
+        dim_rows = ws.max_row
+        exact = dim_rows is None or xml_size <= EXCEL_EXACT_COUNT_MAX_BYTES
+        ws.reset_dimensions()
+
+        rows = ws.iter_rows(values_only=True)
+        if merged:
+            rows = _fill_merged_rows(rows, merged)
+        return _summarize_rows(rows, ws.title, exact, dim_rows, preview_rows)
+    finally:
+        wb.close()
 
-        filepath = OUTPUT_DIR / filename
-        wb.save(filepath)
-        return f"✓ Excel создан: {filepath} ({len(rows)} строк)"
-    except json.JSONDecodeError as e:
-        return f"Ошибка парсинга JSON data: {e}"
-    except Exception as e:
-        return f"Ошибка: {e}"
 
+def _summarize_rows(rows, title: str, exact: bool, dim_rows: Optional[int],
+                    preview_rows: int) -> Dict[str, Any]:
+    """Сводка по потоку строк листа (см. _stream_sheet_summary).
 
-@tool
-def excel_add_formulas(filename: str, formulas: str) -> str:
-    """Добавить формулы в Excel.
+    exact=False — проход останавливается после превью, число строк
+    оценивается по dim_rows.
+    """
+    header = None
+    header_row_idx = 0
+    preview = []
+    has_data: list = []
+    n_rows = 0
+
+    for row_idx, row in enumerate(rows, 1):
+        if _is_empty_row(row):
+            continue
+        if header is None:
+            header = list(row)
+            header_row_idx = row_idx
+            has_data = [False] * len(header)
+            continue
+
+        n_rows += 1
+        if len(row) > len(has_data):
+            has_data.extend([False] * (len(row) - len(has_data)))
+        for col_idx, value in enumerate(row):
+            if value is not None and value != "":
+                has_data[col_idx] = True
+
+        if len(preview) < preview_rows:
+            preview.append(row)
+        elif not exact:
+            break
+
+    if header is None:
+        return {"sheet": title, "columns": [], "preview": pd.DataFrame(),
+                "rows": 0, "exact": True}
+
+    width = max(len(has_data), len(header))
+    header = header + [None] * (width - len(header))
+    has_data = has_data + [False] * (width - len(has_data))
+
+    # Аналог dropna(axis=1, how="all"): в точном режиме — по всем строкам,
+    # в приблизительном — по превью (колонки с заголовком сохраняем)
+    keep = [
+        i for i in range(width)
+        if has_data[i] or (not exact and header[i] not in (None, ""))
+    ]
+    columns = _dedupe_headers(header)
+    columns = [columns[i] for i in keep]
 
-    Args:
-        filename: Имя файла
-        formulas: JSON-массив, например: [{"cell": "C2", "formula": "=A2+B2"}]
+    preview_df = pd.DataFrame(
+        [[(row[i] if i < len(row) else None) for i in keep] for row in preview],
+        columns=columns,
+    )
+
+    rows = n_rows if exact else max(dim_rows - header_row_idx, n_rows)
+    return {"sheet": title, "columns": columns, "preview": preview_df,
+            "rows": rows, "exact": exact}
+
+
+# ============ EXCEL: КЭШ КНИГ И ТАБЛИЦ ============
+
+class _WorkbookCache:
+    """Процессный LRU-кэш загруженных книг openpyxl и разобранных DataFrame.
+
+    Ключ записи — (путь, mtime, size, вид, вариант): после любого изменения
+    файла на диске старые записи перестают совпадать и вытесняются.
+    Объём оценивается грубо (книга — по размеру XML листов, DataFrame —
+    по memory_usage), при превышении бюджета вытесняются самые старые.
+    Закэшированные DataFrame общие для всех инструментов — их нельзя
+    изменять на месте.
     """
-    if not EXCEL_AVAILABLE:
-        return "Ошибка: openpyxl не установлен"
 
+    def __init__(self, budget_bytes: int):
+        self.budget = budget_bytes
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (obj, nbytes)
+        self._lock = threading.RLock()
+        self._path_locks: Dict[str, threading.RLock] = {}
+
+    @staticmethod
+    def _stamp(filepath: Path) -> tuple:
+        st = filepath.stat()
+        return (str(filepath.resolve()), st.st_mtime_ns, st.st_size)
+
+    def path_lock(self, filepath: Path) -> threading.RLock:
+        """Лок на файл: инструменты могут вызываться из параллельных потоков."""
+        with self._lock:
+            return self._path_locks.setdefault(str(filepath.resolve()), threading.RLock())
+
+    def stats(self) -> str:
+        return (
+            f"hits={self.hits}, misses={self.misses}, evictions={self.evictions}, "
+            f"{self.used / (1024 * 1024):.1f}/{self.budget / (1024 * 1024):.0f} MB"
+        )
+
+    def _get(self, key: tuple, label: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                logger.info(f"Кэш Excel: hit {label} ({self.stats()})")
+                return entry[0]
+            self.misses += 1
+            logger.info(f"Кэш Excel: miss {label} ({self.stats()})")
+            return None
+
+    def _put(self, key: tuple, obj, nbytes: int) -> None:
+        with self._lock:
+            # Записи этого же файла с другим mtime/size устарели
+            self._drop(lambda k: k[0] == key[0] and k[1:3] != key[1:3])
+            if key in self._entries:
+                self.used -= self._entries.pop(key)[1]
+            if nbytes > self.budget:
+                return  # Не влезает в бюджет целиком — не кэшируем
+            self._entries[key] = (obj, nbytes)
+            self.used += nbytes
+            while self.used > self.budget and self._entries:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.used -= evicted
+                self.evictions += 1
+
+    def _drop(self, predicate) -> None:
+        for key in [k for k in self._entries if predicate(k)]:
+            self.used -= self._entries.pop(key)[1]
+
+    def get_workbook(self, filepath: Path):
+        """Книга для редактирования (полная загрузка, формулы как текст)."""
+        stamp = self._stamp(filepath)
+        key = stamp + ("workbook", None)
+        wb = self._get(key, f"{filepath.name} [workbook]")
+        if wb is None:
+            wb = openpyxl.load_workbook(filepath)
+            self._put(key, wb, _estimate_workbook_bytes(filepath))
+        return wb
+
+    def get_frame(self, filepath: Path, variant: tuple, loader):
+        """Результат loader() (DataFrame или словарь с DataFrame), закэшированный по variant."""
+        stamp = self._stamp(filepath)
+        key = stamp + ("frame", variant)
+        value = self._get(key, f"{filepath.name} {variant}")
+        if value is None:
+            value = loader()
+            self._put(key, value, _estimate_frame_bytes(value))
+        return value
+
+    def contains(self, filepath: Path, variant: tuple) -> bool:
+        """Есть ли актуальная запись (без учёта в счётчиках hit/miss)."""
+        with self._lock:
+            return self._stamp(filepath) + ("frame", variant) in self._entries
+
+    def save_workbook(self, wb, filepath: Path, after_save=None) -> None:
+        """Сохраняет книгу и перекладывает её в кэш под новым ключом (write-through).
+
+        after_save(filepath) вызывается до перевыставления ключа — для
+        доработки файла после openpyxl (значения формул).
+        """
+        wb.save(filepath)
+        if after_save is not None:
+            after_save(filepath)
+        with self._lock:
+            self.invalidate(filepath)
+            self._put(self._stamp(filepath) + ("workbook", None), wb, _estimate_workbook_bytes(filepath))
+
+    def invalidate(self, filepath: Path) -> None:
+        path = str(Path(filepath).resolve())
+        with self._lock:
+            self._drop(lambda k: k[0] == path)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.used = 0
+
+
+# Во сколько раз книга openpyxl в памяти больше распакованного XML листов
+_WORKBOOK_MEMORY_FACTOR = 8
+
+
+def _estimate_workbook_bytes(filepath: Path) -> int:
     try:
-        filepath = _resolve_file(filename)
-        if not filepath:
-            return f"Файл не найден: {filename}"
+        with zipfile.ZipFile(filepath) as zf:
+            xml_size = sum(
+                info.file_size for info in zf.infolist()
+                if info.filename.startswith("xl/worksheets/")
+            )
+        return xml_size * _WORKBOOK_MEMORY_FACTOR
+    except (zipfile.BadZipFile, OSError):
+        return filepath.stat().st_size * _WORKBOOK_MEMORY_FACTOR
 
-        wb = openpyxl.load_workbook(filepath)
-        ws = wb.active
 
-        formula_list = json.loads(formulas)
-        for item in formula_list:
-            ws[item["cell"]] = item["formula"]
+def _estimate_frame_bytes(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, dict):
+        return sum(_estimate_frame_bytes(v) for v in value.values()) + 1024
+    return 1024
 
-        wb.save(filepath)
-        return f"✓ Добавлено {len(formula_list)} формул в {filepath.name}"
-    except json.JSONDecodeError as e:
-        return f"Ошибка парсинга JSON formulas: {e}"
-    except Exception as e:
-        return f"Ошибка: {e}"
 
+_workbook_cache = _WorkbookCache(EXCEL_CACHE_BUDGET_BYTES)
 
-@tool
-def excel_style(filename: str, styles: str) -> str:
-    """Применить стили к Excel.
 
-    Args:
-        filename: Имя файла
-        styles: JSON со стилями. Поддерживаемые ключи:
-            header_row (int), header_color (hex), header_font_color (hex),
-            freeze_panes (str, напр. "A2"), borders (bool)
+@contextmanager
+def _editing_workbook(filepath: Path):
+    """Книга из кэша для изменения. При ошибке запись сбрасывается,
+    чтобы частично изменённая книга не досталась следующему инструменту."""
+    with _workbook_cache.path_lock(filepath):
+        wb = _workbook_cache.get_workbook(filepath)
+        try:
+            yield wb
+        except Exception:
+            _workbook_cache.invalidate(filepath)
+            raise
+
+
+# ============ КОЛОНОЧНЫЙ КЭШ (Feather) ============
+
+_content_hashes: Dict[tuple, str] = {}
+
+
+def _content_hash(filepath: Path) -> str:
+    """Хэш содержимого файла (запоминается по пути, mtime и размеру)."""
+    st = filepath.stat()
+    key = (str(filepath.resolve()), st.st_mtime_ns, st.st_size)
+    digest = _content_hashes.get(key)
+    if digest is None:
+        h = hashlib.blake2b(digest_size=16)
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        _content_hashes[key] = digest
+    return digest
+
+
+class _FrameStore:
+    """Дисковый кэш разобранных таблиц в формате Feather.
+
+    Первый разбор листа/CSV сохраняется рядом в CACHE_DIR/frames под ключом
+    «хэш содержимого + вариант чтения», последующие чтения отображают файл
+    в память (memory_map) вместо медленного pd.read_excel. Размер каталога
+    ограничен max_bytes, вытесняются давно не читавшиеся файлы (по mtime).
     """
-    if not EXCEL_AVAILABLE:
-        return "Ошибка: openpyxl не установлен"
 
-    try:
-        filepath = _resolve_file(filename)
-        if not filepath:
-            return f"Файл не найден: {filename}"
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
 
-        wb = openpyxl.load_workbook(filepath)
-        ws = wb.active
+    # Меняется при смене формата хранимых таблиц — старые записи просто не находятся
+    FORMAT_VERSION = 2
 
-        style_dict = json.loads(styles)
+    def _path_for(self, filepath: Path, variant: tuple) -> Path:
+        key = repr((self.FORMAT_VERSION, variant)).encode("utf-8")
+        variant_key = hashlib.blake2b(key, digest_size=8).hexdigest()
+        return self.root / f"{_content_hash(filepath)}-{variant_key}.feather"
 
-        if "header_row" in style_dict:
-            header_row = style_dict["header_row"]
-            bg_color = style_dict.get("header_color", "4472C4")
-            font_color = style_dict.get("header_font_color", "FFFFFF")
+    def has(self, filepath: Path, variant: tuple) -> bool:
+        return ARROW_AVAILABLE and self._path_for(filepath, variant).exists()
 
-            for cell in ws[header_row]:
-                cell.font = Font(bold=True, color=font_color)
-                cell.fill = PatternFill(start_color=bg_color, end_color=bg_color, fill_type="solid")
-                cell.alignment = Alignment(horizontal="center", vertical="center")
+    def sidecar_path(self, filepath: Path, name: str) -> Path:
+        """Путь для вспомогательного файла кэша (индексы) того же содержимого."""
+        return self.root / f"{_content_hash(filepath)}-{name}"
 
-        if "freeze_panes" in style_dict:
-            ws.freeze_panes = style_dict["freeze_panes"]
+    def load(self, filepath: Path, variant: tuple, loader, columns: Optional[list] = None) -> "pd.DataFrame":
+        """DataFrame из кэша или loader(). columns — прочитать из кэша только эти колонки.
 
-        if style_dict.get("borders", False):
-            thin_border = Border(
-                left=Side(style='thin'), right=Side(style='thin'),
-                top=Side(style='thin'), bottom=Side(style='thin')
-            )
-            for row in ws.iter_rows():
-                for cell in row:
-                    cell.border = thin_border
+        С columns loader() возвращает ту же проекцию, поэтому в кэш полного
+        варианта его результат не сохраняется.
+        """
+        if not ARROW_AVAILABLE:
+            return loader()
 
-        wb.save(filepath)
-        return f"✓ Стили применены к {filepath.name}"
-    except Exception as e:
-        return f"Ошибка: {e}"
+        cached = self._path_for(filepath, variant)
+        if cached.exists():
+            try:
+                df = pa_feather.read_table(cached, columns=columns, memory_map=True).to_pandas()
+                os.utime(cached)  # LRU: отмечаем использование
+                logger.info(f"Кэш Feather: hit {filepath.name} {variant}")
+                return df
+            except Exception as e:
+                logger.warning(f"Кэш Feather повреждён, перечитываю {filepath.name}: {e}")
+                cached.unlink(missing_ok=True)
 
+        df = loader()
+        if columns is None:
+            self._store(df, cached, filepath)
+        return df
 
-@tool
-def excel_read(filename: str, sheet_name: str = None) -> str:
-    """Чтение Excel с автоматической обработкой merged cells.
+    def _store(self, df: "pd.DataFrame", cached: Path, filepath: Path) -> None:
+        if not all(isinstance(c, str) for c in df.columns):
+            return  # Feather требует строковые имена колонок
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = cached.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+            df.reset_index(drop=True).to_feather(tmp, compression="uncompressed")
+            os.replace(tmp, cached)
+            logger.info(f"Кэш Feather: сохранён {filepath.name} ({cached.stat().st_size / 1024:.0f} KB)")
+        except Exception as e:
+            # Смешанные типы в object-колонке и т.п. — просто не кэшируем
+            logger.info(f"Кэш Feather: {filepath.name} не кэшируется ({e})")
+            for leftover in self.root.glob("*.tmp"):
+                leftover.unlink(missing_ok=True)
+            return
+        self.evict()
+
+    def _files(self) -> list:
+        if not self.root.exists():
+            return []
+        return [p for p in self.root.iterdir() if p.is_file() and p.suffix in (".feather", ".npz", ".json")]
+
+    def evict(self) -> None:
+        with self._lock:
+            files = sorted(self._files(), key=lambda p: p.stat().st_mtime)
+            total = sum(p.stat().st_size for p in files)
+            while files and total > self.max_bytes:
+                oldest = files.pop(0)
+                total -= oldest.stat().st_size
+                oldest.unlink(missing_ok=True)
+
+    def usage(self) -> tuple:
+        files = self._files()
+        return len(files), sum(p.stat().st_size for p in files)
+
+    def clear(self) -> int:
+        files = self._files()
+        for p in files:
+            p.unlink(missing_ok=True)
+        return len(files)
+
+
+_frame_store = _FrameStore(CACHE_DIR / "frames", FRAME_CACHE_MAX_BYTES)
+
+
+def _cached_frame(filepath: Path, variant: tuple, loader) -> "pd.DataFrame":
+    """DataFrame из памяти (LRU), затем из Feather-кэша, затем через loader().
+
+    Результат loader() типизируется (_compact_frame) до попадания в кэши.
+    """
+    return _workbook_cache.get_frame(
+        filepath, variant,
+        lambda: _frame_store.load(filepath, variant, lambda: _compact_frame(loader(), filepath.name)),
+    )
 
-    Args:
-        filename: Имя файла (ищет в outputs/, work/ и по абсолютному пути)
-        sheet_name: Имя листа (опционально, по умолчанию — первый)
+
+def frame_cache_usage(clear: bool = False) -> str:
+    """Сводка по кэшам таблиц для команды /cache в GUI."""
+    if clear:
+        removed = _frame_store.clear()
+        _workbook_cache.clear()
+        return f"🧹 Кэш таблиц очищен: удалено файлов {removed}"
+
+    files, size = _frame_store.usage()
+    lines = [
+        f"💾 Кэш таблиц (Feather): {files} файлов, "
+        f"{size / (1024 * 1024):.1f} / {FRAME_CACHE_MAX_BYTES / (1024 * 1024):.0f} MB",
+        f"📁 {_frame_store.root}",
+        f"🧠 В памяти: {_workbook_cache.stats()}",
+        f"🗂 Каталог таблиц: {_catalog.usage()}",
+    ]
+    if _compaction_totals["frames"]:
+        lines.append(
+            f"🗜 Типизация таблиц: {_compaction_totals['frames']} шт., "
+            f"{_memory_report(_compaction_totals['before'], _compaction_totals['after'])}"
+        )
+    if not ARROW_AVAILABLE:
+        lines.append("⚠️ pyarrow не установлен — дисковый кэш отключён (pip install pyarrow)")
+    return "\n".join(lines)
+
+
+# ============ EXCEL: ИНДЕКС СТРОК ============
+#
+# Индекс строк листа по сырому XML внутри xlsx: за один проход
+# запоминаются смещения начала каждой <row> в распакованном потоке,
+# строки и колонки со значениями, таблица общих строк и стили дат.
+# Страница читается распаковкой только нужного участка. Индекс
+# (смещения, строки с данными, колонки, merged cells) сохраняется
+# в CACHE_DIR/frames рядом с Feather-кэшем того же файла.
+#
+# Контрольные точки zlib (копии decompressobj с позицией в сжатом потоке)
+# живут только в памяти процесса: стандартный zlib не умеет начать
+# распаковку deflate с произвольного бита, поэтому после перезапуска
+# первая страница распаковывает поток от начала (без разбора XML), и
+# точки набираются заново.
+
+ROW_INDEX_CHECKPOINT_BYTES = 8 * 1024 * 1024
+ROW_INDEX_MEMORY_ENTRIES = 8
+_ZIP_READ_CHUNK = 256 * 1024
+_ROW_INDEX_VERSION = 2
+
+_ROW_START_RE = re.compile(rb'<(?:\w+:)?row\b([^>]*)>')
+# Ячейка со значением: (буквы из r, тип t, текст <v>); <is> — встроенная строка.
+# Excel и openpyxl пишут <c r="A1" s=".." t=".."> — для них регулярка проще
+# и вдвое быстрее, общая (префиксы, любой порядок атрибутов) — для остальных
+_CELL_START_RE = re.compile(rb'<(?:\w+:)?c\b')
+_VALUE_CELL_FAST_RE = re.compile(
+    rb'<c r="([A-Z]+)\d+"(?: s="\d+")?(?: t="(\w+)")?[^>]*?(?<!/)>'
+    rb'(?:<f\b[^>]*?(?:/>|>[^<]*</f>))?<(?:v>([^<]+)<|is>)'
+)
+_VALUE_CELL_RE = re.compile(
+    rb'<(?:\w+:)?c\b(?:(?=[^>]*?\br="([A-Z]*))|)(?:(?=[^>]*?\bt="(\w+)")|)[^>]*?(?<!/)>\s*'
+    rb'(?:<(?:\w+:)?f\b[^>]*?(?:/>|>[^<]*</(?:\w+:)?f>)\s*)?'
+    rb'(?:<(?:\w+:)?v(?:\s[^>]*)?>([^<]+)<|<(?:\w+:)?is>)'
+)
+_ROW_NUMBER_RE = re.compile(rb'\br="(\d+)"')
+_SHEET_DATA_RE = re.compile(rb'<((?:\w+:)?)sheetData\b[^>]*?(/?)>')
+_SHEET_DATA_END_RE = re.compile(rb'</(?:\w+:)?sheetData>')
+_ROOT_TAG_RE = re.compile(rb'<((?:\w+:)?worksheet)\b[^>]*>')
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+class _ZipMemberStream:
+    """Распакованное содержимое члена zip-архива с произвольного смещения.
+
+    Сжатые данные читаются из файла напрямую и распаковываются zlib;
+    каждые ROW_INDEX_CHECKPOINT_BYTES распакованных байт запоминается
+    копия состояния распаковщика, чтобы следующее чтение начиналось с
+    ближайшей точки, а не с начала потока.
     """
-    if not EXCEL_AVAILABLE:
-        return "Ошибка: openpyxl / pandas не установлен"
 
-    try:
-        filepath = _resolve_file(filename)
-        if not filepath:
-            return f"Файл не найден: {filename} (проверены: outputs/, work/)"
+    def __init__(self, filepath: Path, member: str):
+        with zipfile.ZipFile(filepath) as zf:
+            info = zf.getinfo(member)
+        if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ValueError(f"Неподдерживаемое сжатие листа: {info.compress_type}")
+        with open(filepath, "rb") as fh:
+            fh.seek(info.header_offset)
+            local_header = fh.read(30)
+        name_len, extra_len = struct.unpack("<HH", local_header[26:30])
+
+        self.filepath = filepath
+        self.data_offset = info.header_offset + 30 + name_len + extra_len
+        self.stored = info.compress_type == zipfile.ZIP_STORED
+        self.compressed_size = info.compress_size
+        self.size = info.file_size
+        self.checkpoints = [(0, 0, None)]   # (распакованное смещение, сжатое смещение, распаковщик)
+        self._lock = threading.Lock()
+
+    def chunks(self, start: int = 0):
+        """Генератор (смещение, байты) от ближайшей контрольной точки не дальше start."""
+        if self.stored:
+            with open(self.filepath, "rb") as fh:
+                fh.seek(self.data_offset + start)
+                pos = start
+                while pos < self.size:
+                    data = fh.read(min(_ZIP_READ_CHUNK, self.size - pos))
+                    if not data:
+                        return
+                    yield pos, data
+                    pos += len(data)
+            return
+
+        with self._lock:
+            idx = bisect.bisect_right([c[0] for c in self.checkpoints], start) - 1
+            dec_pos, comp_pos, snapshot = self.checkpoints[idx]
+            decomp = snapshot.copy() if snapshot is not None else zlib.decompressobj(-15)
+
+        with open(self.filepath, "rb") as fh:
+            fh.seek(self.data_offset + comp_pos)
+            last_checkpoint = dec_pos
+            while comp_pos < self.compressed_size:
+                raw = fh.read(min(_ZIP_READ_CHUNK, self.compressed_size - comp_pos))
+                if not raw:
+                    break
+                comp_pos += len(raw)
+                data = decomp.decompress(raw)
+                if data:
+                    yield dec_pos, data
+                    dec_pos += len(data)
+                if dec_pos - last_checkpoint >= ROW_INDEX_CHECKPOINT_BYTES:
+                    last_checkpoint = dec_pos
+                    with self._lock:
+                        if dec_pos > self.checkpoints[-1][0]:
+                            self.checkpoints.append((dec_pos, comp_pos, decomp.copy()))
+            tail = decomp.flush()
+            if tail:
+                yield dec_pos, tail
+
+    def next_checkpoint_after(self, pos: int) -> int:
+        """Ближайшая контрольная точка правее pos (или -1)."""
+        if self.stored:
+            return pos + 1
+        for dec_pos, _, _ in self.checkpoints:
+            if dec_pos > pos:
+                return dec_pos
+        return -1
+
+
+class _WorkbookStrings:
+    """Общие строки (sharedStrings.xml) и номера стилей-дат книги."""
+
+    def __init__(self, strings: list, date_styles: set):
+        self.strings = strings
+        self.date_styles = date_styles
+
+    @classmethod
+    def parse(cls, filepath: Path) -> "_WorkbookStrings":
+        strings, date_styles = [], set()
+        with zipfile.ZipFile(filepath) as zf:
+            names = set(zf.namelist())
+            if "xl/sharedStrings.xml" in names:
+                with zf.open("xl/sharedStrings.xml") as fh:
+                    for _, elem in ET.iterparse(fh):
+                        if _local_name(elem.tag) == "si":
+                            # rPh — фонетические подсказки, в значение не входят
+                            parts = [
+                                t.text or "" for t in elem.iter()
+                                if _local_name(t.tag) == "t"
+                            ]
+                            phonetic = {
+                                id(t) for ph in elem.iter() if _local_name(ph.tag) == "rPh"
+                                for t in ph.iter() if _local_name(t.tag) == "t"
+                            }
+                            if phonetic:
+                                parts = [t.text or "" for t in elem.iter()
+                                         if _local_name(t.tag) == "t" and id(t) not in phonetic]
+                            strings.append("".join(parts))
+                            elem.clear()
+            if "xl/styles.xml" in names:
+                root = ET.fromstring(zf.read("xl/styles.xml"))
+                custom = {}
+                for elem in root.iter():
+                    if _local_name(elem.tag) == "numFmt":
+                        custom[int(elem.get("numFmtId"))] = elem.get("formatCode", "")
+                for elem in root.iter():
+                    if _local_name(elem.tag) == "cellXfs":
+                        for xf_id, xf in enumerate(x for x in elem if _local_name(x.tag) == "xf"):
+                            fmt_id = int(xf.get("numFmtId", 0))
+                            code = custom.get(fmt_id, BUILTIN_FORMATS.get(fmt_id, ""))
+                            if code and is_date_format(code):
+                                date_styles.add(xf_id)
+        return cls(strings, date_styles)
+
+    def save(self, path: Path) -> None:
+        tmp = path.with_suffix(f".{uuid.uuid4().hex[:8]}.tmp")
+        tmp.write_text(
+            json.dumps({"strings": self.strings, "date_styles": sorted(self.date_styles)}, ensure_ascii=False),
+            encoding="utf-8",
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "_WorkbookStrings":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        return cls(data["strings"], set(data["date_styles"]))
+
+
+class _SheetRowIndex:
+    """Смещения строк листа в распакованном XML и чтение строк по номеру.
 
-        # Нормализуем merged cells на КОПИИ
-        normalized = _normalize_merged_cells(filepath)
+    starts[i] — начало i-й несамозакрытой <row>, numbers[i] — её номер в листе.
+    data — позиции строк со значениями (первая — заголовок), columns — номера
+    колонок (с 1), где под заголовком есть хоть одно значение. Правила те же,
+    что у сводки листа (_summarize_rows): строки только с оформлением и
+    пустые колонки отбрасываются, merged cells считаются заполненными.
+    """
 
+    def __init__(self, stream: "_ZipMemberStream", starts, numbers, end: int,
+                 root_tag: bytes, merged: list, strings: "_WorkbookStrings",
+                 data=None, columns: Optional[list] = None):
+        self.stream = stream
+        self.starts = starts
+        self.numbers = numbers
+        self.end = end
+        self.root_tag = root_tag
+        self.merged = merged
+        self.strings = strings
+        self.data = data
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    @classmethod
+    def build(cls, stream: "_ZipMemberStream", strings: "_WorkbookStrings") -> "_SheetRowIndex":
+        """Один проход по распакованному XML: регулярки по чанкам, без разбора ячеек."""
+        starts, numbers, merged = [], [], []
+        root_tag, end = b"", None
+        phase = 0                       # 0 — до <sheetData>, 1 — строки, 2 — после
+        carry, carry_pos = b"", 0
+        last_number = 0
+        valued: list = []               # есть ли в строке значения
+        header_seen = False
+        data_letters: set = set()       # колонки со значениями под заголовком
+        pending = None                  # начало содержимого последней <row> в buf
+        empty_strings = {str(i).encode() for i, text in enumerate(strings.strings) if text == ""}
+        cell_re = None
+
+        def close_row(content: bytes) -> None:
+            nonlocal header_seen, cell_re
+            if cell_re is None:
+                first = _CELL_START_RE.search(content)
+                if first is None:
+                    valued.append(False)
+                    return
+                fast = content.startswith(b'<c r="', first.start())
+                cell_re = _VALUE_CELL_FAST_RE if fast else _VALUE_CELL_RE
+            cells = cell_re.findall(content)
+            if empty_strings:
+                cells = [c for c in cells if not (c[1] == b"s" and c[2] in empty_strings)]
+            valued.append(bool(cells))
+            if not cells:
+                return
+            letters = {c[0] for c in cells}
+            if b"" in letters:
+                raise ValueError("ячейки без адреса r — индекс строк не строится")
+            if header_seen:
+                data_letters.update(letters)
+            header_seen = True
+
+        for pos, data in stream.chunks(0):
+            buf = carry + data
+            base = carry_pos
+            scan = 0
+
+            if not root_tag:
+                m = _ROOT_TAG_RE.search(buf)
+                if m:
+                    root_tag = m.group(0)
+            if phase == 0:
+                m = _SHEET_DATA_RE.search(buf)
+                if m:
+                    scan = m.end()
+                    if m.group(2):      # <sheetData/> — лист без строк
+                        phase, end = 2, base + m.end()
+                    else:
+                        phase = 1
+            if phase == 1:
+                m_end = _SHEET_DATA_END_RE.search(buf, scan)
+                limit = m_end.start() if m_end else len(buf)
+                for m in _ROW_START_RE.finditer(buf, scan, limit):
+                    if pending is not None:
+                        close_row(buf[pending:m.start()])
+                        pending = None
+                    num = _ROW_NUMBER_RE.search(m.group(1))
+                    last_number = int(num.group(1)) if num else last_number + 1
+                    if not m.group(1).rstrip().endswith(b"/"):   # <row r="5"/> — пустая строка
+                        starts.append(base + m.start())
+                        numbers.append(last_number)
+                        pending = m.end()
+                    scan = m.end()
+                if m_end:
+                    if pending is not None:
+                        close_row(buf[pending:limit])
+                        pending = None
+                    phase, end = 2, base + m_end.start()
+                    scan = m_end.end()
+            if phase == 2:
+                for m in _MERGE_CELL_RE.finditer(buf, scan):
+                    merged.append(range_boundaries(m.group(1).decode("ascii")))
+                    scan = m.end()
+
+            # Тег может попасть на границу чанка — хвост переносим в следующий;
+            # незакрытая строка переносится целиком, чтобы найти в ней значения
+            cut = pending if pending is not None else max(scan, len(buf) - 4096)
+            carry, carry_pos = buf[cut:], base + cut
+            if pending is not None:
+                pending = 0
+
+        if end is None or not root_tag:
+            raise ValueError("Не найден <sheetData> в XML листа")
+        index = cls(stream, np.asarray(starts, dtype=np.int64), np.asarray(numbers, dtype=np.int64),
+                    end, root_tag, merged, strings)
+        index._layout(np.asarray(valued, dtype=bool),
+                      {column_index_from_string(c.decode("ascii")) for c in data_letters})
+        return index
+
+    def _layout(self, valued, columns: set) -> None:
+        """data и columns с учётом merged cells: непустой якорь заполняет
+        весь диапазон, как в _fill_merged_rows."""
+        data = np.flatnonzero(valued)
+        if len(data) and self.merged:
+            header_number = int(self.numbers[data[0]])
+            anchors = {}
+            for bounds in self.merged:
+                anchor = int(np.searchsorted(self.numbers, bounds[1]))
+                if anchor < len(self.numbers) and int(self.numbers[anchor]) == bounds[1]:
+                    anchors[bounds] = anchor
+            values = self.read_rows(anchors.values())
+            for (min_col, min_row, max_col, max_row), anchor in anchors.items():
+                row = values.get(anchor, [])
+                if min_col > len(row) or row[min_col - 1] in (None, ""):
+                    continue
+                lo, hi = np.searchsorted(self.numbers, [min_row, max_row + 1])
+                if hi - lo != max_row - min_row + 1:
+                    # Строк диапазона нет в XML — их заполнит только полный разбор
+                    raise ValueError("merged cells на строках без <row> — индекс строк не строится")
+                valued[lo:hi] = True
+                if max_row > header_number:
+                    columns.update(range(min_col, max_col + 1))
+            data = np.flatnonzero(valued)
+        self.data = data.astype(np.int64)
+        self.columns = sorted(columns)
+
+    def save(self, path: Path) -> None:
+        meta = {"version": _ROW_INDEX_VERSION, "end": self.end,
+                "root_tag": self.root_tag.decode("utf-8"), "merged": self.merged,
+                "columns": self.columns}
+        tmp = path.with_suffix(f".{uuid.uuid4().hex[:8]}.npz")
+        np.savez(tmp, starts=self.starts, numbers=self.numbers, data=self.data,
+                 meta=np.array(json.dumps(meta)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path, stream: "_ZipMemberStream", strings: "_WorkbookStrings") -> "_SheetRowIndex":
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != _ROW_INDEX_VERSION:
+                raise ValueError("устаревшая версия индекса")
+            return cls(stream, data["starts"], data["numbers"], meta["end"],
+                       meta["root_tag"].encode("utf-8"), [tuple(r) for r in meta["merged"]], strings,
+                       data["data"], meta["columns"])
+
+    # --- чтение строк ---
+
+    def _row_bytes(self, positions: list) -> list:
+        """Сырой XML строк positions (по возрастанию) за один проход распаковки."""
+        n = len(self.starts)
+        result = []
+        buf = bytearray()
+        buf_start = None
+        chunks = None
+        for p in positions:
+            start = int(self.starts[p])
+            stop = int(self.starts[p + 1]) if p + 1 < n else self.end
+            buffered_end = buf_start + len(buf) if buf_start is not None else -1
+            # Далеко впереди есть контрольная точка — перезапускаем распаковку с неё
+            if chunks is None or (buffered_end < start and 0 <= self.stream.next_checkpoint_after(buffered_end) <= start):
+                chunks = self.stream.chunks(start)
+                buf, buf_start = bytearray(), None
+            while buf_start is None or buf_start + len(buf) < stop:
+                pos, data = next(chunks)
+                if buf_start is None:
+                    buf_start = pos
+                buf += data
+                if start > buf_start:
+                    drop = min(start - buf_start, len(buf))
+                    del buf[:drop]
+                    buf_start += drop
+            result.append(bytes(buf[start - buf_start:stop - buf_start]))
+        return result
+
+    def _decode_cell(self, cell) -> Any:
+        kind = cell.get("t", "n")
+        value = None
+        for child in cell:
+            name = _local_name(child.tag)
+            if name == "v":
+                value = child.text
+            elif name == "is":
+                value = "".join(t.text or "" for t in child.iter() if _local_name(t.tag) == "t")
+        if value is None:
+            return None
+        if kind == "s":
+            return self.strings.strings[int(value)]
+        if kind in ("str", "inlineStr", "e"):
+            return value
+        if kind == "b":
+            return value == "1"
+        if kind == "d":
+            return datetime.fromisoformat(value)
+        number = float(value)
+        if int(cell.get("s", 0)) in self.strings.date_styles:
+            return from_excel(number)
+        return int(number) if number.is_integer() and not any(c in value for c in ".eE") else number
+
+    def read_rows(self, positions) -> Dict[int, list]:
+        """{позиция: значения строки с первого столбца} для позиций индекса."""
+        positions = sorted(set(int(p) for p in positions if 0 <= p < len(self.starts)))
+        if not positions:
+            return {}
+        closing = b"</" + _ROOT_TAG_RE.match(self.root_tag).group(1) + b">"
+        root = ET.fromstring(self.root_tag + b"".join(self._row_bytes(positions)) + closing)
+
+        rows = {}
+        for p, row in zip(positions, (r for r in root if _local_name(r.tag) == "row")):
+            values: Dict[int, Any] = {}
+            col = 0
+            for cell in row:
+                if _local_name(cell.tag) != "c":
+                    continue
+                ref = cell.get("r")
+                col = column_index_from_string(ref.rstrip("0123456789")) if ref else col + 1
+                values[col] = self._decode_cell(cell)
+            width = max(values, default=0)
+            rows[p] = [values.get(c) for c in range(1, width + 1)]
+        return rows
+
+    def read_table_rows(self, positions, columns: Optional[list] = None) -> list:
+        """Строки с заполненными merged cells; columns — только эти колонки (с 1)."""
+        positions = [int(p) for p in positions]
+        numbers = {p: int(self.numbers[p]) for p in positions}
+        anchors = {}
+        for bounds in self.merged:
+            min_col, min_row, max_col, max_row = bounds
+            if any(min_row <= n <= max_row for n in numbers.values()):
+                anchor = int(np.searchsorted(self.numbers, min_row))
+                if anchor < len(self.numbers) and int(self.numbers[anchor]) == min_row:
+                    anchors[bounds] = anchor
+
+        rows = self.read_rows(positions + list(anchors.values()))
+
+        out = []
+        for p in positions:
+            row = list(rows.get(p, []))
+            for (min_col, min_row, max_col, max_row), anchor in anchors.items():
+                if min_row <= numbers[p] <= max_row:
+                    source = rows.get(anchor, [])
+                    value = source[min_col - 1] if min_col - 1 < len(source) else None
+                    row += [None] * (max_col - len(row))
+                    row[min_col - 1:max_col] = [value] * (max_col - min_col + 1)
+            if columns is not None:
+                row = [row[c - 1] if c <= len(row) else None for c in columns]
+            out.append(row)
+        return out
+
+
+_row_indexes: "OrderedDict[tuple, _SheetRowIndex]" = OrderedDict()
+_row_indexes_lock = threading.Lock()
+
+
+def _sheet_row_index(filepath: Path, sheet_name: Optional[str] = None) -> "_SheetRowIndex":
+    """Индекс строк листа: из памяти, с диска (CACHE_DIR/frames) или новым проходом."""
+    member = _xlsx_sheet_member(filepath, sheet_name)
+    st = filepath.stat()
+    key = (str(filepath.resolve()), st.st_mtime_ns, st.st_size, member)
+    with _row_indexes_lock:
+        index = _row_indexes.get(key)
+        if index is not None:
+            _row_indexes.move_to_end(key)
+            return index
+
+    stream = _ZipMemberStream(filepath, member)
+    strings_path = _frame_store.sidecar_path(filepath, "strings.json")
+    index_path = _frame_store.sidecar_path(filepath, f"rows-{hashlib.blake2b(member.encode(), digest_size=4).hexdigest()}.npz")
+
+    index = None
+    if index_path.exists() and strings_path.exists():
         try:
-            df = pd.read_excel(normalized, sheet_name=sheet_name or 0, dtype=str)
-            df = df.dropna(how="all").dropna(axis=1, how="all")
+            index = _SheetRowIndex.load(index_path, stream, _WorkbookStrings.load(strings_path))
+            os.utime(index_path)
+            logger.info(f"Индекс строк: загружен {filepath.name} [{member}]")
+        except Exception as e:
+            logger.warning(f"Индекс строк {filepath.name} не читается, строю заново: {e}")
+
+    if index is None:
+        started = time.perf_counter()
+        strings = _WorkbookStrings.parse(filepath)
+        index = _SheetRowIndex.build(stream, strings)
+        try:
+            _frame_store.root.mkdir(parents=True, exist_ok=True)
+            strings.save(strings_path)
+            index.save(index_path)
+            _frame_store.evict()
+        except OSError as e:
+            logger.warning(f"Индекс строк {filepath.name} не сохранён: {e}")
+        logger.info(
+            f"Индекс строк: {filepath.name} [{member}] {len(index)} строк "
+            f"за {time.perf_counter() - started:.1f} сек"
+        )
 
-            preview = df.head(20).to_string(index=False)
-            return (
-                f"Файл: {filepath.name}\n"
-                f"Строк: {len(df)}\n"
-                f"Колонок: {len(df.columns)}\n\n"
-                f"Первые строки:\n{preview}"
-            )
-        finally:
-            _cleanup_normalized(normalized, filepath)
+    with _row_indexes_lock:
+        _row_indexes[key] = index
+        while len(_row_indexes) > ROW_INDEX_MEMORY_ENTRIES:
+            _row_indexes.popitem(last=False)
+    return index
 
-    except Exception as e:
-        return f"Ошибка чтения: {e}"
 
+def _indexed_header(index: "_SheetRowIndex") -> list:
+    """Имена непустых колонок из первой строки со значениями — как в сводке листа."""
+    if not len(index.data) or not index.columns:
+        return []
+    header = index.read_table_rows([index.data[0]])[0]
+    header += [None] * (index.columns[-1] - len(header))
+    names = _dedupe_headers(header)
+    return [names[c - 1] for c in index.columns]
+
+
+def _indexed_page(filepath: Path, sheet_name: Optional[str], offset: int, limit: int) -> tuple:
+    """(страница, всего строк) по индексу строк, без разбора всего листа."""
+    index = _sheet_row_index(filepath, sheet_name)
+    columns = _indexed_header(index)
+    body = index.data[1:]
+    rows = index.read_table_rows(body[offset:offset + limit], index.columns)
+    return pd.DataFrame(rows, columns=columns, index=range(offset, offset + len(rows))), len(body)
+
+
+def _indexed_sample(filepath: Path, sheet_name: Optional[str], size: int, seed: int = 0) -> tuple:
+    """(случайная выборка строк, всего строк) по индексу — один проход распаковки."""
+    index = _sheet_row_index(filepath, sheet_name)
+    columns = _indexed_header(index)
+    body = index.data[1:]
+    total = len(body)
+    if size < total:
+        body = body[sorted(random.Random(seed).sample(range(total), size))]
+    return pd.DataFrame(index.read_table_rows(body, index.columns), columns=columns), total
+
+
+# ============ ТАБЛИЦЫ: ТИПИЗАЦИЯ ============
+
+# Текст с долей уникальных значений не выше порога хранится как category
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+CATEGORY_MIN_ROWS = 50
+
+_LEADING_ZERO_RE = r"^[+-]?0\d"
+_DATE_TEXT_RE = r"^\s*\d{1,4}[-./]\d{1,2}[-./]\d{1,4}(?:[ T]\d{1,2}:\d{2}(?::\d{2})?)?\s*$"
+
+_compaction_totals = {"frames": 0, "before": 0, "after": 0}
+_compaction_lock = threading.Lock()
+
+
+def _compact_numeric(series: "pd.Series") -> "pd.Series":
+    """Целые — в наименьший целый тип, дробные — во float32, только если значения не меняются."""
+    if pd.api.types.is_float_dtype(series) and series.notna().all():
+        if (series == np.floor(series)).all() and series.abs().max() < 2 ** 53:
+            series = series.astype(np.int64)
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer")
+    if pd.api.types.is_float_dtype(series) and series.dtype != np.float32:
+        as32 = series.astype(np.float32)
+        same = (as32.astype(np.float64) == series) | series.isna()
+        if same.all():
+            return as32
+    return series
+
+
+def _infer_column(series: "pd.Series", categories: bool = True) -> "pd.Series":
+    """Тип одной колонки: число, дата, логический, category или текст как есть.
+
+    Таблицы читаются с dtype=object, так что весь вывод типов — здесь.
+    categories=False — без category (для кусков таблицы: у каждого куска
+    был бы свой набор категорий).
+    """
+    if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+        return _compact_numeric(series)
+    if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+        return series
+
+    values = series.dropna()
+    if values.empty:
+        return series
+    text = values.astype(str)
+    kinds = values.map(type).value_counts()
+
+    # Логические — до чисел: to_numeric превратил бы True/False в 1.0/0.0
+    if kinds.index.isin([bool, np.bool_]).all():
+        return series.astype("boolean")
+    if kinds.index.isin([str]).all() and text.str.lower().isin(("true", "false")).all():
+        return series.map(lambda v: v if pd.isna(v) else v.lower() == "true").astype("boolean")
+
+    # Числа (кроме кодов с ведущими нулями — артикулы, ИНН, индексы)
+    if not kinds.index.isin([bool, np.bool_]).any() and not text.str.match(_LEADING_ZERO_RE).any():
+        numbers = pd.to_numeric(values, errors="coerce")
+        if numbers.notna().all():
+            return _compact_numeric(pd.to_numeric(series, errors="coerce"))
+
+    if kinds.index.isin([datetime, pd.Timestamp]).all():
+        return pd.to_datetime(series, errors="coerce")
+    if kinds.index.isin([str]).all() and text.str.match(_DATE_TEXT_RE).all():
+        dayfirst = text.str.contains(r"^\s*\d{1,2}\.", regex=True).any()
+        dates = pd.to_datetime(series, errors="coerce", dayfirst=bool(dayfirst), format="mixed")
+        if dates.notna().sum() == len(values):
+            return dates
+
+    if (
+        categories
+        and kinds.index.isin([str]).all()
+        and len(series) >= CATEGORY_MIN_ROWS
+        and values.nunique() <= len(series) * CATEGORY_MAX_UNIQUE_RATIO
+    ):
+        return series.astype("category")
+    return series
+
+
+def _compact_frame(df: "pd.DataFrame", label: str = "") -> "pd.DataFrame":
+    """Типизация таблицы из Excel/CSV вместо строк: одна векторная проверка на колонку.
+
+    Размер до/после кладётся в df.attrs["memory"] и в общую статистику для /cache.
+    """
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return df
+    before = int(df.memory_usage(deep=True).sum())
+    # По позиции, а не по имени: в шапках бывают повторяющиеся имена колонок
+    compact = pd.concat([_infer_column(df.iloc[:, i]) for i in range(df.shape[1])], axis=1)
+    compact.columns = df.columns
+    compact.attrs.update(df.attrs)
+    after = int(compact.memory_usage(deep=True).sum())
+    compact.attrs["memory"] = {"before": before, "after": after}
 
-@tool
-def excel_edit_cell(filename: str, cell: str, value: str) -> str:
-    """Изменить ячейку в Excel.
+    with _compaction_lock:
+        _compaction_totals["frames"] += 1
+        _compaction_totals["before"] += before
+        _compaction_totals["after"] += after
+    if label:
+        logger.info(f"Типизация {label}: {_memory_report(before, after)}")
+    return compact
 
-    Автоматически определяет тип: число, формула или строка.
 
-    Args:
-        filename: Имя файла
-        cell: Адрес ячейки (напр. "A1", "B5")
-        value: Значение (строка, число или формула начинающаяся с =)
+def _typed_chunk(df: "pd.DataFrame") -> "pd.DataFrame":
+    """Типизация куска таблицы (как _compact_frame, но без category и статистики)."""
+    if df.empty:
+        return df
+    typed = pd.concat([_infer_column(df.iloc[:, i], categories=False) for i in range(df.shape[1])], axis=1)
+    typed.columns = df.columns
+    typed.index = df.index
+    return typed
+
+
+def _format_bytes(n: int) -> str:
+    return f"{n / 1024:.0f} KB" if n < 1024 * 1024 else f"{n / 1024 / 1024:.1f} MB"
+
+
+def _memory_report(before: int, after: int) -> str:
+    change = after / before - 1 if before else 0
+    return f"{_format_bytes(after)} вместо {_format_bytes(before)} ({change:+.0%})"
+
+
+def _frame_memory_line(df: "pd.DataFrame") -> str:
+    memory = df.attrs.get("memory")
+    if memory:
+        return f"Память: {_memory_report(memory['before'], memory['after'])}"
+    return f"Память: {_format_bytes(int(df.memory_usage(deep=True).sum()))}"
+
+
+# ============ ТАБЛИЦЫ: ЗАГРУЗКА ============
+
+CSV_SUFFIXES = {".csv", ".tsv", ".txt"}
+
+
+def _read_table_raw(filepath: Path, sheet_name=None, usecols=None, nrows=None) -> "pd.DataFrame":
+    """Таблица с заголовком в первой строке: CSV (формат определяется) или Excel.
+
+    dtype=object: pandas не превращает текст "00012" в число 12 — типы
+    колонок выводит _infer_column (через _cached_frame/_typed_chunk).
     """
-    if not EXCEL_AVAILABLE:
-        return "Ошибка: openpyxl не установлен"
+    if filepath.suffix.lower() in CSV_SUFFIXES:
+        enc, sep = _sniff_csv(filepath)
+        return pd.read_csv(filepath, encoding=enc, sep=sep, usecols=usecols, nrows=nrows, dtype=object)
+    return pd.read_excel(filepath, sheet_name=sheet_name or 0, usecols=usecols, nrows=nrows,
+                         dtype=object, engine=_pandas_engine(filepath))
 
+
+def _table_columns(filepath: Path, sheet_name=None) -> list:
+    """Имена колонок без чтения данных (nrows=0)."""
+    return [str(c) for c in _read_table_raw(filepath, sheet_name, nrows=0).columns]
+
+
+def _read_table(filepath: Path, sheet_name=None, columns: Optional[list] = None) -> "pd.DataFrame":
+    """DataFrame таблицы через кэши (память → Feather → разбор).
+
+    С columns читаются только нужные колонки (usecols), но если полный
+    разбор файла уже есть в кэше — проекция берётся из него.
+    Результат общий для всех инструментов — не изменять на месте.
+    """
+    full_variant = ("pandas", sheet_name or 0)
+    full = lambda: _cached_frame(filepath, full_variant, lambda: _read_table_raw(filepath, sheet_name))
+    if not columns:
+        return full()
+
+    columns = list(columns)
+    if _workbook_cache.contains(filepath, full_variant):
+        # Запись могут вытеснить из другого потока между contains и чтением —
+        # тогда таблица просто перечитается целиком
+        return full()[columns]
+    projected = lambda: _cached_frame(
+        filepath, full_variant + (tuple(columns),),
+        lambda: _read_table_raw(filepath, sheet_name, usecols=columns)[columns],
+    )
+    if _frame_store.has(filepath, full_variant):
+        # Повреждённый Feather load() удалит, и таблица перечитается с usecols
+        return _frame_store.load(filepath, full_variant, projected, columns=columns)
+    return projected()
+
+
+# ============ ТАБЛИЦЫ: БЮДЖЕТ ПАМЯТИ ============
+#
+# Перед полной загрузкой таблицы оценивается её объём в памяти: байт на
+# строку по первым строкам × число строк. Если оценка больше
+# DATA_MEMORY_BUDGET_BYTES, инструменты данных (сводные, профиль,
+# конвертация) идут по таблице кусками, а частичные агрегаты при нехватке
+# памяти сбрасываются на диск и сливаются в конце.
+
+MEMORY_ESTIMATE_SAMPLE_ROWS = 2000
+# Разбор Excel/CSV держит строки ещё и как списки Python-объектов
+MEMORY_PARSE_OVERHEAD = 2
+TABLE_CHUNK_MIN_ROWS = 10_000
+TABLE_CHUNK_MAX_ROWS = 500_000
+SPILL_DIR = CACHE_DIR / "spill"
+SPILL_PARTITIONS = 16
+
+_table_size_estimates: Dict[tuple, Dict[str, Any]] = {}
+
+
+def _iter_table_chunks(filepath: Path, sheet_name=None, columns: Optional[list] = None,
+                       chunk_rows: int = TABLE_CHUNK_MIN_ROWS):
+    """Таблица с заголовком в первой строке кусками по chunk_rows строк.
+
+    CSV — read_csv(chunksize, dtype=object), Excel — поток строк
+    _iter_sheet_rows с заполненными merged cells; каждый кусок типизируется
+    _typed_chunk. В памяти одновременно только один кусок. Форматы без
+    построчного чтения (.xls без calamine) отдаются одним куском.
+    """
+    suffix = filepath.suffix.lower()
+    if suffix in CSV_SUFFIXES:
+        enc, sep = _sniff_csv(filepath)
+        with pd.read_csv(filepath, encoding=enc, sep=sep, usecols=columns, chunksize=chunk_rows,
+                         dtype=object) as reader:
+            for chunk in reader:
+                yield _typed_chunk(chunk[columns] if columns else chunk)
+        return
+    if not _row_readable(filepath):
+        df = _read_table_raw(filepath, sheet_name, usecols=columns)
+        yield _typed_chunk(df[columns] if columns else df)
+        return
+
+    rows = _iter_sheet_rows(filepath, sheet_name)
     try:
-        filepath = _resolve_file(filename)
-        if not filepath:
-            return f"Файл не найден: {filename}"
+        header = next((row for row in rows if not _is_empty_row(row)), None)
+        if header is None:
+            return
+        names = _dedupe_headers(header)
+        missing = [c for c in columns or () if c not in names]
+        if missing:
+            raise ValueError(f"Колонки не найдены: {', '.join(map(str, missing))}")
+        selected = list(columns) if columns else names
+        positions = [names.index(c) for c in selected]
+
+        batch = []
+        for row in rows:
+            if _is_empty_row(row):
+                continue
+            batch.append([row[i] if i < len(row) else None for i in positions])
+            if len(batch) >= chunk_rows:
+                yield _typed_chunk(pd.DataFrame.from_records(batch, columns=selected))
+                batch = []
+        if batch:
+            yield _typed_chunk(pd.DataFrame.from_records(batch, columns=selected))
+    finally:
+        rows.close()
+
+
+def _table_estimate(filepath: Path, sheet_name=None) -> Dict[str, Any]:
+    """Запомненная до изменения файла оценка: байт на строку по колонкам (+ число строк)."""
+    stat = filepath.stat()
+    key = (str(filepath), stat.st_mtime_ns, stat.st_size, sheet_name)
+    estimate = _table_size_estimates.get(key)
+    if estimate is None:
+        chunks = _iter_table_chunks(filepath, sheet_name, chunk_rows=MEMORY_ESTIMATE_SAMPLE_ROWS)
+        sample = next(chunks, None)
+        chunks.close()
+        per_column = {}
+        if sample is not None and not sample.empty:
+            per_column = (sample.memory_usage(deep=True, index=False) / len(sample)).to_dict()
+        estimate = {"rows": None, "per_column": per_column}
+        _table_size_estimates[key] = estimate
+    return estimate
+
+
+def _estimate_row_bytes(filepath: Path, sheet_name=None, columns: Optional[list] = None) -> float:
+    """Байт на строку DataFrame при разборе — по первым MEMORY_ESTIMATE_SAMPLE_ROWS строкам."""
+    per_column = _table_estimate(filepath, sheet_name)["per_column"]
+    per_row = sum(size for col, size in per_column.items() if not columns or col in columns)
+    return per_row * MEMORY_PARSE_OVERHEAD
+
+
+def _estimate_table_bytes(filepath: Path, sheet_name=None, columns: Optional[list] = None) -> tuple:
+    """(байт, строк): оценка объёма DataFrame таблицы (или её колонок columns) при разборе.
+
+    Байт на строку — по первым строкам, число строк — без полного разбора.
+    """
+    estimate = _table_estimate(filepath, sheet_name)
+    if not estimate["per_column"]:
+        return 0, 0
+    if estimate["rows"] is None:
+        estimate["rows"] = _estimate_table_rows(filepath, sheet_name) or MEMORY_ESTIMATE_SAMPLE_ROWS
+    rows = estimate["rows"]
+    return int(_estimate_row_bytes(filepath, sheet_name, columns) * rows), rows
 
-        wb = openpyxl.load_workbook(filepath)
-        ws = wb.active
 
-        # Авто-приведение типов
-        parsed_value: Any = value
-        if isinstance(value, str):
-            if value.startswith("="):
-                # Формула — оставляем как есть
-                parsed_value = value
-            else:
-                # Пробуем число
-                try:
-                    if "." in value:
-                        parsed_value = float(value)
-                    else:
-                        parsed_value = int(value)
-                except ValueError:
-                    parsed_value = value  # Строка
+def _chunk_rows_for(row_bytes: float, budget: int) -> int:
+    """Строк в куске — около 1/8 бюджета: рядом живут частичные агрегаты и следующий кусок."""
+    chunk_rows = int(budget / 8 / max(row_bytes, 1))
+    return min(max(chunk_rows, TABLE_CHUNK_MIN_ROWS), TABLE_CHUNK_MAX_ROWS)
 
-        ws[cell] = parsed_value
-        wb.save(filepath)
 
-        type_label = "формула" if str(value).startswith("=") else type(parsed_value).__name__
-        return f"✓ Ячейка {cell} = {parsed_value} ({type_label})"
-    except Exception as e:
-        return f"Ошибка: {e}"
+def _table_plan(filepath: Path, sheet_name=None, columns: Optional[list] = None) -> Dict[str, Any]:
+    """Как обрабатывать таблицу: целиком в памяти или кусками.
+
+    {"mode": "memory" | "chunked", "estimate": байт, "chunk_rows": строк в куске}.
+    Таблица из кэша в памяти и форматы без потокового чтения — всегда "memory".
+    """
+    streamable = filepath.suffix.lower() in CSV_SUFFIXES or _row_readable(filepath)
+    if not streamable or _workbook_cache.contains(filepath, ("pandas", sheet_name or 0)):
+        return {"mode": "memory", "estimate": None, "chunk_rows": None}
+
+    estimate, rows = _estimate_table_bytes(filepath, sheet_name, columns)
+    if estimate <= DATA_MEMORY_BUDGET_BYTES:
+        return {"mode": "memory", "estimate": estimate, "chunk_rows": None}
+
+    chunk_rows = _chunk_rows_for(estimate / max(rows, 1), DATA_MEMORY_BUDGET_BYTES)
+    return {"mode": "chunked", "estimate": estimate, "chunk_rows": chunk_rows}
+
+
+def _plan_line(plan: Dict[str, Any], chunks: int = 0, spills: int = 0) -> str:
+    """Строка «Режим: ...» для ответа инструмента."""
+    budget = _format_bytes(DATA_MEMORY_BUDGET_BYTES)
+    if plan["mode"] == "memory":
+        if plan["estimate"] is None:
+            return "Режим: в памяти"
+        return f"Режим: в памяти (≈{_format_bytes(plan['estimate'])}, бюджет {budget})"
+    line = (
+        f"Режим: по частям — ≈{_format_bytes(plan['estimate'])} больше бюджета {budget}; "
+        f"{chunks} част. по {plan['chunk_rows']} строк"
+    )
+    if spills:
+        line += f", частичные итоги сброшены на диск {spills} раз"
+    return line
+
+
+# ============ EXCEL: ИМЕНОВАННЫЕ СТИЛИ ============
+
+STYLE_HEADER_COLOR = "4472C4"
+STYLE_HEADER_FONT_COLOR = "FFFFFF"
+STYLE_TOTAL_COLOR = "FFD966"
+
+
+def _thin_border() -> "Border":
+    side = Side(style="thin")
+    return Border(left=side, right=side, top=side, bottom=side)
+
+
+def _register_style(wb, kind: str, borders: bool = True,
+                    color: Optional[str] = None, font_color: Optional[str] = None) -> "StyleArray":
+    """Регистрирует NamedStyle в книге (один раз) и возвращает его индексы стилей.
+
+    kind: header — шапка, body — данные, total — итоги, rowhead — подписи строк.
+    Имя стиля включает параметры, так что разные цвета шапки — разные стили.
+    """
+    color = (color or (STYLE_TOTAL_COLOR if kind == "total" else STYLE_HEADER_COLOR)).upper()
+    font_color = (font_color or STYLE_HEADER_FONT_COLOR).upper()
+
+    name = f"agent_{kind}"
+    if kind in ("header", "total"):
+        name += f"_{color}"
+    if kind == "header":
+        name += f"_{font_color}"
+    if not borders:
+        name += "_noborder"
+
+    if name not in wb.named_styles:
+        style = NamedStyle(name=name)
+        if borders:
+            style.border = _thin_border()
+        if kind == "header":
+            style.font = Font(bold=True, color=font_color)
+            style.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+            style.alignment = Alignment(horizontal="center", vertical="center")
+        elif kind == "total":
+            style.font = Font(bold=True)
+            style.fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+        elif kind == "rowhead":
+            style.font = Font(bold=True)
+        wb.add_named_style(style)
+    return wb._named_styles[name].as_tuple()
+
+
+def _style_range(ws, style: "StyleArray", min_row: int, max_row: int,
+                 min_col: int = 1, max_col: Optional[int] = None,
+                 keep: tuple = ("numFmtId",)) -> None:
+    """Назначает стиль прямоугольнику ячеек.
+
+    Вместо создания Font/Border на каждую ячейку копируется готовый
+    массив индексов стиля (все ячейки ссылаются на один xf в styles.xml).
+    Атрибуты из keep (по умолчанию формат чисел) остаются от ячейки.
+    """
+    max_col = max_col or ws.max_column
+    cells = ws._cells
+    for row in range(min_row, max_row + 1):
+        for col in range(min_col, max_col + 1):
+            cell = cells.get((row, col)) or ws.cell(row=row, column=col)
+            own = cell._style
+            cell._style = copy(style)
+            if own is not None:
+                for attr in keep:
+                    setattr(cell._style, attr, getattr(own, attr))
+
+
+def _frame_column_widths(df: "pd.DataFrame") -> list:
+    """Ширина колонок (в символах) листа, записанного df.to_excel: индекс, затем данные."""
+    def longest(values) -> int:
+        lengths = pd.Series(values).astype(str).str.len()
+        return int(lengths.max()) if len(lengths) else 0
+
+    widths = []
+    for level in range(df.index.nlevels):
+        name = df.index.names[level]
+        widths.append(max(len(str(name or "")), longest(df.index.get_level_values(level))))
+    for col in df.columns:
+        labels = col if isinstance(col, tuple) else (col,)
+        widths.append(max(max(len(str(label)) for label in labels), longest(df[col])))
+    return widths
+
+
+def _styled_cells(ws, values, style: "StyleArray") -> list:
+    """Строка WriteOnlyCell с заданным стилем — для write-only листов."""
+    cells = []
+    for value in values:
+        cell = WriteOnlyCell(ws, value=value)
+        cell._style = copy(style)
+        cells.append(cell)
+    return cells
+
+
+# ============ EXCEL: ВЫЧИСЛЕНИЕ ФОРМУЛ ============
+#
+# openpyxl пишет формулы без значений, поэтому pandas и data_only-чтение
+# видят в них пустоту. Здесь формулы разбираются и считаются локально:
+# граф зависимостей держится в памяти рядом с книгой из кэша, при правке
+# пересчитываются только ячейки ниже по графу, а значения дописываются
+# в <v> уже сохранённого файла.
+
+class _XlError(str):
+    """Значение-ошибка Excel (#DIV/0!, #N/A, ...)."""
+
+
+_DIV0 = _XlError("#DIV/0!")
+_NA = _XlError("#N/A")
+_VALUE = _XlError("#VALUE!")
+_REF = _XlError("#REF!")
+_XL_ERRORS = {e: _XlError(e) for e in ("#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A")}
+
+
+class _Unsupported(Exception):
+    """Формула с функцией или конструкцией, которую движок не считает."""
+
+
+class _RangeValue(list):
+    """Значения диапазона: список строк."""
+
+    def flat(self):
+        for row in self:
+            yield from row
+
+
+_RANGE_REF_RE = re.compile(
+    r"^(?:(?:'((?:[^']|'')+)'|([^'!:]+))!)?"
+    r"(\$?)([A-Za-z]{1,3})(\$?)(\d*)(?::(\$?)([A-Za-z]{1,3})(\$?)(\d*))?$"
+)
+# Адреса ячеек вне строковых литералов и имён листов — для ключа формы формулы
+_CELL_TOKEN_RE = re.compile(
+    r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(?<![\w.$])(\$?)([A-Za-z]{1,3})(\$?)(\d+)(?![\w(!])"
+)
+
+_BINARY_PRECEDENCE = {
+    "=": 1, "<>": 1, "<": 1, ">": 1, "<=": 1, ">=": 1,
+    "&": 2, "+": 3, "-": 3, "*": 4, "/": 4, "^": 5,
+}
+_PREFIX_PRECEDENCE = 6
+
+
+def _formula_shape(formula: str, row: int, col: int) -> str:
+    """Формула с адресами относительно ячейки: у протянутых формул одна форма.
+
+    A2*B2 в C2 и A3*B3 в C3 дают одинаковую строку, и разбор делается один раз.
+    """
+    def repl(m):
+        if m.group(2) is None:
+            return m.group(0)
+        c = column_index_from_string(m.group(2).upper())
+        r = int(m.group(4))
+        cs = f"C{c}" if m.group(1) else f"C[{c - col}]"
+        rs = f"R{r}" if m.group(3) else f"R[{r - row}]"
+        return rs + cs
+    return _CELL_TOKEN_RE.sub(repl, formula)
+
+
+class _FormulaParser:
+    """Разбор формулы в дерево (кортежи) по токенам openpyxl.
+
+    Адреса хранятся относительно ячейки с формулой ($-части — абсолютно),
+    поэтому одно дерево годится для всех ячеек с той же формой формулы.
+    """
+
+    def __init__(self, formula: str, row: int, col: int):
+        tokens = Tokenizer(formula).items
+        self.tokens = [t for t in tokens if t.type != Token.WSPACE]
+        self.pos = 0
+        self.row, self.col = row, col
+
+    def parse(self):
+        node = self._expr(0)
+        if self.pos != len(self.tokens):
+            raise _Unsupported(f"лишний токен {self.tokens[self.pos].value}")
+        return node
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def _next(self):
+        tok = self._peek()
+        if tok is None:
+            raise _Unsupported("неожиданный конец формулы")
+        self.pos += 1
+        return tok
+
+    def _expr(self, min_prec: int):
+        left = self._unary()
+        while True:
+            tok = self._peek()
+            if tok is None or tok.type != Token.OP_IN:
+                return left
+            prec = _BINARY_PRECEDENCE.get(tok.value)
+            if prec is None:
+                raise _Unsupported(f"оператор {tok.value}")
+            if prec <= min_prec:
+                return left
+            self.pos += 1
+            # Все бинарные операторы Excel, включая ^, левоассоциативны: 2^3^2 = 64
+            right = self._expr(prec)
+            left = ("bin", tok.value, left, right)
+
+    def _unary(self):
+        tok = self._peek()
+        if tok is not None and tok.type == Token.OP_PRE:
+            self.pos += 1
+            operand = self._unary()
+            node = ("neg", operand) if tok.value == "-" else operand
+        else:
+            node = self._primary()
+        while (tok := self._peek()) is not None and tok.type == Token.OP_POST:
+            self.pos += 1
+            node = ("bin", "/", node, ("lit", 100))
+        return node
+
+    def _primary(self):
+        tok = self._next()
+        if tok.type == Token.OPERAND:
+            if tok.subtype == Token.NUMBER:
+                number = float(tok.value)
+                return ("lit", int(number) if number.is_integer() and "." not in tok.value else number)
+            if tok.subtype == Token.TEXT:
+                return ("lit", tok.value[1:-1].replace('""', '"'))
+            if tok.subtype == Token.LOGICAL:
+                return ("lit", tok.value.upper() == "TRUE")
+            if tok.subtype == Token.ERROR:
+                return ("lit", _XL_ERRORS.get(tok.value.upper(), _XlError(tok.value)))
+            return self._reference(tok.value)
+        if tok.type == Token.PAREN and tok.subtype == Token.OPEN:
+            node = self._expr(0)
+            close = self._next()
+            if close.type != Token.PAREN:
+                raise _Unsupported("скобки")
+            return node
+        if tok.type == Token.FUNC and tok.subtype == Token.OPEN:
+            name = tok.value[:-1].upper()
+            if name.startswith("_XLFN."):
+                name = name[6:]
+            args = []
+            if (nxt := self._peek()) is not None and nxt.type == Token.FUNC and nxt.subtype == Token.CLOSE:
+                self.pos += 1
+                return ("func", name, tuple(args))
+            while True:
+                nxt = self._peek()
+                if nxt is not None and (nxt.type == Token.SEP or nxt.type == Token.FUNC and nxt.subtype == Token.CLOSE):
+                    args.append(("lit", None))   # пропущенный аргумент: IF(A1,,1)
+                else:
+                    args.append(self._expr(0))
+                sep = self._next()
+                if sep.type == Token.FUNC and sep.subtype == Token.CLOSE:
+                    return ("func", name, tuple(args))
+                if sep.type != Token.SEP or sep.subtype != Token.ARG:
+                    raise _Unsupported(f"разделитель {sep.value}")
+        raise _Unsupported(f"токен {tok.value}")
+
+    def _reference(self, text: str):
+        m = _RANGE_REF_RE.match(text)
+        if not m:
+            raise _Unsupported(f"ссылка {text}")
+        quoted, plain, c1abs, c1, r1abs, r1, c2abs, c2, r2abs, r2 = m.groups()
+        sheet = quoted.replace("''", "'") if quoted else plain
+
+        def col_ref(letters, absolute, whole_column):
+            idx = column_index_from_string(letters.upper())
+            # Целые столбцы (A:A) не входят в форму формулы — храним абсолютно
+            return (idx, True) if absolute or whole_column else (idx - self.col, False)
+
+        def row_ref(digits, absolute):
+            return (int(digits), True) if absolute else (int(digits) - self.row, False)
+
+        if c2 is None:
+            if not r1:
+                raise _Unsupported(f"ссылка {text}")
+            return ("ref", sheet, row_ref(r1, r1abs), col_ref(c1, c1abs, False))
+        if bool(r1) != bool(r2):
+            raise _Unsupported(f"ссылка {text}")
+        if not r1:
+            return ("range", sheet, (1, True), col_ref(c1, c1abs, True),
+                    (EXCEL_MAX_ROWS, True), col_ref(c2, c2abs, True))
+        return ("range", sheet, row_ref(r1, r1abs), col_ref(c1, c1abs, False),
+                row_ref(r2, r2abs), col_ref(c2, c2abs, False))
+
+
+def _resolve(spec: tuple, base: int) -> int:
+    value, absolute = spec
+    return value if absolute else base + value
+
+
+def _single(value):
+    """Диапазон в скалярном контексте: допустима только одна ячейка."""
+    if isinstance(value, _RangeValue):
+        return value[0][0] if len(value) == 1 and len(value[0]) == 1 else _VALUE
+    return value
+
+
+def _to_number(value):
+    if isinstance(value, _XlError):
+        return value
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, datetime):
+        return to_excel(value)
+    if isinstance(value, str):
+        try:
+            return float(value.strip())
+        except ValueError:
+            return _VALUE
+    return _VALUE
+
+
+def _to_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _to_bool(value):
+    if isinstance(value, _XlError):
+        return value
+    if isinstance(value, str):
+        upper = value.upper()
+        if upper in ("TRUE", "FALSE"):
+            return upper == "TRUE"
+        return _VALUE
+    number = _to_number(value)
+    return number if isinstance(number, _XlError) else number != 0
+
+
+def _compare_key(value):
+    """Порядок типов Excel: числа < текст < логические, текст без учёта регистра."""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (2, value)
+    if isinstance(value, str):
+        return (1, value.lower())
+    return (0, _to_number(value))
+
+
+def _numbers(args, strict_scalars: bool = True):
+    """Числа из аргументов агрегатной функции: в диапазонах текст и пустые пропускаются."""
+    for arg in args:
+        if isinstance(arg, _RangeValue):
+            for v in arg.flat():
+                if isinstance(v, _XlError):
+                    raise _FormulaErrorValue(v)
+                if isinstance(v, (int, float)) and not isinstance(v, bool):
+                    yield v
+                elif isinstance(v, datetime):
+                    yield to_excel(v)
+        else:
+            number = _to_number(arg) if strict_scalars else arg
+            if isinstance(number, _XlError):
+                raise _FormulaErrorValue(number)
+            yield number
+
+
+class _FormulaErrorValue(Exception):
+    def __init__(self, value: "_XlError"):
+        self.value = value
+
+
+def _xl_round(value, digits=0):
+    value, digits = _to_number(value), _to_number(digits)
+    for v in (value, digits):
+        if isinstance(v, _XlError):
+            return v
+    # Округление по десятичной записи числа из 15 значащих цифр, как в Excel:
+    # ROUND(1.005; 2) = 1.01, хотя двоичный float 1.005 чуть меньше 1.005
+    exponent = decimal.Decimal(1).scaleb(-int(digits))
+    try:
+        exact = decimal.Decimal(format(value, ".15g"))
+        return float(exact.quantize(exponent, rounding=decimal.ROUND_HALF_UP))
+    except decimal.InvalidOperation:
+        return float(value)  # Больше 28 значащих цифр — дробной части у float уже нет
+
+
+def _xl_vlookup(lookup, table, col_index, approximate=True):
+    if isinstance(lookup, _XlError):
+        return lookup
+    if not isinstance(table, _RangeValue):
+        return _VALUE
+    col_index = _to_number(col_index)
+    if isinstance(col_index, _XlError):
+        return col_index
+    col_index = int(col_index)
+    if col_index < 1:
+        return _VALUE
+    if table and col_index > len(table[0]):
+        return _REF
+    approximate = _to_bool(approximate) if approximate is not None else True
+    key = _compare_key(lookup)
+
+    if not approximate:
+        for row in table:
+            if row[0] is not None and _compare_key(row[0]) == key:
+                return row[col_index - 1]
+        return _NA
+
+    # Приблизительный поиск: последняя строка, где первый столбец <= искомого
+    found = None
+    for row in table:
+        if row[0] is None:
+            continue
+        if _compare_key(row[0])[0] != key[0]:
+            continue
+        if _compare_key(row[0]) > key:
+            break
+        found = row
+    return found[col_index - 1] if found is not None else _NA
+
+
+def _aggregate(name: str, args: list):
+    try:
+        if name == "SUM":
+            return sum(_numbers(args))
+        if name in ("AVERAGE", "MIN", "MAX"):
+            values = list(_numbers(args))
+            if name == "AVERAGE":
+                return sum(values) / len(values) if values else _DIV0
+            if not values:
+                return 0
+            return min(values) if name == "MIN" else max(values)
+        if name == "COUNT":
+            count = 0
+            for arg in args:
+                if isinstance(arg, _RangeValue):
+                    count += sum(1 for v in arg.flat() if isinstance(v, (int, float, datetime)) and not isinstance(v, bool))
+                elif not isinstance(_to_number(arg), _XlError) and arg is not None:
+                    count += 1
+            return count
+        if name == "COUNTA":
+            count = 0
+            for arg in args:
+                if isinstance(arg, _RangeValue):
+                    count += sum(1 for v in arg.flat() if v is not None)
+                elif arg is not None:
+                    count += 1
+            return count
+    except _FormulaErrorValue as e:
+        return e.value
+    raise _Unsupported(name)
+
+
+_SCALAR_FUNCTIONS = {
+    "ROUND": _xl_round,
+    "ABS": lambda v: (n if isinstance(n := _to_number(v), _XlError) else abs(n)),
+    "NOT": lambda v: (b if isinstance(b := _to_bool(v), _XlError) else not b),
+    "CONCATENATE": lambda *vs: next((v for v in vs if isinstance(v, _XlError)), None)
+    or "".join(_to_text(v) for v in vs),
+    "VLOOKUP": _xl_vlookup,
+}
+_AGGREGATE_FUNCTIONS = {"SUM", "AVERAGE", "MIN", "MAX", "COUNT", "COUNTA"}
+
+
+class _FormulaEngine:
+    """Граф зависимостей формул книги и их вычисленные значения.
+
+    Ключ ячейки — (лист, строка, столбец). Для одиночных ссылок ведётся
+    обратный индекс, для диапазонов — список интервалов по столбцу.
+    """
+
+    def __init__(self, wb):
+        self.wb = wb
+        self.formulas: Dict[tuple, tuple] = {}     # ключ → дерево формулы
+        self.values: Dict[tuple, Any] = {}
+        self.unsupported: Dict[tuple, str] = {}
+        self.cells_deps: Dict[tuple, set] = {}     # ячейка → формулы, ссылающиеся на неё
+        self.range_deps: Dict[tuple, list] = {}    # (лист, столбец) → [(r1, r2, формула)]
+        self.precedents: Dict[tuple, tuple] = {}   # формула → (ячейки, диапазоны)
+        self.formula_rows: Dict[tuple, list] = {}  # (лист, столбец) → отсортированные строки формул
+        self._shapes: Dict[str, Any] = {}
+        self._sheets = {}
+
+    # --- построение графа ---
+
+    def build(self) -> None:
+        for ws in self.wb.worksheets:
+            title = ws.title
+            for (row, col), cell in ws._cells.items():
+                if cell.data_type == "f":
+                    self._register((title, row, col), cell.value)
+
+    def _parse(self, key: tuple, formula: str):
+        if not isinstance(formula, str):
+            raise _Unsupported("формула массива")
+        _, row, col = key
+        text = formula[1:] if formula.startswith("=") else formula
+        shape = _formula_shape(text, row, col)
+        tree = self._shapes.get(shape)
+        if tree is None:
+            try:
+                tree = _FormulaParser("=" + text, row, col).parse()
+            except _Unsupported as e:
+                tree = e
+            except Exception as e:   # TokenizerError и прочие ошибки синтаксиса
+                tree = _Unsupported(f"синтаксис: {e}")
+            self._shapes[shape] = tree
+        if isinstance(tree, _Unsupported):
+            raise tree
+        return tree
+
+    def _register(self, key: tuple, formula) -> None:
+        sheet, row, col = key
+        try:
+            tree = self._parse(key, formula)
+        except _Unsupported as e:
+            self.unsupported[key] = str(e)
+            tree = None
+        self.formulas[key] = tree
+        bisect.insort(self.formula_rows.setdefault((sheet, col), []), row)
+        if tree is None:
+            self.precedents[key] = ((), ())
+            return
+
+        cells, ranges = [], []
+        self._collect(tree, key, cells, ranges)
+        self.precedents[key] = (tuple(cells), tuple(ranges))
+        for ref in cells:
+            self.cells_deps.setdefault(ref, set()).add(key)
+        for ref_sheet, r1, c1, r2, c2 in ranges:
+            for c in range(c1, c2 + 1):
+                self.range_deps.setdefault((ref_sheet, c), []).append((r1, r2, key))
+
+    def _unregister(self, key: tuple) -> None:
+        if key not in self.formulas:
+            return
+        sheet, row, col = key
+        cells, ranges = self.precedents.pop(key)
+        for ref in cells:
+            deps = self.cells_deps.get(ref)
+            if deps:
+                deps.discard(key)
+        for ref_sheet, r1, c1, r2, c2 in ranges:
+            for c in range(c1, c2 + 1):
+                entries = self.range_deps.get((ref_sheet, c), [])
+                entries[:] = [e for e in entries if e[2] != key]
+        rows = self.formula_rows[(sheet, col)]
+        del rows[bisect.bisect_left(rows, row)]
+        del self.formulas[key]
+        self.values.pop(key, None)
+        self.unsupported.pop(key, None)
+
+    def _collect(self, node, host: tuple, cells: list, ranges: list) -> None:
+        kind = node[0]
+        if kind == "ref":
+            _, sheet, row_spec, col_spec = node
+            cells.append((sheet or host[0], _resolve(row_spec, host[1]), _resolve(col_spec, host[2])))
+        elif kind == "range":
+            _, sheet, r1, c1, r2, c2 = node
+            rows = sorted((_resolve(r1, host[1]), _resolve(r2, host[1])))
+            cols = sorted((_resolve(c1, host[2]), _resolve(c2, host[2])))
+            ranges.append((sheet or host[0], rows[0], cols[0], rows[1], cols[1]))
+        elif kind == "bin":
+            self._collect(node[2], host, cells, ranges)
+            self._collect(node[3], host, cells, ranges)
+        elif kind == "neg":
+            self._collect(node[1], host, cells, ranges)
+        elif kind == "func":
+            for arg in node[2]:
+                self._collect(arg, host, cells, ranges)
+
+    # --- пересчёт ---
+
+    def update(self, changed) -> Dict[str, int]:
+        """Перерегистрирует изменённые ячейки и пересчитывает всё, что от них зависит."""
+        changed = set(changed)
+        for key in changed:
+            self._unregister(key)
+            ws = self._sheet(key[0])
+            cell = ws._cells.get((key[1], key[2])) if ws is not None else None
+            if cell is not None and cell.data_type == "f":
+                self._register(key, cell.value)
+        return self.recalculate(self._downstream(changed))
+
+    def recalculate_all(self) -> Dict[str, int]:
+        return self.recalculate(set(self.formulas))
+
+    def _dependents(self, key: tuple):
+        yield from self.cells_deps.get(key, ())
+        sheet, row, col = key
+        for r1, r2, formula in self.range_deps.get((sheet, col), ()):
+            if r1 <= row <= r2:
+                yield formula
+
+    def _downstream(self, changed: set) -> set:
+        dirty = {key for key in changed if key in self.formulas}
+        queue = list(changed)
+        seen = set(changed)
+        while queue:
+            key = queue.pop()
+            for dep in self._dependents(key):
+                if dep not in seen:
+                    seen.add(dep)
+                    dirty.add(dep)
+                    queue.append(dep)
+        return dirty
+
+    def _formula_precedents(self, key: tuple):
+        """Ячейки-формулы, от которых зависит формула key."""
+        cells, ranges = self.precedents[key]
+        for ref in cells:
+            if ref in self.formulas:
+                yield ref
+        for sheet, r1, c1, r2, c2 in ranges:
+            for c in range(c1, c2 + 1):
+                rows = self.formula_rows.get((sheet, c))
+                if rows:
+                    for r in rows[bisect.bisect_left(rows, r1):bisect.bisect_right(rows, r2)]:
+                        yield (sheet, r, c)
+
+    def recalculate(self, dirty: set) -> Dict[str, int]:
+        """Считает формулы из dirty в порядке зависимостей (итеративный обход, без рекурсии)."""
+        order, state, cyclic = [], {}, set()
+        for start in dirty:
+            if start in state:
+                continue
+            state[start] = 1
+            stack = [(start, self._formula_precedents(start))]
+            while stack:
+                node, precedents = stack[-1]
+                for dep in precedents:
+                    if dep not in dirty:
+                        continue
+                    status = state.get(dep)
+                    if status is None:
+                        state[dep] = 1
+                        stack.append((dep, self._formula_precedents(dep)))
+                        break
+                    if status == 1:
+                        nodes = [n for n, _ in stack]
+                        cyclic.update(nodes[nodes.index(dep):])
+                else:
+                    stack.pop()
+                    state[node] = 2
+                    order.append(node)
+
+        failed = 0
+        for key in order:
+            tree = self.formulas[key]
+            if tree is None or key in cyclic:
+                self.values.pop(key, None)
+                failed += 1
+                continue
+            try:
+                value = self._eval(tree, key)
+                self.values[key] = _single(value)
+            except _Unsupported as e:
+                self.unsupported[key] = str(e)
+                self.values.pop(key, None)
+                failed += 1
+        return {"calculated": len(order) - failed, "failed": failed, "cyclic": len(cyclic)}
+
+    def _sheet(self, title: str):
+        if title not in self._sheets:
+            self._sheets[title] = self.wb[title] if title in self.wb.sheetnames else None
+        return self._sheets[title]
+
+    def _cell_value(self, sheet: str, row: int, col: int):
+        key = (sheet, row, col)
+        if key in self.formulas:
+            return self.values.get(key)
+        ws = self._sheet(sheet)
+        if ws is None:
+            return _REF
+        cell = ws._cells.get((row, col))
+        return None if cell is None else cell.value
+
+    def _range_value(self, sheet: str, r1: int, c1: int, r2: int, c2: int) -> "_RangeValue":
+        ws = self._sheet(sheet)
+        if ws is None:
+            raise _FormulaErrorValue(_REF)
+        r2 = min(r2, ws.max_row)
+        return _RangeValue(
+            [self._cell_value(sheet, r, c) for c in range(c1, c2 + 1)]
+            for r in range(r1, r2 + 1)
+        )
+
+    def _eval(self, node, host: tuple):
+        kind = node[0]
+        if kind == "lit":
+            return node[1]
+        if kind == "ref":
+            _, sheet, row_spec, col_spec = node
+            return self._cell_value(sheet or host[0], _resolve(row_spec, host[1]), _resolve(col_spec, host[2]))
+        if kind == "range":
+            _, sheet, r1, c1, r2, c2 = node
+            rows = sorted((_resolve(r1, host[1]), _resolve(r2, host[1])))
+            cols = sorted((_resolve(c1, host[2]), _resolve(c2, host[2])))
+            try:
+                return self._range_value(sheet or host[0], rows[0], cols[0], rows[1], cols[1])
+            except _FormulaErrorValue as e:
+                return e.value
+        if kind == "neg":
+            value = _to_number(self._scalar(node[1], host))
+            return value if isinstance(value, _XlError) else -value
+        if kind == "bin":
+            return self._binary(node[1], self._scalar(node[2], host), self._scalar(node[3], host))
+        if kind == "func":
+            return self._call(node[1], node[2], host)
+        raise _Unsupported(kind)
+
+    def _scalar(self, node, host: tuple):
+        return _single(self._eval(node, host))
+
+    @staticmethod
+    def _binary(op: str, left, right):
+        for v in (left, right):
+            if isinstance(v, _XlError):
+                return v
+        if op == "&":
+            return _to_text(left) + _to_text(right)
+        if op in ("=", "<>", "<", ">", "<=", ">="):
+            if left is None:
+                left = "" if isinstance(right, str) else (False if isinstance(right, bool) else 0)
+            if right is None:
+                right = "" if isinstance(left, str) else (False if isinstance(left, bool) else 0)
+            a, b = _compare_key(left), _compare_key(right)
+            return {"=": a == b, "<>": a != b, "<": a < b, ">": a > b, "<=": a <= b, ">=": a >= b}[op]
+
+        a, b = _to_number(left), _to_number(right)
+        for v in (a, b):
+            if isinstance(v, _XlError):
+                return v
+        if op == "+":
+            return a + b
+        if op == "-":
+            return a - b
+        if op == "*":
+            return a * b
+        if op == "/":
+            return _DIV0 if b == 0 else a / b
+        if op == "^":
+            try:
+                result = a ** b
+            except (OverflowError, ZeroDivisionError):
+                return _XL_ERRORS["#NUM!"]
+            return _XL_ERRORS["#NUM!"] if isinstance(result, complex) else result
+        raise _Unsupported(op)
+
+    def _call(self, name: str, args: tuple, host: tuple):
+        # Ленивые функции: ветки IF/IFERROR не вычисляются без нужды
+        if name == "IF":
+            if not 1 <= len(args) <= 3:
+                return _VALUE
+            cond = _to_bool(self._scalar(args[0], host))
+            if isinstance(cond, _XlError):
+                return cond
+            if cond:
+                return self._eval(args[1], host) if len(args) > 1 else True
+            return self._eval(args[2], host) if len(args) > 2 else False
+        if name == "IFERROR":
+            value = self._scalar(args[0], host)
+            return self._eval(args[1], host) if isinstance(value, _XlError) else value
+        if name in ("AND", "OR"):
+            results = []
+            for arg in args:
+                value = self._eval(arg, host)
+                values = value.flat() if isinstance(value, _RangeValue) else [value]
+                for v in values:
+                    if isinstance(v, _XlError):
+                        return v
+                    if v is None or (isinstance(v, str) and isinstance(value, _RangeValue)):
+                        continue
+                    b = _to_bool(v)
+                    if isinstance(b, _XlError):
+                        return b
+                    results.append(b)
+            if not results:
+                return _VALUE
+            return all(results) if name == "AND" else any(results)
+
+        values = [self._eval(arg, host) for arg in args]
+        if name in _AGGREGATE_FUNCTIONS:
+            return _aggregate(name, values)
+        func = _SCALAR_FUNCTIONS.get(name)
+        if func is None:
+            raise _Unsupported(f"функция {name}")
+        # Диапазон допустим только как таблица VLOOKUP, в остальных местах — одна ячейка
+        values = [v if name == "VLOOKUP" and i == 1 else _single(v) for i, v in enumerate(values)]
+        try:
+            return func(*values)
+        except TypeError:
+            return _VALUE
+
+
+_formula_engines: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _recalculate_workbook(wb, changed=None) -> "_FormulaEngine":
+    """Пересчёт формул книги: с changed — только зависимые ячейки.
+
+    Граф живёт, пока книга в кэше; для новой книги строится заново и
+    считается целиком.
+    """
+    engine = _formula_engines.get(wb)
+    if engine is None:
+        engine = _FormulaEngine(wb)
+        engine.build()
+        engine.last_stats = engine.recalculate_all()
+        _formula_engines[wb] = engine
+    elif changed:
+        engine.last_stats = engine.update(changed)
+    else:
+        engine.last_stats = {"calculated": 0, "failed": 0, "cyclic": 0}
+    return engine
+
+
+_FORMULA_CELL_RE = re.compile(rb'<c r="([A-Z]+)(\d+)"([^>]*)><f>(.*?)</f><v\s*/?>(?:</v>)?</c>', re.S)
+
+
+def _xml_cached_value(value) -> Optional[tuple]:
+    """(атрибут t, текст <v>) для значения формулы."""
+    if value is None:
+        return None
+    if isinstance(value, _XlError):
+        return "e", str(value)
+    if isinstance(value, bool):
+        return "b", "1" if value else "0"
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not math.isfinite(value):
+            return "e", "#NUM!"
+        return "n", repr(value) if isinstance(value, float) else str(value)
+    if isinstance(value, datetime):
+        return "n", repr(float(to_excel(value)))
+    return "str", _to_text(value)
+
+
+def _write_cached_values(filepath: Path, engine: "_FormulaEngine") -> int:
+    """Дописывает значения формул в <v> сохранённого openpyxl файла."""
+    by_sheet: Dict[str, Dict[tuple, Any]] = {}
+    for (sheet, row, col), value in engine.values.items():
+        by_sheet.setdefault(sheet, {})[(row, col)] = value
+    if not by_sheet:
+        return 0
+
+    members = {member: by_sheet[name] for name, member in _xlsx_sheet_members(filepath).items() if name in by_sheet}
+    written = 0
+
+    def fill(values):
+        def repl(m):
+            nonlocal written
+            cached = _xml_cached_value(values.get((int(m.group(2)), column_index_from_string(m.group(1).decode()))))
+            if cached is None:
+                return m.group(0)
+            written += 1
+            kind, text = cached
+            return (
+                b'<c r="' + m.group(1) + m.group(2) + b'"' + m.group(3) + b' t="' + kind.encode() + b'"><f>'
+                + m.group(4) + b"</f><v>" + xml_escape(text).encode("utf-8") + b"</v></c>"
+            )
+        return repl
+
+    tmp = filepath.with_name(f".{filepath.name}.{os.getpid()}.tmp")
+    with zipfile.ZipFile(filepath) as src, zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as dst:
+        for info in src.infolist():
+            data = src.read(info)
+            if info.filename in members:
+                data = _FORMULA_CELL_RE.sub(fill(members[info.filename]), data)
+            dst.writestr(info, data, compress_type=info.compress_type)
+    os.replace(tmp, filepath)
+    return written
+
+
+def _save_with_values(wb, filepath: Path, changed=None) -> "_FormulaEngine":
+    """Пересчитать формулы, сохранить книгу и записать значения формул в файл."""
+    engine = _recalculate_workbook(wb, changed)
+    _workbook_cache.save_workbook(wb, filepath, after_save=lambda p: _write_cached_values(p, engine))
+    return engine
+
+
+def _recalc_summary(engine: "_FormulaEngine") -> str:
+    stats = engine.last_stats
+    if not stats["calculated"] and not stats["failed"]:
+        return ""
+    text = f"Пересчитано формул: {stats['calculated']}"
+    if stats["failed"]:
+        reasons = sorted(set(engine.unsupported.values()))[:3]
+        text += f", не вычислено: {stats['failed']}"
+        if stats["cyclic"]:
+            text += f" (циклических: {stats['cyclic']})"
+        if reasons:
+            text += f" — {'; '.join(reasons)}"
+    return text
+
+
+# ============ EXCEL TOOLS ============
+
+# --- Параллельная обработка ---
+# Процессы пула (0 — по числу ядер, но не больше 8)
+PROCESS_POOL_WORKERS = int(os.getenv("AGENT_WORKERS", "0")) or max(1, min(os.cpu_count() or 1, 8))
+# Меньшие объёмы обрабатываются последовательно — запуск процессов дороже
+PARALLEL_MIN_BYTES = int(os.getenv("PARALLEL_MIN_MB", "8")) * 1024 * 1024
+
+# --- CSV ---
+CSV_SNIFF_BYTES = 256 * 1024
+CSV_CHUNK_ROWS = 50_000
+# Лимит строк на лист Excel (включая строку заголовка)
+EXCEL_MAX_ROWS = 1_048_576
+
+# Ширина колонок в write-only режиме должна быть задана до первой строки,
+# поэтому она считается по первым строкам потока (буфер), а не по всем
+EXCEL_AUTOWIDTH_SAMPLE_ROWS = 1000
+
+
+def _iter_data_rows(data: str = "", data_file: str = ""):
+    """Строки данных для excel_create: из JSON-строки или файла .json / .jsonl.
+
+    JSONL читается построчно, не загружая файл целиком. Строки — списки
+    значений или объекты; для объектов первой строкой идут ключи первого объекта.
+    """
+    if data_file:
+        path = _resolve_file(data_file)
+        if not path:
+            raise FileNotFoundError(f"Файл данных не найден: {data_file}")
+        if path.suffix.lower() in (".jsonl", ".ndjson"):
+            def rows():
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            yield json.loads(line)
+            source = rows()
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                source = iter(json.load(f))
+    else:
+        source = iter(json.loads(data))
+
+    keys = None
+    for row in source:
+        if isinstance(row, dict):
+            if keys is None:
+                keys = list(row)
+                yield keys
+            yield [row.get(k) for k in keys]
+        else:
+            yield row
+
+
+@tool
+def excel_create(filename: str, data: str = "", sheet_name: str = "Sheet1", data_file: str = "") -> str:
+    """Создать Excel файл с данными.
+
+    Файл пишется потоково (write-only), поэтому подходит и для больших таблиц.
+    Большие данные лучше передавать файлом через data_file, а не строкой.
+
+    Args:
+        filename: Имя файла (будет создан в outputs/)
+        data: JSON-массив строк, например: [["Имя", "Возраст"], ["Анна", 25]]
+        sheet_name: Имя листа (по умолчанию Sheet1)
+        data_file: Вместо data — имя .json (массив строк) или .jsonl (строка
+            на линию: массив значений или объект) из outputs/ или work/
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: openpyxl не установлен"
+
+    if not data and not data_file:
+        return "Ошибка: нужен data или data_file"
+
+    try:
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(sheet_name)
+
+        # Автоширина считается в том же проходе: первые строки буферизуются,
+        # пока копятся длины, затем ширины фиксируются и поток идёт напрямую
+        widths: list = []
+        buffer = []
+        n_rows = 0
+        has_formulas = False
+
+        def flush_widths():
+            for col_idx, max_length in enumerate(widths, 1):
+                ws.column_dimensions[get_column_letter(col_idx)].width = min(max_length + 2, 50)
+            for buffered in buffer:
+                ws.append(buffered)
+            buffer.clear()
+
+        for row_data in _iter_data_rows(data, data_file):
+            row_data = list(row_data)
+            n_rows += 1
+            if not has_formulas:
+                has_formulas = any(isinstance(v, str) and v.startswith("=") for v in row_data)
+            if n_rows > EXCEL_AUTOWIDTH_SAMPLE_ROWS:
+                ws.append(row_data)
+                continue
+
+            if len(row_data) > len(widths):
+                widths.extend([0] * (len(row_data) - len(widths)))
+            for col_idx, value in enumerate(row_data):
+                if value:
+                    widths[col_idx] = max(widths[col_idx], len(str(value)))
+            buffer.append(row_data)
+            if n_rows == EXCEL_AUTOWIDTH_SAMPLE_ROWS:
+                flush_widths()
+
+        if buffer or n_rows == 0:
+            flush_widths()
+
+        filepath = OUTPUT_DIR / filename
+        _discard_appends(filepath)
+        wb.save(filepath)
+        _workbook_cache.invalidate(filepath)
+
+        result = f"✓ Excel создан: {filepath} ({n_rows} строк)"
+        if has_formulas:
+            # write-only книга не хранит ячейки — считаем формулы по перечитанной
+            with _editing_workbook(filepath) as full_wb:
+                engine = _save_with_values(full_wb, filepath)
+            result += f"\n{_recalc_summary(engine)}"
+        return result
+    except json.JSONDecodeError as e:
+        return f"Ошибка парсинга JSON data: {e}"
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+@tool
+def excel_add_formulas(filename: str, formulas: str) -> str:
+    """Добавить формулы в Excel.
+
+    Значения формул считаются сразу и сохраняются в файле (пересчитываются
+    только ячейки, зависящие от изменённых).
+
+    Args:
+        filename: Имя файла
+        formulas: JSON-массив, например: [{"cell": "C2", "formula": "=A2+B2"}]
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: openpyxl не установлен"
+
+    try:
+        filepath = _resolve_file(filename)
+        if not filepath:
+            return f"Файл не найден: {filename}"
+
+        formula_list = json.loads(formulas)
+
+        with _editing_workbook(filepath) as wb:
+            ws = wb.active
+            changed = set()
+            for item in formula_list:
+                cell = ws[item["cell"]]
+                cell.value = item["formula"]
+                changed.add((ws.title, cell.row, cell.column))
+            engine = _save_with_values(wb, filepath, changed)
+
+        return f"✓ Добавлено {len(formula_list)} формул в {filepath.name}\n{_recalc_summary(engine)}"
+    except json.JSONDecodeError as e:
+        return f"Ошибка парсинга JSON formulas: {e}"
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+@tool
+def excel_style(filename: str, styles: str) -> str:
+    """Применить стили к Excel.
+
+    Args:
+        filename: Имя файла
+        styles: JSON со стилями. Поддерживаемые ключи:
+            header_row (int), header_color (hex), header_font_color (hex),
+            freeze_panes (str, напр. "A2"), borders (bool)
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: openpyxl не установлен"
+
+    try:
+        filepath = _resolve_file(filename)
+        if not filepath:
+            return f"Файл не найден: {filename}"
+
+        style_dict = json.loads(styles)
+
+        with _editing_workbook(filepath) as wb:
+            ws = wb.active
+
+            borders = bool(style_dict.get("borders", False))
+            header_row = style_dict.get("header_row")
+
+            if borders:
+                # Рамки поверх существующего оформления: шрифт, заливка и формат остаются
+                body = _register_style(wb, "body")
+                keep = ("numFmtId", "fontId", "fillId", "alignmentId", "protectionId")
+                if header_row != 1:
+                    _style_range(ws, body, 1, (header_row or ws.max_row + 1) - 1, keep=keep)
+                if header_row and header_row < ws.max_row:
+                    _style_range(ws, body, header_row + 1, ws.max_row, keep=keep)
+
+            if header_row:
+                header = _register_style(
+                    wb, "header", borders=borders,
+                    color=style_dict.get("header_color"),
+                    font_color=style_dict.get("header_font_color"),
+                )
+                # Без borders рамки шапки остаются как были — меняются шрифт, заливка, выравнивание
+                keep = ("numFmtId",) if borders else ("numFmtId", "borderId", "protectionId")
+                _style_range(ws, header, header_row, header_row, keep=keep)
+
+            if "freeze_panes" in style_dict:
+                ws.freeze_panes = style_dict["freeze_panes"]
+
+            _save_with_values(wb, filepath)
+
+        return f"✓ Стили применены к {filepath.name}"
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+# ============ EXCEL: НЕСКОЛЬКО ЛИСТОВ ============
+
+# Превью на лист, когда читается сразу несколько листов
+EXCEL_MULTI_PREVIEW_ROWS = 5
+
+
+def _sheet_names(filepath: Path) -> list:
+    if filepath.suffix.lower() in EXCEL_STREAMABLE_SUFFIXES:
+        return list(_xlsx_sheet_members(filepath))
+    with pd.ExcelFile(filepath, engine=_pandas_engine(filepath)) as xls:
+        return list(xls.sheet_names)
+
+
+def _parse_sheet_spec(filepath: Path, spec: Optional[str]) -> list:
+    """Список листов из параметра sheet_name: имя, "all" или JSON-список имён."""
+    names = _sheet_names(filepath)
+    if not names:
+        raise ValueError(f"В книге {filepath.name} нет листов")
+    if not spec or not str(spec).strip():
+        return names[:1]
+
+    spec = str(spec).strip()
+    if spec.lower() in ("all", "*", "все"):
+        return names
+    requested = json.loads(spec) if spec.startswith("[") else [spec]
+
+    missing = [name for name in requested if name not in names]
+    if missing:
+        raise ValueError(
+            f"Лист не найден: {', '.join(map(str, missing))}. Доступные листы: {', '.join(names)}"
+        )
+    return requested
+
+
+def _sheet_summary(filepath: Path, sheet_name: str, header_rows: Optional[int] = None) -> Dict[str, Any]:
+    """Сводка по листу: колонки, превью, число строк.
+
+    header_rows=None — плоский заголовок (excel_read), иначе многоуровневый
+    (excel_read_structured). Функция верхнего уровня, чтобы её можно было
+    отправить в пул процессов; полный DataFrame структурного чтения при этом
+    попадает в Feather-кэш на диске и доступен основному процессу.
+    """
+    if header_rows is None and _row_readable(filepath):
+        return _stream_sheet_summary(filepath, sheet_name)
+
+    if header_rows is None:
+        # Формат без построчного чтения (.xls без calamine) — полный путь через pandas
+        df = _cached_frame(
+            filepath, ("typed", sheet_name),
+            lambda: pd.read_excel(filepath, sheet_name=sheet_name, dtype=object)
+            .dropna(how="all").dropna(axis=1, how="all"),
+        )
+    else:
+        df = _cached_frame(
+            filepath, ("structured", sheet_name, header_rows),
+            lambda: _structured_frame(filepath, header_rows, sheet_name),
+        )
+    return {"sheet": sheet_name, "columns": [str(c) for c in df.columns],
+            "preview": df.head(EXCEL_PREVIEW_ROWS), "rows": len(df), "exact": True,
+            "memory": _frame_memory_line(df), "header_rows": df.attrs.get("header_rows", header_rows)}
+
+
+def _sheets_size(filepath: Path, sheets: list) -> int:
+    """Объём работы по листам: размер распакованного XML (или файла для не-xlsx)."""
+    if filepath.suffix.lower() not in EXCEL_STREAMABLE_SUFFIXES:
+        return filepath.stat().st_size
+    members = _xlsx_sheet_members(filepath)
+    with zipfile.ZipFile(filepath) as zf:
+        return sum(zf.getinfo(members[name]).file_size for name in sheets)
+
+
+def _read_sheet_summaries(filepath: Path, sheets: list, header_rows: Optional[int] = None) -> list:
+    """Сводки по листам. Незакэшированные листы большой книги разбираются
+    параллельно в пуле процессов — время ≈ времени самого большого листа."""
+    def variant(name):
+        return ("summary", name, header_rows)
+
+    missing = [name for name in sheets if not _workbook_cache.contains(filepath, variant(name))]
+    futures = {}
+    if len(missing) > 1 and _sheets_size(filepath, missing) >= PARALLEL_MIN_BYTES:
+        pool = _get_process_pool()
+        futures = {name: pool.submit(_sheet_summary, filepath, name, header_rows) for name in missing}
+        logger.info(f"{filepath.name}: {len(missing)} листов разбираются параллельно")
+
+    summaries = []
+    for name in sheets:
+        def load(name=name):
+            local = lambda: _sheet_summary(filepath, name, header_rows)
+            return _pool_result(futures[name], local) if name in futures else local()
+        summaries.append(_workbook_cache.get_frame(filepath, variant(name), load))
+    return summaries
+
+
+# ============ EXCEL: ПОСТРАНИЧНОЕ ЧТЕНИЕ ============
+
+EXCEL_PAGE_ROWS = 50
+EXCEL_PAGE_MAX_ROWS = 1000
+CURSOR_TTL_SEC = int(os.getenv("CURSOR_TTL_MIN", "30")) * 60
+CURSOR_MAX_ENTRIES = 64
+
+
+def _sheet_table(filepath: Path, sheet_name: Optional[str] = None) -> "pd.DataFrame":
+    """Весь лист как таблица (заголовок — первая непустая строка), через кэши."""
+    if not _row_readable(filepath):
+        return _cached_frame(
+            filepath, ("typed", sheet_name),
+            lambda: pd.read_excel(filepath, sheet_name=sheet_name or 0, dtype=object)
+            .dropna(how="all").dropna(axis=1, how="all"),
+        )
+
+    def load():
+        raw = _sheet_frame(filepath, sheet_name)
+        if raw.empty:
+            return raw
+        body = raw.iloc[1:].reset_index(drop=True)
+        body.columns = _dedupe_headers(raw.iloc[0].tolist())
+        return body.dropna(axis=1, how="all")
+
+    return _cached_frame(filepath, ("table", sheet_name), load)
+
+
+def _sheet_page(filepath: Path, sheet_name: Optional[str], offset: int, limit: int) -> tuple:
+    """(строки страницы, всего строк) для листа.
+
+    Если лист уже разобран целиком (кэш в памяти или Feather) — срез
+    таблицы, иначе для xlsx — чтение только нужных строк по индексу.
+    """
+    variant = ("table", sheet_name)
+    cached = _workbook_cache.contains(filepath, variant) or _frame_store.has(filepath, variant)
+    if not cached and filepath.suffix.lower() in EXCEL_STREAMABLE_SUFFIXES:
+        try:
+            return _indexed_page(filepath, sheet_name, offset, limit)
+        except (ValueError, KeyError, ET.ParseError) as e:
+            logger.warning(f"Индекс строк {filepath.name} недоступен, читаю лист целиком: {e}")
+    df = _sheet_table(filepath, sheet_name)
+    return df.iloc[offset:offset + limit], len(df)
+
+
+class _CursorStore:
+    """Курсоры постраничного чтения: позиция в листе конкретной версии файла.
+
+    Держится не больше max_entries курсоров (вытесняются давно не
+    использованные), каждый живёт ttl секунд с последнего обращения.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._cursors: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, filepath: Path, sheet_name: Optional[str], position: int, limit: int) -> str:
+        token = uuid.uuid4().hex[:10]
+        st = filepath.stat()
+        with self._lock:
+            self._cursors[token] = {
+                "path": filepath, "sheet": sheet_name, "position": position, "limit": limit,
+                "stamp": (st.st_mtime_ns, st.st_size), "expires": time.monotonic() + self.ttl,
+            }
+            while len(self._cursors) > self.max_entries:
+                self._cursors.popitem(last=False)
+        return token
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        now = time.monotonic()
+        with self._lock:
+            for key in [k for k, c in self._cursors.items() if c["expires"] < now]:
+                del self._cursors[key]
+            cursor = self._cursors.get(token)
+            if cursor is not None:
+                cursor["expires"] = now + self.ttl
+                self._cursors.move_to_end(token)
+            return cursor
+
+    def close(self, token: str) -> None:
+        with self._lock:
+            self._cursors.pop(token, None)
+
+
+_cursors = _CursorStore(CURSOR_MAX_ENTRIES, CURSOR_TTL_SEC)
+
+
+def _read_page(filepath: Path, sheet_name: Optional[str], offset: int, limit: int,
+               token: Optional[str] = None) -> str:
+    """Страница листа и курсор на следующую (новый или продвинутый token)."""
+    page, total = _sheet_page(filepath, sheet_name, offset, limit)
+    end = offset + len(page)
+
+    lines = [f"Файл: {filepath.name}", f"Лист: {sheet_name or _sheet_names(filepath)[0]}"]
+    if len(page):
+        lines.append(f"Строки {offset + 1}–{end} из {total}\n")
+        lines.append(page.to_string(index=False))
+    else:
+        lines.append(f"Строк после {offset} нет (всего {total})")
+
+    if end < total:
+        if token is None:
+            token = _cursors.open(filepath, sheet_name, end, limit)
+        else:
+            _cursors.get(token)["position"] = end
+        lines.append(f'\nДальше: excel_read(cursor="{token}") — строки {end + 1}–{min(end + limit, total)}')
+    elif token is not None:
+        _cursors.close(token)
+    return "\n".join(lines)
+
+
+def _format_sheet_summary(summary: Dict[str, Any], preview_rows: int) -> str:
+    rows_label = str(summary["rows"]) if summary["exact"] else f"≈{summary['rows']} (по размеру листа)"
+    preview = summary["preview"].head(preview_rows).to_string(index=False)
+    return (
+        f"Лист: {summary['sheet']}\n"
+        f"Строк: {rows_label}\n"
+        f"Колонок: {len(summary['columns'])}\n"
+        f"Колонки: {', '.join(summary['columns'])}\n"
+        + (f"{summary['memory']}\n" if summary.get("memory") else "")
+        + f"\nПервые строки:\n{preview}"
+    )
+
+
+@tool
+def excel_read(filename: str = "", sheet_name: str = None, offset: int = None,
+               limit: int = None, cursor: str = "") -> str:
+    """Чтение Excel с автоматической обработкой merged cells.
+
+    Большие .xlsx читаются потоково (превью, колонки, число строк),
+    без загрузки всего листа в память. Несколько листов большой книги
+    разбираются параллельно. Дальше превью — постранично: offset/limit
+    или курсор из предыдущего ответа (страницы не разбирают файл заново).
+    С python-calamine книги (включая .xls, .xlsb, .ods) читаются им.
+
+    Args:
+        filename: Имя файла (ищет в outputs/, work/ и по абсолютному пути)
+        sheet_name: Имя листа (по умолчанию — первый), "all" — все листы,
+            или JSON-список: ["Январь", "Февраль"]
+        offset: С какой строки данных читать страницу (0 — первая после заголовка)
+        limit: Размер страницы (по умолчанию 50, максимум 1000)
+        cursor: Курсор из ответа excel_read — следующая страница того же листа
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: openpyxl / pandas не установлен"
+
+    try:
+        if cursor:
+            state = _cursors.get(cursor)
+            if state is None:
+                return f"Курсор {cursor} не найден или истёк — начни заново с excel_read(filename, offset=...)"
+            st = state["path"].stat()
+            if (st.st_mtime_ns, st.st_size) != state["stamp"]:
+                _cursors.close(cursor)
+                return f"Файл {state['path'].name} изменился после открытия курсора — начни чтение заново"
+            page_limit = max(1, min(int(limit or state["limit"]), EXCEL_PAGE_MAX_ROWS))
+            state["limit"] = page_limit
+            return _read_page(state["path"], state["sheet"], state["position"], page_limit, cursor)
+
+        filepath = _resolve_file(filename)
+        if not filepath:
+            return f"Файл не найден: {filename} (проверены: outputs/, work/)"
+
+        sheets = _parse_sheet_spec(filepath, sheet_name)
+
+        if offset is not None or limit is not None:
+            if len(sheets) > 1:
+                return "Ошибка: постраничное чтение — для одного листа, укажи sheet_name"
+            page_limit = max(1, min(int(limit or EXCEL_PAGE_ROWS), EXCEL_PAGE_MAX_ROWS))
+            return _read_page(filepath, sheets[0], max(0, int(offset or 0)), page_limit)
+
+        summaries = _read_sheet_summaries(filepath, sheets)
+
+        if len(summaries) == 1:
+            summary = summaries[0]
+            text = f"Файл: {filepath.name}\n" + _format_sheet_summary(summary, EXCEL_PREVIEW_ROWS)
+            if summary["rows"] > EXCEL_PREVIEW_ROWS:
+                token = _cursors.open(filepath, sheets[0], EXCEL_PREVIEW_ROWS, EXCEL_PAGE_ROWS)
+                text += f'\n\nДальше: excel_read(cursor="{token}") — следующие {EXCEL_PAGE_ROWS} строк'
+            return text
+
+        return f"Файл: {filepath.name}\nЛистов: {len(summaries)}\n\n" + "\n\n".join(
+            f"=== {_format_sheet_summary(summary, EXCEL_MULTI_PREVIEW_ROWS)}" for summary in summaries
+        )
+
+    except Exception as e:
+        return f"Ошибка чтения: {e}"
+
+
+def _coerce_cell_value(value: Any) -> Any:
+    """Авто-приведение типов: формула (=...) как есть, затем число, иначе строка."""
+    if isinstance(value, str):
+        if value.startswith("="):
+            # Формула — оставляем как есть
+            return value
+        # Пробуем число
+        try:
+            if "." in value:
+                return float(value)
+            return int(value)
+        except ValueError:
+            return value  # Строка
+    return value
+
+
+def _get_sheet(wb, sheet_name: Optional[str] = None):
+    """Лист по имени или активный, если имя не указано."""
+    if not sheet_name:
+        return wb.active
+    if sheet_name not in wb.sheetnames:
+        raise ValueError(
+            f"Лист не найден: {sheet_name}. Доступные листы: {', '.join(wb.sheetnames)}"
+        )
+    return wb[sheet_name]
+
+
+@tool
+def excel_edit_cell(filename: str, cell: str, value: str) -> str:
+    """Изменить ячейку в Excel.
+
+    Автоматически определяет тип: число, формула или строка.
+
+    Args:
+        filename: Имя файла
+        cell: Адрес ячейки (напр. "A1", "B5")
+        value: Значение (строка, число или формула начинающаяся с =)
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: openpyxl не установлен"
+
+    try:
+        filepath = _resolve_file(filename)
+        if not filepath:
+            return f"Файл не найден: {filename}"
+
+        parsed_value = _coerce_cell_value(value)
+
+        with _editing_workbook(filepath) as wb:
+            ws = wb.active
+            cell_obj = ws[cell]
+            cell_obj.value = parsed_value
+            engine = _save_with_values(wb, filepath, {(ws.title, cell_obj.row, cell_obj.column)})
+
+        type_label = "формула" if str(value).startswith("=") else type(parsed_value).__name__
+        summary = _recalc_summary(engine)
+        return f"✓ Ячейка {cell} = {parsed_value} ({type_label})" + (f"\n{summary}" if summary else "")
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+@tool
+def excel_edit_cells(filename: str, edits: str) -> str:
+    """Изменить много ячеек за один вызов: одна загрузка и одно сохранение файла.
+
+    Типы приводятся так же, как в excel_edit_cell (число, формула, строка).
+
+    Args:
+        filename: Имя файла
+        edits: JSON-массив правок, например:
+            [{"cell": "A1", "value": "Итого"},
+             {"cell": "B2", "value": "42", "sheet": "Лист2"},
+             {"range": "C2:C100", "value": "=A2*B2"}]
+            "range" заполняет весь диапазон одним значением; формула при этом
+            сдвигается по строкам/столбцам, как при протягивании в Excel.
+            "sheet" — имя листа (по умолчанию активный).
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: openpyxl не установлен"
+
+    try:
+        filepath = _resolve_file(filename)
+        if not filepath:
+            return f"Файл не найден: {filename}"
+
+        edit_list = json.loads(edits)
+        if not isinstance(edit_list, list):
+            return "Ошибка: edits должен быть JSON-массивом"
+
+        total = 0
+        changed = 0
+        sheets = set()
+        changed_cells = set()
+
+        with _editing_workbook(filepath) as wb:
+            for item in edit_list:
+                ws = _get_sheet(wb, item.get("sheet"))
+                sheets.add(ws.title)
+                value = _coerce_cell_value(item.get("value"))
+
+                if "range" in item:
+                    min_col, min_row, max_col, max_row = range_boundaries(item["range"])
+                    origin = f"{get_column_letter(min_col)}{min_row}"
+                    is_formula = isinstance(value, str) and value.startswith("=")
+                    targets = (
+                        (row, col)
+                        for row in range(min_row, max_row + 1)
+                        for col in range(min_col, max_col + 1)
+                    )
+                elif "cell" in item:
+                    origin, is_formula = None, False
+                    cell_obj = ws[item["cell"]]
+                    targets = [(cell_obj.row, cell_obj.column)]
+                else:
+                    raise ValueError(f"Нужен ключ \"cell\" или \"range\": {item}")
+
+                for row, col in targets:
+                    new_value = value
+                    if is_formula:
+                        new_value = Translator(value, origin=origin).translate_formula(
+                            f"{get_column_letter(col)}{row}"
+                        )
+                    cell_obj = ws.cell(row=row, column=col)
+                    total += 1
+                    if cell_obj.value != new_value:
+                        cell_obj.value = new_value
+                        changed += 1
+                        changed_cells.add((ws.title, row, col))
+
+            started = time.perf_counter()
+            summary = ""
+            if changed:
+                summary = _recalc_summary(_save_with_values(wb, filepath, changed_cells))
+            elapsed = time.perf_counter() - started
+
+        return (
+            f"✓ {filepath.name}: изменено {changed} из {total} ячеек "
+            f"(листы: {', '.join(sorted(sheets)) or '—'})\n"
+            f"Сохранение: {elapsed:.2f} сек" + ("" if changed else " (без изменений, файл не перезаписан)")
+            + (f"\n{summary}" if summary else "")
+        )
+    except json.JSONDecodeError as e:
+        return f"Ошибка парсинга JSON edits: {e}"
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+# ============ EXCEL: ДОЗАПИСЬ СТРОК ============
+#
+# excel_append_rows не открывает книгу: строки дописываются в журнал
+# (JSONL) в CACHE_DIR/append, по одному на файл. Книга собирается одним
+# сохранением — по flush, перед любым обращением к файлу через
+# _resolve_file и в конце сессии (atexit). Журнал переживает падение
+# процесса: незаписанные строки дольются при следующем обращении.
+
+APPEND_DIR = CACHE_DIR / "append"
+# Буфер больше этого числа строк сбрасывается в книгу сразу
+APPEND_BUFFER_MAX_ROWS = int(os.getenv("APPEND_BUFFER_MAX_ROWS", "50000"))
+
+_append_lock = threading.RLock()
+_append_counts: Dict[Path, int] = {}
+
+
+def _append_sidecar(filepath: Path) -> Path:
+    digest = hashlib.blake2b(str(filepath.resolve()).encode(), digest_size=8).hexdigest()
+    return APPEND_DIR / f"{filepath.stem}-{digest}.jsonl"
+
+
+def _has_pending_appends(filepath: Path) -> bool:
+    return _append_sidecar(filepath).exists()
+
+
+def _discard_appends(filepath: Path) -> None:
+    """Файл создаётся заново — недописанные строки прежней книги отбрасываются,
+    иначе следующий flush дольёт их в новую книгу."""
+    sidecar = _append_sidecar(filepath)
+    with _append_lock:
+        sidecar.unlink(missing_ok=True)
+        _append_counts.pop(sidecar, None)
+
+
+def _buffer_appends(filepath: Path, sheet_name: Optional[str], rows: list) -> int:
+    """Дописывает строки в журнал файла; возвращает число строк в буфере."""
+    sidecar = _append_sidecar(filepath)
+    lines = [json.dumps({"sheet": sheet_name, "row": row}, ensure_ascii=False, default=str) for row in rows]
+    with _append_lock:
+        if not sidecar.exists():
+            APPEND_DIR.mkdir(parents=True, exist_ok=True)
+            lines.insert(0, json.dumps({"target": str(filepath.resolve())}, ensure_ascii=False))
+            _append_counts[sidecar] = 0
+        elif sidecar not in _append_counts:
+            with open(sidecar, "rb") as fh:
+                _append_counts[sidecar] = sum(1 for _ in fh) - 1
+        with open(sidecar, "a", encoding="utf-8") as fh:
+            fh.write("\n".join(lines) + "\n")
+        _append_counts[sidecar] += len(rows)
+        return _append_counts[sidecar]
+
+
+def _read_sidecar(sidecar: Path) -> tuple:
+    """(целевой путь, записи) из журнала; оборванная последняя строка пропускается."""
+    target, entries = None, []
+    with open(sidecar, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"{sidecar.name}: пропущена повреждённая строка журнала")
+                continue
+            if "target" in item:
+                target = Path(item["target"])
+            else:
+                entries.append(item)
+    return target, entries
+
+
+def _append_to_sheet(ws, rows: list, changed: set) -> None:
+    """Добавляет строки в конец листа; объекты раскладываются по заголовкам первой строки."""
+    header = None
+    for row in rows:
+        if isinstance(row, dict):
+            if header is None:
+                has_header = ws.max_row > 1 or any(c.value is not None for c in ws[1])
+                header = [str(c.value) if c.value is not None else "" for c in ws[1]] if has_header else []
+            for key in row:
+                if key not in header:
+                    header.append(key)
+                    ws.cell(row=1, column=len(header), value=key)
+                    changed.add((ws.title, 1, len(header)))
+            row = [row.get(name) for name in header]
+        # Пустой новый лист: первая строка пишется в A1, а не во вторую строку
+        if ws.max_row == 1 and all(c.value is None for c in ws[1]):
+            for col, value in enumerate(row, 1):
+                ws.cell(row=1, column=col, value=value)
+        else:
+            ws.append(row)
+        row_idx = ws.max_row
+        changed.update((ws.title, row_idx, col) for col, value in enumerate(row, 1) if value is not None)
+
+
+def _flush_appends(filepath: Path) -> Optional[Dict[str, Any]]:
+    """Записывает буфер строк в книгу одним сохранением. None — буфер пуст."""
+    sidecar = _append_sidecar(filepath)
+    with _append_lock:
+        if not sidecar.exists():
+            return None
+        _, entries = _read_sidecar(sidecar)
+        started = time.perf_counter()
+        changed: set = set()
+        by_sheet: Dict[Optional[str], list] = {}
+        for item in entries:
+            by_sheet.setdefault(item.get("sheet"), []).append(item["row"])
+
+        with _workbook_cache.path_lock(filepath):
+            if filepath.exists():
+                wb = _workbook_cache.get_workbook(filepath)
+            else:
+                wb = openpyxl.Workbook()
+                first = next(iter(by_sheet), None)
+                if first:
+                    wb.active.title = first
+            try:
+                for sheet_name, rows in by_sheet.items():
+                    if sheet_name and sheet_name not in wb.sheetnames:
+                        wb.create_sheet(sheet_name)
+                    _append_to_sheet(_get_sheet(wb, sheet_name), rows, changed)
+                engine = _save_with_values(wb, filepath, changed)
+            except Exception:
+                _workbook_cache.invalidate(filepath)
+                raise
+
+        sidecar.unlink()
+        _append_counts.pop(sidecar, None)
+        logger.info(f"{filepath.name}: из буфера записано {len(entries)} строк")
+        return {"rows": len(entries), "sheets": [s or wb.active.title for s in by_sheet],
+                "seconds": time.perf_counter() - started, "engine": engine}
+
+
+def _flush_all_appends() -> None:
+    """Конец сессии: дописать все буферы (в том числе оставшиеся от прошлого запуска)."""
+    if not APPEND_DIR.exists():
+        return
+    for sidecar in APPEND_DIR.glob("*.jsonl"):
+        try:
+            target, _ = _read_sidecar(sidecar)
+            if target is not None:
+                _flush_appends(target)
+        except Exception as e:
+            logger.error(f"Не удалось записать буфер {sidecar.name}: {e}")
+
+
+atexit.register(_flush_all_appends)
+
+
+@tool
+def excel_append_rows(filename: str, rows: str, sheet_name: str = None, flush: bool = False) -> str:
+    """Дописать строки в конец листа Excel — для данных, которые собираются по частям.
+
+    Строки копятся в буфере и попадают в книгу одним сохранением: при
+    flush=true, при любом чтении или изменении файла другими инструментами
+    и в конце сессии. Тысяча вызовов стоит одной записи книги. Файл
+    создаётся, если его нет.
+
+    Args:
+        filename: Имя файла .xlsx (новый создаётся в outputs/)
+        rows: JSON-массив строк: [["Анна", 25], ["Борис", 31]] или объектов
+            [{"Имя": "Анна", "Возраст": 25}] — объекты раскладываются по
+            заголовкам первой строки листа, новые ключи добавляются колонками
+        sheet_name: Лист (по умолчанию активный; если нет — создаётся)
+        flush: Сразу записать буфер в файл
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: openpyxl не установлен"
+
+    try:
+        filepath = _resolve_file(filename, must_exist=False, flush_appends=False)
+        if filepath.suffix.lower() not in EXCEL_STREAMABLE_SUFFIXES:
+            return f"Ошибка: дозапись поддерживается для {', '.join(sorted(EXCEL_STREAMABLE_SUFFIXES))}"
+
+        row_list = json.loads(rows) if isinstance(rows, str) else rows
+        if not isinstance(row_list, list) or not all(isinstance(r, (list, dict)) for r in row_list):
+            return "Ошибка: rows должен быть JSON-массивом строк (массивов или объектов)"
+
+        buffered = _buffer_appends(filepath, sheet_name, row_list) if row_list else 0
+        if not flush and buffered < APPEND_BUFFER_MAX_ROWS:
+            return (
+                f"✓ {filepath.name}: в буфер добавлено {len(row_list)} строк (всего в буфере {buffered}).\n"
+                f"Файл запишется при чтении, flush=true или в конце сессии"
+            )
+
+        result = _flush_appends(filepath)
+        if result is None:
+            return f"✓ {filepath.name}: буфер пуст, записывать нечего"
+        summary = _recalc_summary(result["engine"])
+        return (
+            f"✓ {filepath.name}: записано {result['rows']} строк одним сохранением "
+            f"(листы: {', '.join(result['sheets'])}, {result['seconds']:.2f} сек)"
+            + (f"\n{summary}" if summary else "")
+        )
+    except json.JSONDecodeError as e:
+        return f"Ошибка парсинга JSON rows: {e}"
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+def _detect_encoding(sample: bytes, truncated: bool) -> str:
+    """Кодировка по первым байтам файла: BOM, затем UTF-8, затем cp1251/latin-1."""
+    if sample.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    if sample.startswith((b"\xff\xfe", b"\xfe\xff")):
+        return "utf-16"
+
+    if truncated:
+        # Не режем многобайтовый символ на границе выборки
+        cut = sample.rfind(b"\n")
+        sample = sample[:cut] if cut > 0 else sample[:-4]
+    try:
+        sample.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    # В русском cp1251-тексте большинство букв — байты 0xC0–0xFF,
+    # в западном latin-1 такие байты встречаются эпизодически (диакритика)
+    high = sum(1 for b in sample if b >= 0xC0)
+    ascii_letters = sum(1 for b in sample if 0x41 <= b <= 0x7A)
+    return "cp1251" if high > 0.3 * (high + ascii_letters) else "latin-1"
+
+
+def _detect_separator(text: str) -> str:
+    """Разделитель через csv.Sniffer; запасной вариант — самый стабильный по строкам."""
+    lines = [line for line in text.splitlines()[:50] if line.strip()]
+    sample = "\n".join(lines)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+    except csv.Error:
+        pass
+
+    best, best_score = ",", -1
+    for sep in (",", ";", "\t", "|"):
+        counts = [line.count(sep) for line in lines]
+        if not counts or counts[0] == 0:
+            continue
+        score = sum(1 for c in counts if c == counts[0])
+        if score > best_score:
+            best, best_score = sep, score
+    return best
+
+
+def _sniff_csv(csv_path: Path) -> tuple:
+    """(кодировка, разделитель) по первым CSV_SNIFF_BYTES байтам файла."""
+    with open(csv_path, "rb") as f:
+        sample = f.read(CSV_SNIFF_BYTES)
+    truncated = len(sample) == CSV_SNIFF_BYTES
+    encoding = _detect_encoding(sample, truncated)
+    text = sample.decode(encoding, errors="ignore")
+    return encoding, _detect_separator(text)
+
+
+def _header_cells(ws, columns) -> list:
+    """Строка заголовка для write-only листа: общий стиль шапки без рамок."""
+    header = _register_style(ws.parent, "header", borders=False)
+    return _styled_cells(ws, [str(name) for name in columns], header)
+
+
+@tool
+def excel_from_csv(csv_filename: str, excel_filename: str) -> str:
+    """Конвертировать CSV в Excel.
+
+    Автоматически определяет кодировку (utf-8, cp1251, latin-1)
+    и разделитель (запятая, точка с запятой, табуляция) по началу файла,
+    затем читает CSV чанками и пишет потоково. Строки сверх лимита Excel
+    (1 048 576) переносятся на следующие листы (Data, Data_2, ...).
+
+    Args:
+        csv_filename: Имя CSV-файла
+        excel_filename: Имя выходного Excel-файла
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: pandas не установлен"
+
+    try:
+        csv_path = _resolve_file(csv_filename)
+        if not csv_path:
+            return f"CSV не найден: {csv_filename}"
+
+        enc, sep = _sniff_csv(csv_path)
+        total_bytes = max(csv_path.stat().st_size, 1)
+        started = time.perf_counter()
+        # Куски не больше, чем позволяет бюджет памяти
+        plan = _table_plan(csv_path)
+        chunk_rows = min(CSV_CHUNK_ROWS, plan["chunk_rows"] or CSV_CHUNK_ROWS)
+        n_chunks = 0
+
+        wb = openpyxl.Workbook(write_only=True)
+        ws = None
+        sheets = 0
+        sheet_rows = 0
+        n_rows = 0
+        columns: list = []
+
+        with open(csv_path, "rb") as fh:
+            reader = pd.read_csv(fh, encoding=enc, sep=sep, chunksize=chunk_rows)
+            for chunk in reader:
+                n_chunks += 1
+                if not columns:
+                    columns = list(chunk.columns)
+                # NaN → пустая ячейка
+                chunk = chunk.astype(object).where(chunk.notna(), None)
+
+                for row in chunk.itertuples(index=False, name=None):
+                    if ws is None or sheet_rows >= EXCEL_MAX_ROWS:
+                        sheets += 1
+                        ws = wb.create_sheet("Data" if sheets == 1 else f"Data_{sheets}")
+                        ws.append(_header_cells(ws, columns))
+                        sheet_rows = 1
+                    ws.append(row)
+                    sheet_rows += 1
+                n_rows += len(chunk)
+
+                logger.info(
+                    f"CSV → Excel {csv_path.name}: {n_rows} строк "
+                    f"({min(fh.tell() / total_bytes, 1):.0%})"
+                )
+
+        if ws is None:
+            ws = wb.create_sheet("Data")
+            if columns:
+                ws.append(_header_cells(ws, columns))
+            sheets = 1
+
+        excel_path = OUTPUT_DIR / excel_filename
+        _discard_appends(excel_path)
+        wb.save(excel_path)
+        _workbook_cache.invalidate(excel_path)
+
+        return (
+            f"✓ Создан {excel_filename}\n"
+            f"  Строк: {n_rows}, Колонок: {len(columns)}"
+            + (f", Листов: {sheets}" if sheets > 1 else "") + "\n"
+            f"  Кодировка: {enc}, Разделитель: {repr(sep)}\n"
+            f"  Режим: потоково, {n_chunks} част. по {chunk_rows} строк"
+            + (f" (≈{_format_bytes(plan['estimate'])} больше бюджета "
+               f"{_format_bytes(DATA_MEMORY_BUDGET_BYTES)})" if plan["mode"] == "chunked" else "") + "\n"
+            f"  Время: {time.perf_counter() - started:.1f} сек"
+        )
+    except pd.errors.EmptyDataError:
+        return "CSV пустой — нечего конвертировать"
+    except (UnicodeDecodeError, pd.errors.ParserError) as e:
+        return f"Не удалось прочитать CSV — неизвестная кодировка или формат: {e}"
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+def extract_multilevel_headers(ws, max_header_rows: int = 3) -> list:
+    """Извлекает многоуровневые заголовки.
+
+    Защита от «рваных» заголовков (разное количество колонок в строках).
+    """
+    rows = ws.iter_rows(min_row=1, max_row=max_header_rows, values_only=True)
+    return _build_multilevel_headers(rows)
+
+
+def _build_multilevel_headers(rows) -> list:
+    """Склеивает строки заголовков в имена колонок через " | "."""
+    header_matrix = []
+
+    for row in rows:
+        header_matrix.append([str(c).strip() if c else "" for c in row])
+
+    if not header_matrix:
+        return []
+
+    # Определяем максимальную ширину по всем строкам
+    max_cols = max(len(row) for row in header_matrix)
+
+    # Выравниваем строки до одинаковой длины
+    for i, row in enumerate(header_matrix):
+        if len(row) < max_cols:
+            header_matrix[i] = row + [""] * (max_cols - len(row))
+
+    headers = []
+    for col_idx in range(max_cols):
+        parts = []
+        for row_idx in range(len(header_matrix)):
+            val = header_matrix[row_idx][col_idx]
+            if val and (not parts or val != parts[-1]):
+                parts.append(val)
+        headers.append(" | ".join(parts) if parts else f"Column_{col_idx + 1}")
+
+    return headers
+
+
+HEADER_DETECT_MAX_ROWS = 4
+HEADER_DETECT_SAMPLE_ROWS = 20
+
+
+def _detect_header_rows(rows: list) -> int:
+    """Сколько первых строк занимает шапка.
+
+    Первая строка — всегда заголовок. Следующая строка тоже считается шапкой,
+    если в ней только текст и либо под ней в той же колонке идут числа/даты
+    (значит, текст — подпись, а не данные), либо строка выше — групповая:
+    пустые ячейки или повторы от объединённых ячеек над разными подписями.
+    """
+    if not rows:
+        return 1
+    sample = [r for r in rows[HEADER_DETECT_MAX_ROWS:] if not _is_empty_row(r)] or rows[1:]
+    width = max(len(r) for r in rows)
+
+    def cell(row, idx):
+        return row[idx] if idx < len(row) else None
+
+    typed_cols = set()
+    for idx in range(width):
+        values = [cell(r, idx) for r in sample]
+        values = [v for v in values if v is not None and v != ""]
+        if values and sum(not isinstance(v, str) for v in values) * 2 > len(values):
+            typed_cols.add(idx)
+
+    count = 1
+    for row_idx in range(1, min(HEADER_DETECT_MAX_ROWS, len(rows))):
+        row, above = rows[row_idx], rows[row_idx - 1]
+        filled = [idx for idx in range(width) if cell(row, idx) not in (None, "")]
+        if not filled or not all(isinstance(cell(row, idx), str) for idx in filled):
+            break
+        over_typed = any(idx in typed_cols for idx in filled)
+        grouped = any(
+            cell(above, idx) in (None, "")
+            or (idx > 0 and cell(above, idx) == cell(above, idx - 1)
+                and cell(row, idx) != cell(row, idx - 1))
+            for idx in filled
+        )
+        if not (over_typed or grouped):
+            break
+        count += 1
+    return count
+
+
+def _structured_frame(filepath: Path, header_rows: int, sheet_name: Optional[str] = None) -> "pd.DataFrame":
+    """DataFrame листа с многоуровневыми заголовками за один проход по строкам.
+
+    Шапка — первые header_rows строк потока (merged cells уже заполнены),
+    тело — оставшиеся строки того же итератора. header_rows=0 — число строк
+    шапки определяется по началу листа (_detect_header_rows); ведущие пустые
+    строки при этом пропускаются. Итог кладётся в df.attrs["header_rows"].
+    """
+    source = _iter_sheet_rows(filepath, sheet_name)
+    rows = source
+    try:
+        if header_rows:
+            header_matrix = [row for _, row in zip(range(header_rows), rows)]
+        else:
+            rows = itertools.dropwhile(_is_empty_row, rows)
+            head = list(itertools.islice(rows, HEADER_DETECT_MAX_ROWS + HEADER_DETECT_SAMPLE_ROWS))
+            header_rows = _detect_header_rows(head)
+            header_matrix = head[:header_rows]
+            rows = itertools.chain(head[header_rows:], rows)
+        headers = _build_multilevel_headers(header_matrix)
+        records = [row for row in rows if not _is_empty_row(row)]
+    finally:
+        source.close()
+
+    df = pd.DataFrame.from_records(records) if records else pd.DataFrame()
+    if len(headers) < len(df.columns):
+        headers += [f"Column_{i + 1}" for i in range(len(headers), len(df.columns))]
+    df.columns = headers[:len(df.columns)]
+    df.attrs["header_rows"] = header_rows
+    return df
+
+
+@tool
+def excel_read_structured(filename: str, header_rows: int = 0, sheet_name: str = None) -> str:
+    """Чтение Excel с многоуровневыми заголовками.
+
+    Args:
+        filename: Имя файла
+        header_rows: Количество строк заголовков (по умолчанию 0 — определить
+            автоматически по типам значений и объединённым ячейкам)
+        sheet_name: Имя листа (по умолчанию — первый), "all" — все листы,
+            или JSON-список имён листов
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: openpyxl / pandas не установлен"
+
+    try:
+        filepath = _resolve_file(filename)
+        if not filepath:
+            return f"Файл не найден: {filename}"
+        if header_rows < 0:
+            return "Ошибка: header_rows должен быть ≥ 0 (0 — определить автоматически)"
+
+        sheets = _parse_sheet_spec(filepath, sheet_name)
+        summaries = _read_sheet_summaries(filepath, sheets, header_rows=header_rows)
+        preview_rows = EXCEL_PREVIEW_ROWS if len(summaries) == 1 else EXCEL_MULTI_PREVIEW_ROWS
+
+        parts = []
+        for summary in summaries:
+            preview = summary["preview"].head(preview_rows).to_string(index=False)
+            parts.append(
+                f"Лист: {summary['sheet']}\n"
+                f"Заголовков уровней: {summary['header_rows']}"
+                + (" (определено автоматически)" if not header_rows else "") + "\n"
+                f"Строк: {summary['rows']}\n"
+                f"Колонок: {len(summary['columns'])}\n"
+                + (f"{summary['memory']}\n" if summary.get("memory") else "")
+                + "\nИмена колонок:\n" + "\n".join(f"- {c}" for c in summary["columns"])
+                + "\n\nПервые строки:\n" + preview
+            )
+
+        return f"Файл: {filepath.name}\n\n" + "\n\n".join(parts)
+
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+# ============ ЗАПРОСЫ К ТАБЛИЦАМ ============
+
+QUERY_MAX_LIMIT = 500
+QUERY_AGG_FUNCS = {"sum", "mean", "count", "min", "max", "median", "std", "nunique"}
+
+
+def _coerce_filter_value(series: "pd.Series", value: Any) -> Any:
+    """Приводит значение фильтра к типу колонки (строка "100" для числовой и т.п.)."""
+    if isinstance(value, list):
+        return [_coerce_filter_value(series, v) for v in value]
+    if isinstance(value, str):
+        if pd.api.types.is_numeric_dtype(series):
+            return pd.to_numeric(value)
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return pd.to_datetime(value)
+    return value
+
+
+def _filter_mask(df: "pd.DataFrame", filters: list) -> "pd.Series":
+    """Векторная маска по списку условий {"column", "op", "value"} (логическое И)."""
+    mask = pd.Series(True, index=df.index)
+    for flt in filters:
+        column, op = flt["column"], flt.get("op", "==")
+        series = df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype) and op in (">", ">=", "<", "<=", "between"):
+            series = series.astype(object)  # неупорядоченные category сравниваются только на равенство
+        value = _coerce_filter_value(series, flt.get("value"))
+
+        if op == "==":
+            cond = series == value
+        elif op == "!=":
+            cond = series != value
+        elif op == ">":
+            cond = series > value
+        elif op == ">=":
+            cond = series >= value
+        elif op == "<":
+            cond = series < value
+        elif op == "<=":
+            cond = series <= value
+        elif op == "in":
+            cond = series.isin(value)
+        elif op == "not_in":
+            cond = ~series.isin(value)
+        elif op == "between":
+            cond = series.between(value[0], value[1])
+        elif op == "contains":
+            cond = series.astype(str).str.contains(str(value), case=False, regex=False, na=False)
+        elif op == "startswith":
+            cond = series.astype(str).str.startswith(str(value), na=False)
+        elif op == "isnull":
+            cond = series.isna()
+        elif op == "notnull":
+            cond = series.notna()
+        else:
+            raise ValueError(f"Неизвестная операция фильтра: {op}")
+        mask &= cond.fillna(False).astype(bool)
+    return mask
+
+
+def _parse_json_arg(value, default):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return default
+    return json.loads(value) if isinstance(value, str) else value
+
+
+@tool
+def excel_query(
+    filename: str,
+    columns: str = "",
+    filters: str = "",
+    group_by: str = "",
+    aggregates: str = "",
+    sort_by: str = "",
+    sheet_name: str = None,
+    offset: int = 0,
+    limit: int = 50,
+    sample: int = 0,
+) -> str:
+    """Выборка из Excel/CSV: колонки, фильтры, группировка, агрегаты, постранично.
+
+    Читаются только нужные колонки; повторные запросы к тому же файлу
+    используют кэш разбора. Используй вместо python_execute для фильтрации
+    и подсчётов.
+
+    Args:
+        filename: Имя файла (.xlsx, .xls, .csv)
+        columns: JSON-список колонок для вывода: ["Регион", "Выручка"] (пусто — все)
+        filters: JSON-список условий (объединяются через И):
+            [{"column": "Регион", "op": "==", "value": "Север"},
+             {"column": "Выручка", "op": ">", "value": 1000}]
+            op: ==, !=, >, >=, <, <=, in, not_in, between, contains, startswith, isnull, notnull
+        group_by: JSON-список колонок группировки: ["Регион"]
+        aggregates: JSON {"колонка": "функция" или ["функции"]}:
+            {"Выручка": ["sum", "mean"], "Заказ": "count"}
+            Функции: sum, mean, count, min, max, median, std, nunique
+        sort_by: Колонка сортировки, "-" в начале — по убыванию: "-Выручка_sum"
+        sheet_name: Лист Excel (по умолчанию первый)
+        offset: С какой строки результата показывать (для следующих страниц)
+        limit: Сколько строк показать (макс. 500)
+        sample: Для быстрой оценки по большому .xlsx — случайные N строк
+            вместо всего листа (суммы и количества тогда — по выборке)
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: pandas не установлен"
+
+    try:
+        filepath = _resolve_file(filename)
+        if not filepath:
+            return f"Файл не найден: {filename}"
+
+        columns_list = _parse_json_arg(columns, [])
+        filter_list = _parse_json_arg(filters, [])
+        group_list = _parse_json_arg(group_by, [])
+        agg_spec = _parse_json_arg(aggregates, {})
+        agg_spec = {col: ([funcs] if isinstance(funcs, str) else list(funcs)) for col, funcs in agg_spec.items()}
+
+        bad_funcs = {f for funcs in agg_spec.values() for f in funcs} - QUERY_AGG_FUNCS
+        if bad_funcs:
+            return f"Ошибка: неизвестные функции {', '.join(bad_funcs)}. Доступные: {', '.join(sorted(QUERY_AGG_FUNCS))}"
+
+        # Проекция: только колонки, которые реально участвуют в запросе
+        available = _table_columns(filepath, sheet_name)
+        needed = list(dict.fromkeys(
+            columns_list + [f["column"] for f in filter_list] + group_list + list(agg_spec)
+        ))
+        missing = [c for c in needed if c not in available]
+        if missing:
+            return (
+                f"Колонки не найдены: {', '.join(missing)}\n"
+                f"Доступные колонки: {', '.join(available)}"
+            )
+
+        sampled = None
+        full_variant = ("pandas", sheet_name or 0)
+        if (
+            sample and int(sample) > 0
+            and filepath.suffix.lower() in EXCEL_STREAMABLE_SUFFIXES
+            and not _workbook_cache.contains(filepath, full_variant)
+            and not _frame_store.has(filepath, full_variant)
+        ):
+            # Выборка по индексу строк: лист целиком не разбирается
+            try:
+                df, total_rows = _indexed_sample(filepath, sheet_name, int(sample))
+                df = df[needed] if needed else df
+                df = df.infer_objects()
+                sampled = len(df)
+            except (ValueError, KeyError, ET.ParseError) as e:
+                logger.warning(f"Индекс строк {filepath.name} недоступен, читаю лист целиком: {e}")
+        if sampled is None:
+            df = _read_table(filepath, sheet_name, columns=needed or None)
+            total_rows = len(df)
+
+        if filter_list:
+            df = df[_filter_mask(df, filter_list)]
+        matched = len(df)
+
+        if agg_spec or group_list:
+            named = {
+                f"{col}_{func}": pd.NamedAgg(column=col, aggfunc=func)
+                for col, funcs in agg_spec.items() for func in funcs
+            }
+            if group_list:
+                grouped = df.groupby(group_list, dropna=False, observed=True)
+                result = grouped.agg(**named) if named else grouped.size().to_frame("count")
+                result = result.reset_index()
+            else:
+                result = df.agg({col: funcs for col, funcs in agg_spec.items()})
+                result = pd.DataFrame([{
+                    f"{col}_{func}": result.at[func, col]
+                    for col, funcs in agg_spec.items() for func in funcs
+                }])
+        else:
+            result = df[columns_list] if columns_list else df
+
+        if sort_by:
+            key = sort_by.lstrip("-")
+            if key not in result.columns:
+                return f"Колонка сортировки не найдена: {key}. Доступные: {', '.join(map(str, result.columns))}"
+            result = result.sort_values(key, ascending=not sort_by.startswith("-"))
+
+        limit = max(1, min(int(limit), QUERY_MAX_LIMIT))
+        offset = max(0, int(offset))
+        page = result.iloc[offset:offset + limit]
+
+        lines = [
+            f"Файл: {filepath.name}",
+            f"Прочитано колонок: {len(needed) or len(available)} из {len(available)}, строк: {total_rows}",
+        ]
+        if sampled is not None:
+            lines.append(f"⚠️ По случайной выборке {sampled} из {total_rows} строк — суммы и количества по выборке")
+        if filter_list:
+            lines.append(f"Под фильтр попало: {matched}")
+        lines.append(f"Результат: {len(result)} строк × {len(result.columns)} колонок")
+        if len(page):
+            lines.append(f"Показаны строки {offset + 1}–{offset + len(page)}:\n")
+            lines.append(page.to_string(index=False))
+        else:
+            lines.append("На этой странице строк нет")
+        if offset + limit < len(result):
+            lines.append(f"\nСледующая страница: offset={offset + limit}")
+        return "\n".join(lines)
+
+    except json.JSONDecodeError as e:
+        return f"Ошибка парсинга JSON параметров: {e}"
+    except KeyError as e:
+        return f"Ошибка: не хватает ключа в условии {e}"
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+# ============ ТАБЛИЦЫ: СОЕДИНЕНИЕ (JOIN) ============
+#
+# table_join соединяет две таблицы (CSV/Excel) по ключевым колонкам hash
+# join'ом: меньшая по оценке объёма сторона загружается в память и служит
+# хэш-таблицей (merge pandas), большая идёт кусками. Если и меньшая сторона
+# не помещается в бюджет памяти, обе делятся по хэшу ключа на части на
+# диске (Grace hash join), и части соединяются попарно.
+
+JOIN_TYPES = ("inner", "left", "right", "outer")
+JOIN_OUTPUT_SUFFIXES = (".csv", ".xlsx", ".feather")
+# Одноимённые неключевые колонки: "Имя" слева, "Имя_2" справа
+JOIN_SUFFIXES = ("", "_2")
+_JOIN_ROW = "__join_row"
+
+
+class _TableSink:
+    """Потоковая запись таблицы кусками: CSV, xlsx (write-only, строки
+    сверх лимита Excel — на следующие листы) или Feather (поток Arrow IPC;
+    типы колонок берутся по первому куску)."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.kind = path.suffix.lower()
+        self.rows = 0
+        self.sheets = 0
+        self.columns: list = []
+        self._wb = None
+        self._ws = None
+        self._sheet_rows = 0
+        self._writer = None
+        self._schema = None
+        if self.kind == ".xlsx":
+            self._wb = openpyxl.Workbook(write_only=True)
+        elif self.kind == ".feather" and not ARROW_AVAILABLE:
+            raise ValueError("для .feather нужен pyarrow — выбери .csv или .xlsx")
+
+    def write(self, df: "pd.DataFrame") -> None:
+        if not self.columns:
+            self.columns = [str(c) for c in df.columns]
+        if df.empty:
+            return
+        if self.kind == ".csv":
+            df.to_csv(self.path, mode="a" if self.rows else "w", header=not self.rows,
+                      index=False, encoding="utf-8-sig" if not self.rows else "utf-8")
+        elif self.kind == ".xlsx":
+            self._write_xlsx(df)
+        else:
+            self._write_feather(df)
+        self.rows += len(df)
+
+    def _write_xlsx(self, df: "pd.DataFrame") -> None:
+        # NaN/NA → пустая ячейка
+        values = df.astype(object).where(df.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            if self._ws is None or self._sheet_rows >= EXCEL_MAX_ROWS:
+                self._new_sheet()
+            self._ws.append(row)
+            self._sheet_rows += 1
+
+    def _new_sheet(self) -> None:
+        self.sheets += 1
+        self._ws = self._wb.create_sheet("Data" if self.sheets == 1 else f"Data_{self.sheets}")
+        self._ws.append(_header_cells(self._ws, self.columns))
+        self._sheet_rows = 1
+
+    def _write_feather(self, df: "pd.DataFrame") -> None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._writer is None:
+            # Колонка без значений в первом куске — строковая, а не null
+            self._schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                for field in table.schema
+            ])
+            self._writer = pa.ipc.new_file(str(self.path), self._schema)
+        self._writer.write_table(table.cast(self._schema))
+
+    def close(self, columns: Optional[list] = None) -> None:
+        """Завершить файл; columns — заголовок, если не было ни одной строки."""
+        if not self.columns:
+            self.columns = [str(c) for c in columns or []]
+        if self.kind == ".xlsx":
+            if self._ws is None:
+                self._new_sheet()
+            self._wb.save(self.path)
+        elif self.kind == ".csv" and not self.rows:
+            pd.DataFrame(columns=self.columns).to_csv(self.path, index=False, encoding="utf-8-sig")
+        elif self.kind == ".feather":
+            if self._writer is None:
+                self._write_feather(pd.DataFrame(columns=self.columns))
+            self._writer.close()
+        _workbook_cache.invalidate(self.path)
+
+
+def _join_key_kind(series: "pd.Series") -> str:
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "date"
+    if pd.api.types.is_bool_dtype(series) or not pd.api.types.is_numeric_dtype(series):
+        return "text"
+    return "number"
+
+
+def _join_key_text(value: Any) -> Any:
+    """Строковый вид значения ключа из колонки смешанных типов — такой же,
+    как у колонки одного типа: 2024-01-05 для даты, 12 для 12.0."""
+    if isinstance(value, datetime):
+        if value.hour == value.minute == value.second == value.microsecond == 0:
+            return value.strftime("%Y-%m-%d")
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, (float, np.floating)) and float(value).is_integer():
+        return str(int(value))
+    return value
+
+
+def _normalize_join_key(series: "pd.Series", as_text: bool) -> "pd.Series":
+    """Ключ в сопоставимом виде: целые float (1.0 из колонок с пропусками) и
+    int → Int64; as_text — строка (ключи разных типов в двух файлах или
+    в разных кусках одного файла: куски типизируются по отдельности)."""
+    kind = _join_key_kind(series)
+    if kind == "number":
+        values = series.dropna()
+        if pd.api.types.is_integer_dtype(series) or bool((values % 1 == 0).all()):
+            series = series.astype("Int64")
+    if not as_text:
+        return series
+    if kind == "date" or series.dtype == object:
+        series = series.astype(object).map(_join_key_text, na_action="ignore")
+    return series.astype("string")
+
+
+def _normalize_join_keys(df: "pd.DataFrame", keys: list, as_text: tuple) -> "pd.DataFrame":
+    return df.assign(**{key: _normalize_join_key(df[key], text) for key, text in zip(keys, as_text)})
+
+
+def _join_text_flags(left: "pd.DataFrame", right: "pd.DataFrame", left_on: list, right_on: list) -> tuple:
+    """Для каждой пары ключей: сравнивать как строки (типы сторон различаются)."""
+    return tuple(
+        _join_key_kind(left[lk]) != _join_key_kind(right[rk]) for lk, rk in zip(left_on, right_on)
+    )
+
+
+def _join_partition(df: "pd.DataFrame", keys: list, partitions: int) -> "np.ndarray":
+    """Номер части для каждой строки — по хэшу строкового вида ключей,
+    чтобы 1 из CSV и 1.0 из Excel попали в одну часть."""
+    text = pd.DataFrame({key: _normalize_join_key(df[key], True) for key in keys})
+    return pd.util.hash_pandas_object(text, index=False).to_numpy() % partitions
+
+
+def _join_pair(left: "pd.DataFrame", right: "pd.DataFrame", left_on: list, right_on: list,
+               how: str) -> "pd.DataFrame":
+    """merge двух таблиц с приведёнными ключами."""
+    flags = _join_text_flags(left, right, left_on, right_on)
+    return _normalize_join_keys(left, left_on, flags).merge(
+        _normalize_join_keys(right, right_on, flags),
+        how=how, left_on=left_on, right_on=right_on, suffixes=JOIN_SUFFIXES,
+    )
+
+
+def _join_sides(left: Dict[str, Any], right: Dict[str, Any]) -> tuple:
+    """(build, probe): в память — сторона с меньшей оценкой объёма."""
+    for side in (left, right):
+        side["bytes"], side["rows"] = _estimate_table_bytes(side["path"], side["sheet"])
+    return (left, right) if left["bytes"] <= right["bytes"] else (right, left)
+
+
+def _side_chunks(side: Dict[str, Any]):
+    row_bytes = side["bytes"] / max(side["rows"], 1)
+    chunk_rows = _chunk_rows_for(row_bytes, DATA_MEMORY_BUDGET_BYTES)
+    return _iter_table_chunks(side["path"], side["sheet"], chunk_rows=chunk_rows)
+
+
+def _memory_hash_join(left: Dict[str, Any], right: Dict[str, Any], how: str,
+                      sink: _TableSink) -> Dict[str, Any]:
+    """Меньшая сторона — в памяти, большая — кусками.
+
+    Строки хэш-таблицы без пары (для right/outer, если она справа, и
+    left/outer, если слева) отмечаются по номеру строки и дописываются
+    в конце.
+    """
+    build, probe = _join_sides(left, right)
+    build_is_left = build is left
+    keep_unmatched = how == "outer" or how == ("left" if build_is_left else "right")
+    chunk_how = ("right" if build_is_left else "left") if how in ("outer", probe["side"]) else "inner"
+
+    # Хэш-таблица собирается из тех же кусков, что и поток другой стороны,
+    # чтобы ключи обеих сторон были типизированы одинаково
+    table = pd.concat(list(_side_chunks(build)), ignore_index=True)
+    if keep_unmatched:
+        table = table.assign(**{_JOIN_ROW: np.arange(len(table))})
+    matched = np.zeros(len(table), dtype=bool)
+    views: Dict[tuple, "pd.DataFrame"] = {}
+    template = None
+    chunks = 0
+
+    for chunk in _side_chunks(probe):
+        chunks += 1
+        flags = _join_text_flags(chunk, table, probe["on"], build["on"])
+        if flags not in views:
+            views[flags] = _normalize_join_keys(table, build["on"], flags)
+        view = views[flags]
+        chunk = _normalize_join_keys(chunk, probe["on"], flags)
+        template = (chunk.iloc[:0], view)
+        if build_is_left:
+            merged = view.merge(chunk, how=chunk_how, left_on=build["on"], right_on=probe["on"],
+                                suffixes=JOIN_SUFFIXES)
+        else:
+            merged = chunk.merge(view, how=chunk_how, left_on=probe["on"], right_on=build["on"],
+                                 suffixes=JOIN_SUFFIXES)
+        if keep_unmatched:
+            matched[merged[_JOIN_ROW].dropna().to_numpy(dtype=np.int64)] = True
+            merged = merged.drop(columns=_JOIN_ROW)
+        sink.write(merged)
+        logger.info(f"Join {probe['path'].name}: часть {chunks}, строк результата {sink.rows}")
+
+    if keep_unmatched and not matched.all():
+        if template is None:
+            columns = _table_columns(probe["path"], probe["sheet"])
+            flags = (True,) * len(build["on"])
+            template = (_normalize_join_keys(pd.DataFrame(columns=columns), probe["on"], flags),
+                        _normalize_join_keys(table, build["on"], flags))
+        empty, view = template
+        rest = view[~matched]
+        if build_is_left:
+            merged = rest.merge(empty, how="left", left_on=build["on"], right_on=probe["on"],
+                                suffixes=JOIN_SUFFIXES)
+        else:
+            merged = empty.merge(rest, how="right", left_on=probe["on"], right_on=build["on"],
+                                 suffixes=JOIN_SUFFIXES)
+        sink.write(merged.drop(columns=_JOIN_ROW))
+
+    return {"mode": "memory", "build": build, "probe": probe, "chunks": chunks}
+
+
+def _grace_hash_join(left: Dict[str, Any], right: Dict[str, Any], how: str,
+                     sink: _TableSink) -> Dict[str, Any]:
+    """Обе стороны делятся по хэшу ключа на части на диске, части
+    соединяются попарно — в памяти одновременно одна пара частей."""
+    build, _ = _join_sides(left, right)
+    partitions = max(SPILL_PARTITIONS, math.ceil(build["bytes"] * 2 / DATA_MEMORY_BUDGET_BYTES))
+    SPILL_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=SPILL_DIR) as tmp:
+        tmp = Path(tmp)
+        templates = {}
+        for side in (left, right):
+            for n, chunk in enumerate(_side_chunks(side)):
+                templates.setdefault(side["side"], chunk.iloc[:0])
+                part = _join_partition(chunk, side["on"], partitions)
+                for p in np.unique(part):
+                    # pickle, а не Feather: ключи бывают смешанных типов
+                    chunk[part == p].to_pickle(tmp / f"{side['side']}{p}_{n}.pkl")
+            logger.info(f"Join {side['path'].name}: разложен на {partitions} частей")
+            if side["side"] not in templates:
+                columns = _table_columns(side["path"], side["sheet"])
+                templates[side["side"]] = pd.DataFrame(columns=columns)
+
+        for p in range(partitions):
+            frames = {}
+            for side in ("left", "right"):
+                files = sorted(tmp.glob(f"{side}{p}_*.pkl"))
+                frames[side] = pd.concat([pd.read_pickle(f) for f in files]) if files else templates[side]
+            if frames["left"].empty and frames["right"].empty:
+                continue
+            sink.write(_join_pair(frames["left"], frames["right"], left["on"], right["on"], how))
+    return {"mode": "partitioned", "build": build, "partitions": partitions}
 
 
 @tool
-def excel_from_csv(csv_filename: str, excel_filename: str) -> str:
-    """Конвертировать CSV в Excel.
+def table_join(left_file: str, right_file: str, on: str, output_file: str, how: str = "inner",
+               right_on: str = "", left_sheet: str = None, right_sheet: str = None) -> str:
+    """Соединить две таблицы (CSV/Excel) по ключевым колонкам — как JOIN в SQL.
 
-    Автоматически определяет кодировку (utf-8, cp1251, latin-1)
-    и разделитель (запятая, точка с запятой, табуляция).
+    Меньшая таблица загружается в память как хэш-таблица, большая читается
+    кусками; если меньшая не помещается в бюджет памяти, обе делятся на
+    части на диске. Подходит для больших выгрузок (клиенты × заказы) —
+    не пиши соединение через python_execute.
 
     Args:
-        csv_filename: Имя CSV-файла
-        excel_filename: Имя выходного Excel-файла
+        left_file: Левая таблица (.csv, .xlsx, .xls)
+        right_file: Правая таблица
+        on: Ключевая колонка левой таблицы или JSON-список: ["Клиент", "Дата"]
+        output_file: Имя результата: .csv, .xlsx или .feather (колоночный формат)
+        how: inner (только совпавшие), left, right или outer (все строки)
+        right_on: Ключи правой таблицы, если называются иначе (по умолчанию — как on)
+        left_sheet: Лист левой книги (по умолчанию — первый)
+        right_sheet: Лист правой книги (по умолчанию — первый)
     """
     if not EXCEL_AVAILABLE:
-        return "Ошибка: pandas не установлен"
+        return "Ошибка: openpyxl / pandas не установлен"
 
     try:
-        csv_path = _resolve_file(csv_filename)
-        if not csv_path:
-            return f"CSV не найден: {csv_filename}"
-
-        # Определяем кодировку
-        df = None
-        encodings = ["utf-8", "cp1251", "latin-1"]
-        separators = [",", ";", "\t"]
-
-        for enc in encodings:
-            for sep in separators:
-                try:
-                    df = pd.read_csv(csv_path, encoding=enc, sep=sep)
-                    # Проверяем что прочиталось разумно (> 1 колонки или 1 строка)
-                    if len(df.columns) > 1 or len(df) > 0:
-                        break
-                except (UnicodeDecodeError, pd.errors.ParserError):
-                    continue
-            if df is not None and len(df.columns) > 1:
-                break
-
-        if df is None:
-            return "Не удалось прочитать CSV — неизвестная кодировка или формат"
-
-        excel_path = OUTPUT_DIR / excel_filename
-
-        with pd.ExcelWriter(excel_path, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Data')
-            ws = writer.sheets['Data']
-            for cell in ws[1]:
-                cell.font = Font(bold=True)
-                cell.fill = PatternFill(start_color="4472C4", fill_type="solid")
-
+        how = (how or "inner").strip().lower()
+        if how not in JOIN_TYPES:
+            return f"Ошибка: how должен быть одним из: {', '.join(JOIN_TYPES)}"
+        output_path = OUTPUT_DIR / output_file
+        if output_path.suffix.lower() not in JOIN_OUTPUT_SUFFIXES:
+            return f"Ошибка: результат сохраняется в {', '.join(JOIN_OUTPUT_SUFFIXES)}"
+
+        def keys(value):
+            value = (value or "").strip()
+            return [str(k) for k in json.loads(value)] if value.startswith("[") else ([value] if value else [])
+
+        left_on = keys(on)
+        right_on = keys(right_on) or left_on
+        if not left_on:
+            return "Ошибка: укажи ключевые колонки (on)"
+        if len(left_on) != len(right_on):
+            return "Ошибка: число ключей on и right_on должно совпадать"
+
+        sides = {}
+        for side, filename, sheet, side_keys in (("left", left_file, left_sheet, left_on),
+                                                 ("right", right_file, right_sheet, right_on)):
+            path = _resolve_file(filename)
+            if not path:
+                return f"Файл не найден: {filename}"
+            available = _table_columns(path, sheet)
+            missing = [k for k in side_keys if k not in available]
+            if missing:
+                return (
+                    f"Колонки не найдены в {path.name}: {', '.join(missing)}\n"
+                    f"Доступные колонки: {', '.join(available)}"
+                )
+            sides[side] = {"side": side, "path": path, "sheet": sheet, "on": side_keys}
+
+        started = time.perf_counter()
+        left, right = sides["left"], sides["right"]
+        build, _ = _join_sides(left, right)
+        _discard_appends(output_path)
+        sink = _TableSink(output_path)
+        # Хэш-таблица плюс результат соединения должны уместиться в бюджет
+        if build["bytes"] <= DATA_MEMORY_BUDGET_BYTES // 2:
+            info = _memory_hash_join(left, right, how, sink)
+        else:
+            info = _grace_hash_join(left, right, how, sink)
+        sink.close(_table_columns(left["path"], left["sheet"]) + _table_columns(right["path"], right["sheet"]))
+
+        condition = ", ".join(lk if lk == rk else f"{lk} = {rk}" for lk, rk in zip(left_on, right_on))
+        if info["mode"] == "memory":
+            mode = (
+                f"Режим: {info['build']['path'].name} в памяти (≈{_format_bytes(info['build']['bytes'])}), "
+                f"{info['probe']['path'].name} — потоком, {info['chunks']} част."
+            )
+        else:
+            mode = (
+                f"Режим: по частям на диске — {info['partitions']} частей "
+                f"(≈{_format_bytes(info['build']['bytes'])} больше бюджета "
+                f"{_format_bytes(DATA_MEMORY_BUDGET_BYTES // 2)})"
+            )
         return (
-            f"✓ Создан {excel_filename}\n"
-            f"  Строк: {len(df)}, Колонок: {len(df.columns)}\n"
-            f"  Кодировка: {enc}, Разделитель: {repr(sep)}"
+            f"✓ Создан {output_file}\n"
+            f"  Соединение: {how} по {condition}\n"
+            f"  Строк: {sink.rows}, Колонок: {len(sink.columns)}"
+            + (f", Листов: {sink.sheets}" if sink.sheets > 1 else "") + "\n"
+            f"  {mode}\n"
+            f"  Время: {time.perf_counter() - started:.1f} сек"
         )
+
+    except json.JSONDecodeError as e:
+        return f"Ошибка парсинга JSON ключей: {e}"
     except Exception as e:
         return f"Ошибка: {e}"
 
 
-def extract_multilevel_headers(ws, max_header_rows: int = 3) -> list:
-    """Извлекает многоуровневые заголовки.
+# ============ КАТАЛОГ ТАБЛИЦ ============
+#
+# Фоновый каталог табличных файлов OUTPUT_DIR и WORK_DIR в SQLite: листы,
+# колонки, типы, число строк и примеры значений. Файл разбирается заново,
+# только если изменились его mtime или размер, так что обновление без
+# новых файлов — это несколько stat(). Обновляет каталог только фоновый
+# поток (запускается вместе с агентом), изменённые файлы разбираются
+# параллельно в пуле процессов. catalog_search лишь читает базу и находит
+# файл по колонкам за миллисекунды вместо excel_read по каждому кандидату.
+
+CATALOG_DB = CACHE_DIR / "catalog.sqlite3"
+CATALOG_REFRESH_SEC = int(os.getenv("CATALOG_REFRESH_SEC", "60"))
+CATALOG_SAMPLE_ROWS = 50
+CATALOG_SAMPLE_VALUES = 3
+CATALOG_SHOW_COLUMNS = 30
+# .txt не каталогизируется: это чаще заметки, чем таблицы
+CATALOG_SUFFIXES = (CSV_SUFFIXES - {".txt"}) | CALAMINE_SUFFIXES
+
+_CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, name_fold TEXT, mtime_ns INTEGER, size INTEGER,
+    scanned REAL, error TEXT
+);
+CREATE TABLE IF NOT EXISTS sheets (
+    path TEXT, sheet TEXT, position INTEGER, rows INTEGER, exact INTEGER
+);
+CREATE TABLE IF NOT EXISTS columns (
+    path TEXT, sheet TEXT, position INTEGER, name TEXT, name_fold TEXT,
+    kind TEXT, dtype TEXT, samples TEXT
+);
+CREATE INDEX IF NOT EXISTS sheets_path ON sheets (path);
+CREATE INDEX IF NOT EXISTS columns_path ON columns (path);
+CREATE INDEX IF NOT EXISTS columns_name ON columns (name_fold);
+"""
 
-    Защита от «рваных» заголовков (разное количество колонок в строках).
-    """
-    header_matrix = []
 
-    for row in ws.iter_rows(min_row=1, max_row=max_header_rows, values_only=True):
-        header_matrix.append([str(c).strip() if c else "" for c in row])
+def _catalog_sheet(sheet: Optional[str], preview: "pd.DataFrame", rows: int, exact: bool) -> Dict[str, Any]:
+    """Запись о листе: колонки с типом (по первым строкам) и примерами значений."""
+    columns = []
+    for pos in range(preview.shape[1]):
+        series = _infer_column(preview.iloc[:, pos])
+        samples = series.dropna().astype(str).unique()[:CATALOG_SAMPLE_VALUES]
+        columns.append({"name": str(preview.columns[pos]), "kind": _column_kind(series),
+                        "dtype": str(series.dtype), "samples": [str(v) for v in samples]})
+    return {"sheet": sheet, "rows": rows, "exact": exact, "columns": columns}
 
-    if not header_matrix:
-        return []
 
-    # Определяем максимальную ширину по всем строкам
-    max_cols = max(len(row) for row in header_matrix)
+def _catalog_scan(filepath: Path) -> list:
+    """Листы файла для каталога. Функция верхнего уровня — выполняется в пуле.
 
-    # Выравниваем строки до одинаковой длины
-    for i, row in enumerate(header_matrix):
-        if len(row) < max_cols:
-            header_matrix[i] = row + [""] * (max_cols - len(row))
+    Excel — потоковая сводка по листу (у больших xlsx число строк из
+    <dimension>), CSV — первые строки и подсчёт переводов строк.
+    """
+    if filepath.suffix.lower() in CSV_SUFFIXES:
+        enc, sep = _sniff_csv(filepath)
+        preview = pd.read_csv(filepath, encoding=enc, sep=sep, nrows=CATALOG_SAMPLE_ROWS, dtype=object)
+        return [_catalog_sheet(None, preview, max(_csv_records(filepath, enc, sep)[0] - 1, 0), True)]
+
+    sheets = []
+    for name in _sheet_names(filepath):
+        if _row_readable(filepath):
+            summary = _stream_sheet_summary(filepath, name, CATALOG_SAMPLE_ROWS)
+        else:
+            summary = _sheet_summary(filepath, name)
+        sheets.append(_catalog_sheet(name, summary["preview"], summary["rows"], summary["exact"]))
+    return sheets
 
-    headers = []
-    for col_idx in range(max_cols):
-        parts = []
-        for row_idx in range(len(header_matrix)):
-            val = header_matrix[row_idx][col_idx]
-            if val and (not parts or val != parts[-1]):
-                parts.append(val)
-        headers.append(" | ".join(parts) if parts else f"Column_{col_idx + 1}")
 
-    return headers
+class _Catalog:
+    """Каталог таблиц в SQLite с инкрементальным обновлением.
 
+    refresh() сверяет файлы на диске с записями по (mtime, size) и
+    переразбирает только изменённые; фоновый поток (start) вызывает его
+    раз в CATALOG_REFRESH_SEC. Поиск базу не обновляет. Соединение с базой
+    открывается на каждую операцию — потоки не делят соединения.
+    """
 
-@tool
-def excel_read_structured(filename: str, header_rows: int = 2) -> str:
-    """Чтение Excel с многоуровневыми заголовками.
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.refreshed: Optional[float] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_CATALOG_SCHEMA)
+        return conn
+
+    @staticmethod
+    def _files():
+        for root in (OUTPUT_DIR, WORK_DIR):
+            for dirpath, dirnames, filenames in os.walk(root):
+                # Служебные папки (.cache и т.п.) не каталогизируются
+                dirnames[:] = [d for d in dirnames if not d.startswith(".")]
+                for name in filenames:
+                    if name.startswith((".", "~$")):
+                        continue
+                    if Path(name).suffix.lower() in CATALOG_SUFFIXES:
+                        yield Path(dirpath) / name
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="table-catalog", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"Каталог таблиц: {e}")
+            time.sleep(CATALOG_REFRESH_SEC)
+
+    @property
+    def refreshing(self) -> bool:
+        return self._lock.locked()
+
+    def refresh(self) -> Dict[str, int]:
+        """Обновить каталог: изменённые файлы разбираются в пуле все сразу,
+        результаты записываются одной транзакцией."""
+        with self._lock:
+            conn = self._connect()
+            try:
+                known = {path: (mtime, size) for path, mtime, size
+                         in conn.execute("SELECT path, mtime_ns, size FROM files")}
+                seen = set()
+                changed = []
+                for filepath in self._files():
+                    try:
+                        stat = filepath.stat()
+                    except OSError:
+                        continue
+                    seen.add(str(filepath))
+                    if known.get(str(filepath)) != (stat.st_mtime_ns, stat.st_size):
+                        changed.append((filepath, stat))
+                removed = [path for path in known if path not in seen]
+
+                futures = {}
+                if changed:
+                    pool = _get_process_pool()
+                    futures = {filepath: pool.submit(_catalog_scan, filepath) for filepath, _ in changed}
+                scanned = []
+                for filepath, stat in changed:
+                    sheets, error = [], None
+                    try:
+                        sheets = _pool_result(futures[filepath], lambda: _catalog_scan(filepath))
+                    except Exception as e:
+                        error = str(e)
+                    scanned.append((filepath, stat, sheets, error))
+
+                with conn:
+                    for filepath, stat, sheets, error in scanned:
+                        self._store(conn, filepath, stat, sheets, error)
+                    for path in removed:
+                        self._delete(conn, path)
+            finally:
+                conn.close()
+            self.refreshed = time.time()
+            if changed or removed:
+                logger.info(f"Каталог таблиц: {len(changed)} обновлено, {len(removed)} удалено, всего {len(seen)}")
+            return {"files": len(seen), "changed": len(changed), "removed": len(removed)}
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, path: str) -> None:
+        for table in ("files", "sheets", "columns"):
+            conn.execute(f"DELETE FROM {table} WHERE path = ?", (path,))
+
+    def _store(self, conn: sqlite3.Connection, filepath: Path, stat,
+               sheets: list, error: Optional[str]) -> None:
+        path = str(filepath)
+        self._delete(conn, path)
+        conn.execute(
+            "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+            (path, filepath.name.casefold(), stat.st_mtime_ns, stat.st_size, time.time(), error),
+        )
+        for position, sheet in enumerate(sheets):
+            conn.execute("INSERT INTO sheets VALUES (?, ?, ?, ?, ?)",
+                         (path, sheet["sheet"], position, sheet["rows"], int(sheet["exact"])))
+            conn.executemany("INSERT INTO columns VALUES (?, ?, ?, ?, ?, ?, ?, ?)", [
+                (path, sheet["sheet"], i, col["name"], col["name"].casefold(), col["kind"],
+                 col["dtype"], json.dumps(col["samples"], ensure_ascii=False))
+                for i, col in enumerate(sheet["columns"])
+            ])
+
+    def search(self, terms: list, limit: int) -> tuple:
+        """(файлы, всего в каталоге). Файл подходит, если каждый термин есть
+        в имени одной из его колонок или в имени файла."""
+        conn = self._connect()
+        try:
+            total = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            candidates = None
+            matched_columns: Dict[str, set] = {}
+            for term in terms:
+                pattern = "%" + re.sub(r"([\\%_])", r"\\\1", term.casefold()) + "%"
+                hits = set()
+                for path, name in conn.execute(
+                    "SELECT path, name FROM columns WHERE name_fold LIKE ? ESCAPE '\\'", (pattern,)
+                ):
+                    hits.add(path)
+                    matched_columns.setdefault(path, set()).add(name)
+                hits.update(path for (path,) in conn.execute(
+                    "SELECT path FROM files WHERE name_fold LIKE ? ESCAPE '\\'", (pattern,)
+                ))
+                candidates = hits if candidates is None else candidates & hits
+
+            rows = conn.execute("SELECT path, size, mtime_ns, error FROM files").fetchall()
+            if candidates is not None:
+                rows = [row for row in rows if row[0] in candidates]
+            # Сначала файлы с точным совпадением имени колонки, затем свежие
+            exact = {term.casefold() for term in terms}
+            rows.sort(key=lambda row: (
+                -sum(name.casefold() in exact for name in matched_columns.get(row[0], ())),
+                -row[2],
+            ))
+
+            results = []
+            for path, size, _, error in rows[:limit]:
+                sheets = []
+                for sheet, n_rows, is_exact in conn.execute(
+                    "SELECT sheet, rows, exact FROM sheets WHERE path = ? ORDER BY position", (path,)
+                ):
+                    columns = [
+                        {"name": name, "kind": kind, "samples": json.loads(samples)}
+                        for name, kind, samples in conn.execute(
+                            "SELECT name, kind, samples FROM columns WHERE path = ? AND sheet IS ? "
+                            "ORDER BY position", (path, sheet),
+                        )
+                    ]
+                    sheets.append({"sheet": sheet, "rows": n_rows, "exact": bool(is_exact),
+                                   "columns": columns})
+                results.append({"path": Path(path), "size": size, "error": error, "sheets": sheets,
+                                "matched": matched_columns.get(path, set())})
+            return results, total
+        finally:
+            conn.close()
 
-    Args:
-        filename: Имя файла
-        header_rows: Количество строк заголовков (по умолчанию 2)
-    """
-    if not EXCEL_AVAILABLE:
-        return "Ошибка: openpyxl / pandas не установлен"
+    def usage(self) -> str:
+        if not self.db_path.exists():
+            return "каталог ещё не построен"
+        conn = self._connect()
+        try:
+            files = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            columns = conn.execute("SELECT COUNT(*) FROM columns").fetchone()[0]
+        finally:
+            conn.close()
+        return f"{files} файлов, {columns} колонок"
 
-    try:
-        filepath = _resolve_file(filename)
-        if not filepath:
-            return f"Файл не найден: {filename}"
 
-        normalized = _normalize_merged_cells(filepath)
+_catalog = _Catalog(CATALOG_DB)
 
+
+def _catalog_display_path(path: Path) -> str:
+    for root in (OUTPUT_DIR, WORK_DIR):
         try:
-            wb = openpyxl.load_workbook(normalized)
-            ws = wb.active
+            return f"{root.name}/{path.relative_to(root).as_posix()}"
+        except ValueError:
+            continue
+    return str(path)
+
 
-            headers = extract_multilevel_headers(ws, max_header_rows=header_rows)
-            wb.close()
+@tool
+def catalog_search(query: str = "", limit: int = 10) -> str:
+    """Найти табличные файлы (Excel/CSV) в outputs/ и work/ по колонкам.
 
-            df = pd.read_excel(normalized, skiprows=header_rows, header=None, dtype=str)
-            df.columns = headers[:len(df.columns)]
-            df = df.dropna(how="all")
+    Каталог листов, колонок, типов и примеров значений ведётся в фоне и
+    обновляется только для изменённых файлов — поиск не открывает файлы.
+    Используй вместо list_files + excel_read по каждому файлу, чтобы найти,
+    где лежат нужные данные.
 
-            preview = df.head(20).to_string(index=False)
+    Args:
+        query: Колонки или часть имени файла через запятую: "Revenue" или
+            "Регион, Выручка" — файл должен подходить под все; пусто — все таблицы
+        limit: Сколько файлов показать (по умолчанию 10)
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: pandas не установлен"
 
-            return (
-                f"Файл: {filepath.name}\n"
-                f"Заголовков уровней: {header_rows}\n"
-                f"Колонок: {len(df.columns)}\n\n"
-                f"Имена колонок:\n" + "\n".join(f"- {c}" for c in df.columns)
-                + "\n\nПервые строки:\n" + preview
-            )
-        finally:
-            _cleanup_normalized(normalized, filepath)
+    try:
+        # Каталог обновляет только фоновый поток — поиск лишь читает базу
+        _catalog.start()
+        terms = [t.strip() for t in (query or "").split(",") if t.strip()]
+        results, total = _catalog.search(terms, max(1, int(limit)))
+
+        header = f"Найдено таблиц: {len(results)}" if terms else f"Таблиц в каталоге: {total}"
+        if terms and len(results) == max(1, int(limit)):
+            header += " (показаны первые)"
+        if _catalog.refreshed is None:
+            header += "\n⏳ Каталог ещё строится в фоне — часть файлов может не найтись"
+        elif _catalog.refreshing:
+            header += "\n⏳ Каталог обновляется в фоне — новые файлы могут появиться чуть позже"
+        else:
+            age = int(time.time() - _catalog.refreshed)
+            header += f"\nКаталог обновлён {age} сек назад (обновляется раз в {CATALOG_REFRESH_SEC} сек)"
+        if not results:
+            return header + ("\nПо запросу ничего не найдено" if terms else "")
+
+        lines = [header]
+        for item in results:
+            lines.append(f"\n• {_catalog_display_path(item['path'])} ({_format_bytes(item['size'])})")
+            if item["error"]:
+                lines.append(f"    не удалось разобрать: {item['error']}")
+            for sheet in item["sheets"]:
+                rows = sheet["rows"] if sheet["exact"] else f"≈{sheet['rows']}"
+                label = f"лист {sheet['sheet']}" if sheet["sheet"] is not None else "CSV"
+                shown = sheet["columns"][:CATALOG_SHOW_COLUMNS]
+                more = len(sheet["columns"]) - len(shown)
+                lines.append(
+                    f"    {label}: {rows} строк, колонки: "
+                    + ", ".join(f"{c['name']} ({c['kind']})" for c in shown)
+                    + (f" … и ещё {more}" if more > 0 else "")
+                )
+                for col in sheet["columns"]:
+                    if col["name"] in item["matched"]:
+                        lines.append(f"      {col['name']}: " + ", ".join(col["samples"]))
+        return "\n".join(lines)
 
     except Exception as e:
         return f"Ошибка: {e}"
@@ -768,6 +5033,9 @@ def bash_execute(command: str) -> str:
     if safety_error:
         return safety_error
 
+    # Скрипт может читать файлы напрямую — буферы дозаписи сначала в книги
+    _flush_all_appends()
+
     try:
         result = subprocess.run(
             command, shell=True, capture_output=True, text=True,
@@ -845,6 +5113,8 @@ def list_files(directory: str = "outputs") -> str:
     if not target.exists():
         return f"Директория не существует: {target}"
 
+    _flush_all_appends()
+
     try:
         items = sorted(target.iterdir())
     except PermissionError:
@@ -887,6 +5157,8 @@ def python_execute(code: str) -> str:
     if safety_error:
         return safety_error
 
+    _flush_all_appends()
+
     try:
         script = WORK_DIR / f"_exec_{datetime.now().timestamp()}.py"
         script.write_text(code, encoding="utf-8")
@@ -914,8 +5186,888 @@ def python_execute(code: str) -> str:
         return f"Ошибка: {e}"
 
 
+# ============ ПРОФИЛИРОВАНИЕ ТАБЛИЦ ============
+
+# Файлы больше порога профилируются по выборке первых PROFILE_SAMPLE_ROWS строк
+PROFILE_SAMPLE_MIN_BYTES = int(os.getenv("PROFILE_SAMPLE_MB", "20")) * 1024 * 1024
+PROFILE_SAMPLE_ROWS = int(os.getenv("PROFILE_SAMPLE_ROWS", "100000"))
+PROFILE_TOP_K = 3
+PROFILE_CATEGORICAL_MAX = 50
+
+
+class _HyperLogLog:
+    """Приблизительный счётчик уникальных значений (HyperLogLog, 2^p регистров).
+
+    Хэши — 64-битные из pd.util.hash_pandas_object, всё считается
+    векторно в numpy. Скетчи объединяются через merge() — для подсчёта
+    по частям (чанки, несколько файлов). Ошибка ~1.04/sqrt(2^p): 1.6% при p=12.
+    """
+
+    def __init__(self, p: int = 12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    def add_series(self, series: "pd.Series") -> "_HyperLogLog":
+        values = series.dropna()
+        if len(values):
+            self.add_hashes(pd.util.hash_pandas_object(values, index=False).to_numpy())
+        return self
+
+    def add_hashes(self, hashes: "np.ndarray") -> None:
+        hashes = hashes.astype(np.uint64, copy=False)
+        idx = (hashes >> np.uint64(64 - self.p)).astype(np.intp)
+        # Старшие 32 бита остатка точно представимы во float64 — log2 без потерь
+        rest = ((hashes << np.uint64(self.p)) >> np.uint64(32)).astype(np.float64)
+        with np.errstate(divide="ignore"):
+            rank = np.where(rest > 0, 32 - np.floor(np.log2(rest)), 33).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def merge(self, other: "_HyperLogLog") -> "_HyperLogLog":
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * m and zeros:
+            raw = m * np.log(m / zeros)   # linear counting для малых множеств
+        return int(round(raw))
+
+
+class _TDigest:
+    """Скетч квантилей в духе t-digest (merging digest).
+
+    Значения хранятся центроидами (среднее, вес), отсортированными по
+    среднему. Новый кусок сливается с центроидами и сжимается векторно:
+    точки, чьи квантили попадают в одну единичную ячейку шкалы
+    k(q) = δ/2π·asin(2q−1), объединяются в центроид. К хвостам ячейки
+    уже, поэтому p1/p99 точнее медианы. Центроидов — O(δ), скетчи
+    объединяются через merge() — для подсчёта по частям.
+    """
+
+    def __init__(self, compression: int = 500):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    def add(self, values: "np.ndarray") -> "_TDigest":
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values):
+            self.min = min(self.min, float(values.min()))
+            self.max = max(self.max, float(values.max()))
+            self._compress(np.concatenate([self.means, values]),
+                           np.concatenate([self.weights, np.ones(len(values))]))
+        return self
+
+    def merge(self, other: "_TDigest") -> "_TDigest":
+        if len(other.means):
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+            self._compress(np.concatenate([self.means, other.means]),
+                           np.concatenate([self.weights, other.weights]))
+        return self
+
+    def _compress(self, means: "np.ndarray", weights: "np.ndarray") -> None:
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        q = (np.cumsum(weights) - weights / 2) / weights.sum()
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+        cells = (k - k[0]).astype(np.intp)
+        w = np.bincount(cells, weights=weights)
+        m = np.bincount(cells, weights=means * weights)
+        keep = w > 0
+        self.weights = w[keep]
+        self.means = m[keep] / self.weights
+
+    def quantiles(self, qs) -> list:
+        if not len(self.means):
+            return [None] * len(qs)
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        x = np.concatenate([[0.0], centers, [total]])
+        y = np.concatenate([[self.min], self.means, [self.max]])
+        return np.interp(np.asarray(qs, dtype=np.float64) * total, x, y).tolist()
+
+
+def _column_kind(series: "pd.Series") -> str:
+    if pd.api.types.is_bool_dtype(series):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(series):
+        return "numeric"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    return "text"
+
+
+def _estimate_table_rows(filepath: Path, sheet_name=None) -> Optional[int]:
+    """Число строк данных без полного разбора (xlsx — <dimension>, CSV — переводы строк)."""
+    suffix = filepath.suffix.lower()
+    if suffix in EXCEL_STREAMABLE_SUFFIXES:
+        return _stream_sheet_summary(filepath, sheet_name, 0)["rows"]
+    if suffix in CSV_SUFFIXES:
+        return max(_count_lines(filepath) - 1, 0)
+    return None
+
+
+def _profile_frame(df: "pd.DataFrame", top_k: int = PROFILE_TOP_K) -> List[Dict[str, Any]]:
+    """Профиль колонок: тип, пустые, ~уникальные, min/max, top-k.
+
+    Пустые, min и max считаются одним векторным вызовом на всю таблицу,
+    уникальные — по HyperLogLog (один хэш-проход на колонку), top-k —
+    только для колонок с малым числом уникальных.
+    """
+    nulls = df.isna().sum()
+    kinds = {col: _column_kind(df[col]) for col in df.columns}
+    ordered = [c for c in df.columns if kinds[c] in ("numeric", "datetime")]
+    mins = df[ordered].min() if ordered else pd.Series(dtype=object)
+    maxs = df[ordered].max() if ordered else pd.Series(dtype=object)
+
+    profile = []
+    for col in df.columns:
+        series = df[col]
+        distinct = _HyperLogLog().add_series(series).estimate()
+        distinct = min(distinct, len(series) - int(nulls[col]))
+        info = {
+            "column": col,
+            "dtype": str(series.dtype),
+            "kind": kinds[col],
+            "nulls": int(nulls[col]),
+            "distinct": distinct,
+            "min": mins.get(col),
+            "max": maxs.get(col),
+            "top": [],
+        }
+        if kinds[col] in ("text", "bool") and distinct <= PROFILE_CATEGORICAL_MAX * 20:
+            counts = series.value_counts(dropna=True).head(top_k)
+            info["top"] = list(zip(counts.index.tolist(), counts.tolist()))
+        profile.append(info)
+    return profile
+
+
+def _profile_chunks(chunks, top_k: int = PROFILE_TOP_K, digests: bool = False) -> tuple:
+    """(строк, профиль, кусков) за один проход по кускам таблицы.
+
+    Пустые, min/max и HyperLogLog складываются по кускам, top-k — из
+    суммы value_counts, пока уникальных немного (иначе счётчик бросается).
+    digests=True — для числовых колонок ещё среднее, σ (моменты кусков
+    сливаются по Чану) и t-digest для квантилей.
+    """
+    state: Dict[str, Dict[str, Any]] = {}
+    total = n_chunks = 0
+    for chunk in chunks:
+        total += len(chunk)
+        n_chunks += 1
+        for col in chunk.columns:
+            series = chunk[col]
+            kind = _column_kind(series.dropna()) if series.notna().any() else None
+            info = state.setdefault(col, {
+                "dtype": str(series.dtype), "kind": kind, "nulls": 0,
+                "hll": _HyperLogLog(), "min": None, "max": None, "counts": pd.Series(dtype="int64"),
+                "n": 0, "mean": 0.0, "m2": 0.0, "digest": _TDigest() if digests else None,
+            })
+            info["nulls"] += int(series.isna().sum())
+            info["hll"].add_series(series)
+            if kind is None:
+                continue
+            if info["kind"] is None:
+                info["kind"], info["dtype"] = kind, str(series.dtype)
+            elif kind != info["kind"]:
+                info["kind"], info["dtype"] = "text", "object"
+            if info["kind"] in ("numeric", "datetime"):
+                low, high = series.min(), series.max()
+                info["min"] = low if info["min"] is None else min(info["min"], low)
+                info["max"] = high if info["max"] is None else max(info["max"], high)
+                if info["kind"] == "numeric" and info["digest"] is not None:
+                    values = series.dropna().to_numpy(dtype=np.float64)
+                    _merge_moments(info, values[np.isfinite(values)])
+                    info["digest"].add(values)
+            elif info["counts"] is not None:
+                counts = info["counts"].add(series.value_counts(dropna=True), fill_value=0)
+                info["counts"] = counts if len(counts) <= PROFILE_CATEGORICAL_MAX * 20 else None
+
+    profile = []
+    for col, info in state.items():
+        kind = info["kind"] or "text"
+        distinct = min(info["hll"].estimate(), total - info["nulls"])
+        counts = info["counts"] if kind in ("text", "bool") and info["counts"] is not None else None
+        top = counts.sort_values(ascending=False, kind="stable").head(top_k) if counts is not None else None
+        entry = {
+            "column": col,
+            "dtype": info["dtype"],
+            "kind": kind,
+            "nulls": info["nulls"],
+            "distinct": distinct,
+            "min": info["min"] if kind in ("numeric", "datetime") else None,
+            "max": info["max"] if kind in ("numeric", "datetime") else None,
+            "top": list(zip(top.index.tolist(), top.astype(int).tolist())) if top is not None else [],
+        }
+        if digests and kind == "numeric" and info["n"]:
+            entry["mean"] = info["mean"]
+            entry["std"] = math.sqrt(info["m2"] / (info["n"] - 1)) if info["n"] > 1 else None
+            entry["digest"] = info["digest"]
+        profile.append(entry)
+    return total, profile, n_chunks
+
+
+def _merge_moments(info: Dict[str, Any], values: "np.ndarray") -> None:
+    """Добавляет кусок к n/mean/m2 в info (параллельный алгоритм Чана)."""
+    n_b = len(values)
+    if not n_b:
+        return
+    mean_b = float(values.mean())
+    m2_b = float(((values - mean_b) ** 2).sum())
+    n = info["n"] + n_b
+    delta = mean_b - info["mean"]
+    info["mean"] += delta * n_b / n
+    info["m2"] += m2_b + delta * delta * info["n"] * n_b / n
+    info["n"] = n
+
+
+def _profile_table(filepath: Path, sheet_name=None) -> Dict[str, Any]:
+    """Профиль таблицы.
+
+    Таблица больше бюджета памяти профилируется целиком по кускам; иначе
+    большие файлы — по выборке, если полного разбора нет в кэше.
+    """
+    full_variant = ("pandas", sheet_name or 0)
+    cached = _workbook_cache.contains(filepath, full_variant) or _frame_store.has(filepath, full_variant)
+    plan = _table_plan(filepath, sheet_name) if not cached else {"mode": "memory", "estimate": None}
+    if plan["mode"] == "chunked":
+        chunks = _iter_table_chunks(filepath, sheet_name, chunk_rows=plan["chunk_rows"])
+        total, columns, n_chunks = _profile_chunks(chunks)
+        return {"rows": total, "sample_rows": None, "columns": columns, "mode": _plan_line(plan, n_chunks)}
+
+    sampled = not cached and filepath.stat().st_size > PROFILE_SAMPLE_MIN_BYTES
+
+    if sampled:
+        df = _compact_frame(_read_table_raw(filepath, sheet_name, nrows=PROFILE_SAMPLE_ROWS))
+        total = _estimate_table_rows(filepath, sheet_name) or len(df)
+    else:
+        df = _read_table(filepath, sheet_name)
+        total = len(df)
+        if total > PROFILE_SAMPLE_ROWS * 10:
+            df = df.sample(PROFILE_SAMPLE_ROWS * 10, random_state=0)
+            sampled = True
+
+    return {
+        "rows": total,
+        "sample_rows": len(df) if sampled else None,
+        "columns": _profile_frame(df),
+        "mode": _plan_line(plan),
+    }
+
+
+# ============ CSV: ПОТОКОВОЕ ЧТЕНИЕ ============
+#
+# csv_read и csv_stats отвечают на вопросы о больших CSV (логи, выгрузки
+# на гигабайты) без конвертации в Excel и без загрузки файла целиком:
+# число строк — подсчёт переводов строк по mmap, хвост — чтение с конца
+# файла, статистика — один проход по кускам с объединяемыми скетчами.
+# Файлы в UTF-16 и с переводами строк внутри кавычек так не посчитать —
+# для них строки и хвост берутся разбором CSV кусками.
+
+CSV_PREVIEW_ROWS = 10
+CSV_TAIL_BLOCK_BYTES = 64 * 1024
+CSV_COUNT_BLOCK_BYTES = 64 * 1024 * 1024
+CSV_QUOTE_BLOCK_BYTES = 8 * 1024 * 1024
+CSV_PARSE_CHUNK_ROWS = 200_000
+CSV_STATS_QUANTILES = (0.01, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+
+def _ascii_compatible(encoding: str) -> bool:
+    """Переводы строк и кавычки — те же байты, что в ASCII (не UTF-16/32)."""
+    return not codecs.lookup(encoding).name.startswith(("utf-16", "utf-32"))
+
+
+def _newline_in_quotes(block: bytes, quoted: bool) -> tuple:
+    """(есть ли перевод строки внутри кавычек, открыта ли кавычка в конце
+    блока). Чётность кавычек считается numpy по частям CSV_QUOTE_BLOCK_BYTES."""
+    for pos in range(0, len(block), CSV_QUOTE_BLOCK_BYTES):
+        data = np.frombuffer(block, dtype=np.uint8, count=min(CSV_QUOTE_BLOCK_BYTES, len(block) - pos),
+                             offset=pos)
+        inside = np.bitwise_xor.accumulate((data == 0x22).view(np.uint8))
+        if quoted:
+            inside ^= 1
+        if inside[data == 0x0A].any():
+            return True, quoted
+        quoted = bool(inside[-1])
+    return False, quoted
+
+
+def _count_newlines(filepath: Path) -> Optional[int]:
+    """Число строк файла: переводы строк считаются по mmap блоками,
+    последняя строка без перевода тоже учитывается. None — если перевод
+    строки встречается внутри кавычек (многострочная ячейка): тогда строк
+    файла больше, чем записей."""
+    with open(filepath, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if not size:
+            return 0
+        lines, quoted = 0, False
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for pos in range(0, size, CSV_COUNT_BLOCK_BYTES):
+                block = mm[pos:pos + CSV_COUNT_BLOCK_BYTES]
+                lines += block.count(b"\n")
+                if quoted or b'"' in block:
+                    found, quoted = _newline_in_quotes(block, quoted)
+                    if found:
+                        return None
+            return lines + int(mm[size - 1:size] != b"\n")
+
+
+def _csv_records(filepath: Path, enc: str, sep: str) -> tuple:
+    """(число записей вместе с заголовком, запись = строка файла).
+
+    Быстрый путь — подсчёт переводов строк. Если кодировка не совместима
+    с ASCII (UTF-16) или в кавычках есть переводы строк, записи считаются
+    разбором CSV кусками — дольше, но без двойного счёта многострочных ячеек.
+    """
+    if _ascii_compatible(enc):
+        lines = _count_newlines(filepath)
+        if lines is not None:
+            return lines, True
+    records = 0
+    with pd.read_csv(filepath, encoding=enc, sep=sep, header=None, usecols=[0], dtype=object,
+                     chunksize=CSV_PARSE_CHUNK_ROWS) as reader:
+        for chunk in reader:
+            records += len(chunk)
+    return records, False
+
+
+def _count_lines(filepath: Path) -> int:
+    """Число записей CSV вместе с заголовком (см. _csv_records)."""
+    enc, sep = _sniff_csv(filepath)
+    return _csv_records(filepath, enc, sep)[0]
+
+
+def _csv_tail(filepath: Path, enc: str, sep: str, columns: list, n_rows: int,
+              by_lines: bool = True) -> "pd.DataFrame":
+    """Последние n_rows строк CSV: блок с конца файла растёт, пока в нём
+    не наберётся достаточно строк. Если запись не равна строке файла
+    (by_lines=False: UTF-16, многострочные ячейки), файл разбирается
+    кусками и сохраняются последние n_rows записей."""
+    if n_rows <= 0:
+        return pd.DataFrame(columns=columns)
+    if not by_lines:
+        tail = pd.DataFrame(columns=columns)
+        with pd.read_csv(filepath, encoding=enc, sep=sep, header=0, names=columns,
+                         chunksize=max(n_rows, CSV_PARSE_CHUNK_ROWS)) as reader:
+            for chunk in reader:
+                tail = pd.concat([tail, chunk]).iloc[-n_rows:] if len(tail) else chunk.iloc[-n_rows:]
+        return tail
+    with open(filepath, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        block = CSV_TAIL_BLOCK_BYTES
+        while True:
+            start = max(size - block, 0)
+            fh.seek(start)
+            # Первая строка блока — обрезанная или заголовок файла
+            lines = [line for line in fh.read(size - start).splitlines()[1:] if line.strip()]
+            if len(lines) > n_rows or not start:
+                break
+            block *= 4
+    data = b"\n".join(lines[-n_rows:])
+    if not data:
+        return pd.DataFrame(columns=columns)
+    return pd.read_csv(io.BytesIO(data), encoding=enc, sep=sep, header=None, names=columns)
+
+
+def _csv_chunks(filepath: Path, enc: str, sep: str, columns: Optional[list], chunk_rows: int):
+    """CSV кусками по chunk_rows строк с прогрессом в логе."""
+    total_bytes = max(filepath.stat().st_size, 1)
+    n_rows = 0
+    with open(filepath, "rb") as fh:
+        with pd.read_csv(fh, encoding=enc, sep=sep, usecols=columns, chunksize=chunk_rows,
+                         dtype=object) as reader:
+            for chunk in reader:
+                n_rows += len(chunk)
+                logger.info(f"CSV {filepath.name}: {n_rows} строк ({min(fh.tell() / total_bytes, 1):.0%})")
+                yield _typed_chunk(chunk[columns] if columns else chunk)
+
+
+def _format_stat(value) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "—"
+    return f"{value:.6g}" if isinstance(value, float) else str(value)
+
+
+def _resolve_csv(filename: str):
+    """(путь, ошибка) для CSV-инструментов."""
+    filepath = _resolve_file(filename)
+    if not filepath:
+        return None, f"Файл не найден: {filename}"
+    if filepath.suffix.lower() not in CSV_SUFFIXES:
+        return None, (
+            f"Ошибка: ожидается CSV ({', '.join(sorted(CSV_SUFFIXES))}); "
+            f"для Excel используй excel_read / excel_pivot_analyze"
+        )
+    return filepath, None
+
+
+@tool
+def csv_read(filename: str, head: int = 10, tail: int = 5) -> str:
+    """Быстрый просмотр CSV любого размера: число строк, колонки, начало и конец.
+
+    Файл не загружается целиком: строки считаются по mmap, первые строки
+    читаются с начала, последние — с конца файла. Кодировка и разделитель
+    определяются автоматически. Для статистики по колонкам — csv_stats.
+
+    Args:
+        filename: Имя CSV-файла (.csv, .tsv, .txt)
+        head: Сколько первых строк показать (по умолчанию 10)
+        tail: Сколько последних строк показать (по умолчанию 5, 0 — не показывать)
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: pandas не установлен"
+
+    try:
+        filepath, error = _resolve_csv(filename)
+        if error:
+            return error
+        head = max(0, min(int(head), EXCEL_PAGE_MAX_ROWS))
+        tail = max(0, min(int(tail), EXCEL_PAGE_MAX_ROWS))
+
+        enc, sep = _sniff_csv(filepath)
+        first = pd.read_csv(filepath, encoding=enc, sep=sep, nrows=max(head, CSV_PREVIEW_ROWS))
+        columns = [str(c) for c in first.columns]
+        records, by_lines = _csv_records(filepath, enc, sep)
+        rows = max(records - 1, 0)
+        last = (_csv_tail(filepath, enc, sep, columns, tail, by_lines) if rows > head
+                else first.iloc[head:head + tail])
+
+        parts = [
+            f"Файл: {filepath.name} ({_format_bytes(filepath.stat().st_size)})",
+            f"Кодировка: {enc}, Разделитель: {repr(sep)}",
+            f"Строк: {rows} " + ("(по переводам строк)" if by_lines else "(разбором CSV: многострочные ячейки или UTF-16)"),
+            f"Колонок: {len(columns)}",
+            "Колонки: " + ", ".join(f"{c} ({first[c].dtype})" for c in first.columns),
+        ]
+        if head and len(first):
+            parts.append("\nПервые строки:\n" + first.head(head).to_string(index=False))
+        if tail and len(last):
+            parts.append("\nПоследние строки:\n" + last.to_string(index=False))
+        return "\n".join(parts)
+
+    except pd.errors.EmptyDataError:
+        return "CSV пустой"
+    except (UnicodeDecodeError, pd.errors.ParserError) as e:
+        return f"Не удалось прочитать CSV — неизвестная кодировка или формат: {e}"
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
+@tool
+def csv_stats(filename: str, columns: str = "") -> str:
+    """Статистика по колонкам CSV любого размера за один потоковый проход.
+
+    Для каждой колонки: пустые, число уникальных (HyperLogLog), для чисел —
+    min/max, среднее, σ и квантили p1–p99 (t-digest), для текста — частые
+    значения. Файл читается кусками в пределах бюджета памяти, поэтому
+    подходит для многогигабайтных логов — конвертировать в Excel не нужно.
+
+    Args:
+        filename: Имя CSV-файла (.csv, .tsv, .txt)
+        columns: JSON-список колонок: ["latency_ms", "status"] (пусто — все)
+    """
+    if not EXCEL_AVAILABLE:
+        return "Ошибка: pandas не установлен"
+
+    try:
+        filepath, error = _resolve_csv(filename)
+        if error:
+            return error
+        selected = [str(c) for c in _parse_json_arg(columns, [])]
+
+        enc, sep = _sniff_csv(filepath)
+        available = [str(c) for c in pd.read_csv(filepath, encoding=enc, sep=sep, nrows=0).columns]
+        missing = [c for c in selected if c not in available]
+        if missing:
+            return (
+                f"Колонки не найдены: {', '.join(missing)}\n"
+                f"Доступные колонки: {', '.join(available)}"
+            )
+
+        started = time.perf_counter()
+        plan = _table_plan(filepath, None, selected or None)
+        chunk_rows = min(CSV_CHUNK_ROWS, plan["chunk_rows"] or CSV_CHUNK_ROWS)
+        chunks = _csv_chunks(filepath, enc, sep, selected or None, chunk_rows)
+        total, profile, n_chunks = _profile_chunks(chunks, digests=True)
+
+        lines = [
+            f"Файл: {filepath.name} ({_format_bytes(filepath.stat().st_size)})",
+            f"Строк: {total}, Колонок: {len(profile)}",
+            f"Режим: потоково, {n_chunks} част. по {chunk_rows} строк",
+            f"Время: {time.perf_counter() - started:.1f} сек",
+            "",
+            "Колонки:",
+        ]
+        for info in profile:
+            lines.append(
+                f"  • {info['column']} ({info['dtype']}): пустых={info['nulls']}, "
+                f"уникальных≈{info['distinct']}"
+            )
+            if info.get("digest") is not None:
+                quantiles = info["digest"].quantiles(CSV_STATS_QUANTILES)
+                lines.append(
+                    f"      min={_format_stat(info['min'])}, max={_format_stat(info['max'])}, "
+                    f"среднее={_format_stat(info['mean'])}, σ={_format_stat(info['std'])}"
+                )
+                lines.append("      квантили: " + ", ".join(
+                    f"p{q * 100:g}={_format_stat(v)}" for q, v in zip(CSV_STATS_QUANTILES, quantiles)
+                ))
+            elif info["min"] is not None:
+                lines.append(f"      min={_format_stat(info['min'])}, max={_format_stat(info['max'])}")
+            if info["top"]:
+                lines.append("      топ: " + ", ".join(f"{v} ({n})" for v, n in info["top"]))
+        lines.append("\nУникальные и квантили — оценки (HyperLogLog, t-digest)")
+        return "\n".join(lines)
+
+    except json.JSONDecodeError as e:
+        return f"Ошибка парсинга JSON columns: {e}"
+    except pd.errors.EmptyDataError:
+        return "CSV пустой"
+    except (UnicodeDecodeError, pd.errors.ParserError) as e:
+        return f"Не удалось прочитать CSV — неизвестная кодировка или формат: {e}"
+    except Exception as e:
+        return f"Ошибка: {e}"
+
+
 # ============ СВОДНЫЕ ТАБЛИЦЫ (PIVOT) ============
 
+# Функции, которые складываются из частичных итогов по кускам таблицы
+CHUNKED_AGG_FUNCS = {"sum", "mean", "count", "min", "max", "std"}
+PIVOT_AGG_FUNCS = CHUNKED_AGG_FUNCS | {"median"}
+PIVOT_TOTAL_LABEL = "Итого"
+
+
+class _PartialAggregates:
+    """Частичные итоги сводной по группам с ограничением памяти.
+
+    Итоги кусков (по каждому полю: sum, count, n, min, max, sumsq по ключам
+    группировки) копятся в памяти; когда их объём превышает limit_bytes, они
+    сворачиваются повторной группировкой, а если и свёрнутые не помещаются —
+    делятся по хэшу ключей на SPILL_PARTITIONS частей и сбрасываются на диск.
+    В result() каждая часть сворачивается отдельно.
+    """
+
+    REDUCE = {"sum": "sum", "count": "sum", "n": "sum", "min": "min", "max": "max", "sumsq": "sum"}
+
+    def __init__(self, limit_bytes: int, spill_dir: Path):
+        self.limit = limit_bytes
+        self.spill_dir = spill_dir
+        self.pending: list = []
+        self.pending_bytes = 0
+        self.spills = 0
+
+    def add(self, partial: "pd.DataFrame") -> None:
+        self.pending.append(partial)
+        self.pending_bytes += int(partial.memory_usage(deep=True).sum())
+        if self.pending_bytes <= self.limit:
+            return
+        merged = self._reduce(self.pending)
+        self.pending, self.pending_bytes = [merged], int(merged.memory_usage(deep=True).sum())
+        if self.pending_bytes > self.limit / 2:
+            self._spill(merged)
+            self.pending, self.pending_bytes = [], 0
+
+    @classmethod
+    def reduce_spec(cls, columns) -> Dict[tuple, str]:
+        """Функция свёртки для колонок (поле, итог)."""
+        return {col: cls.REDUCE[col[-1]] for col in columns}
+
+    def _reduce(self, parts: list) -> "pd.DataFrame":
+        frame = pd.concat(parts)
+        return frame.groupby(level=list(frame.index.names), sort=False).agg(self.reduce_spec(frame.columns))
+
+    def _spill(self, frame: "pd.DataFrame") -> None:
+        # Хэш по строковому виду ключей: 1 и 1.0 из разных кусков попадают в одну часть
+        keys = frame.index.to_frame(index=False).astype(str)
+        part = pd.util.hash_pandas_object(keys, index=False).to_numpy() % SPILL_PARTITIONS
+        for p in np.unique(part):
+            # pickle, а не Feather: ключи бывают смешанных типов
+            frame[part == p].to_pickle(self.spill_dir / f"part{p}_{self.spills}.pkl")
+        self.spills += 1
+
+    def result(self) -> "pd.DataFrame":
+        if not self.spills:
+            return self._reduce(self.pending) if self.pending else pd.DataFrame()
+        if self.pending:
+            self._spill(self._reduce(self.pending))
+            self.pending = []
+        parts = []
+        for p in range(SPILL_PARTITIONS):
+            files = sorted(self.spill_dir.glob(f"part{p}_*.pkl"))
+            if files:
+                parts.append(self._reduce([pd.read_pickle(f) for f in files]))
+        return pd.concat(parts)
+
+
+def _parse_pivot_aggregates(value_field: Optional[str], agg_func: str,
+                            aggregates: Optional[str]) -> Dict[str, List[str]]:
+    """{"поле": ["функции"]} из aggregates (JSON) или из пары value_field + agg_func.
+
+    Без value_field поле — None: pivot_table агрегирует все остальные колонки.
+    """
+    if aggregates:
+        spec = _parse_json_arg(aggregates, {})
+        if not isinstance(spec, dict) or not spec:
+            raise ValueError('aggregates — JSON-объект {"поле": "функция" или ["функции"]}')
+        return {field: ([funcs] if isinstance(funcs, str) else list(dict.fromkeys(funcs)))
+                for field, funcs in spec.items()}
+    return {value_field: [agg_func]}
+
+
+def _pivot_partial(chunk: "pd.DataFrame", keys: list, aggregates: Dict[str, List[str]]) -> "pd.DataFrame":
+    """Частичные итоги одного куска по группам keys — одна группировка на все поля.
+
+    Колонки — (поле, итог): sum, count (числовых), n (непустых), min, max, sumsq.
+    """
+    frame = {}
+    for field, funcs in aggregates.items():
+        raw = chunk[field]
+        numeric = pd.to_numeric(raw, errors="coerce").astype("float64")
+        if set(funcs) - {"count"} and raw.notna().any() and not numeric.notna().any():
+            raise ValueError(f"поле {field} не числовое — для него доступна только count")
+        frame.update({
+            (field, "sum"): numeric, (field, "count"): numeric.notna(), (field, "n"): raw.notna(),
+            (field, "min"): numeric, (field, "max"): numeric, (field, "sumsq"): numeric * numeric,
+        })
+    frame = pd.DataFrame(frame, index=chunk.index)
+    grouped = frame.groupby([chunk[k] for k in keys], sort=False, observed=True)
+    stats = grouped.agg(_PartialAggregates.reduce_spec(frame.columns))
+    stats.index.names = keys
+    return stats
+
+
+def _finish_stats(stats: "pd.DataFrame", agg_func: str) -> "pd.Series":
+    """Значение агрегата из частичных итогов одного поля."""
+    if agg_func == "count":
+        return stats["n"]
+    if agg_func == "mean":
+        return stats["sum"] / stats["count"].where(stats["count"] > 0)
+    if agg_func == "std":
+        count = stats["count"].where(stats["count"] > 1)
+        var = (stats["sumsq"] - stats["sum"] ** 2 / count) / (count - 1)
+        return np.sqrt(var.clip(lower=0))
+    return stats[agg_func]
+
+
+def _total_label(levels: int):
+    return PIVOT_TOTAL_LABEL if levels == 1 else (PIVOT_TOTAL_LABEL,) + ("",) * (levels - 1)
+
+
+def _pivot_layout(cells: "pd.DataFrame", rows: list, cols: list, totals, margins: bool,
+                  flat: bool) -> "pd.DataFrame":
+    """Раскладка сводной из значений по группам rows + cols.
+
+    cells — колонки (поле, функция), индекс — ключи групп. totals(levels) —
+    те же значения по группам levels (подытоги), totals(None) — общий итог
+    (Series по (поле, функция)). В колонках каждого (поле, функция) — свой
+    блок значений cols со своим «Итого». flat — одно поле и одна функция:
+    без этих двух уровней, как у pivot_table(values=поле).
+    """
+    table = cells.unstack(cols) if cols else cells
+    # Как pivot_table(dropna=True): пустые группы и колонки не выводятся
+    table = table.dropna(how="all").dropna(axis=1, how="all")
+
+    if margins:
+        grand = totals(None)
+        if cols:
+            row_totals, col_totals = totals(rows), totals(cols)
+            pad = ("",) * (len(cols) - 1)
+            data, bottom = {}, []
+            for pair in cells.columns:
+                for column in (c for c in table.columns if c[:2] == pair):
+                    data[column] = table[column]
+                    key = column[2:] if len(cols) > 1 else column[2]
+                    bottom.append(col_totals[pair].get(key))
+                data[pair + (PIVOT_TOTAL_LABEL,) + pad] = row_totals[pair]
+                bottom.append(grand[pair])
+            table = pd.DataFrame(data)
+        else:
+            bottom = [grand[pair] for pair in table.columns]
+
+        label = _total_label(len(rows))
+        index = (pd.MultiIndex.from_tuples([label], names=table.index.names) if len(rows) > 1
+                 else pd.Index([label], name=table.index.name))
+        table = pd.concat([table, pd.DataFrame([bottom], index=index, columns=table.columns)])
+
+    if flat:
+        table.columns = table.columns.droplevel([0, 1]) if cols else table.columns.get_level_values(0)
+    return table
+
+
+def _pivot_from_stats(stats: "pd.DataFrame", rows: list, cols: list,
+                      aggregates: Dict[str, List[str]], margins: bool, flat: bool) -> "pd.DataFrame":
+    """Сводная из частичных итогов по группам rows + cols (подытоги — свёрткой итогов)."""
+    stats = stats.sort_index()
+
+    def finish(part: "pd.DataFrame") -> "pd.DataFrame":
+        return pd.DataFrame({
+            (field, func): _finish_stats(part[field], func)
+            for field, funcs in aggregates.items() for func in funcs
+        }, index=part.index)
+
+    def totals(levels):
+        spec = _PartialAggregates.reduce_spec(stats.columns)
+        if levels is None:
+            # Общий итог — группировка по константе: колонки остаются (поле, итог)
+            return finish(stats.groupby(np.zeros(len(stats), dtype=np.int8)).agg(spec)).iloc[0]
+        return finish(stats.groupby(level=levels).agg(spec))
+
+    return _pivot_layout(finish(stats), rows, cols, totals, margins, flat)
+
+
+def _pivot_frame(df: "pd.DataFrame", rows: list, cols: list, aggregates: Dict[str, List[str]],
+                 margins: bool, flat: bool) -> "pd.DataFrame":
+    """Сводная по таблице в памяти.
+
+    Одно поле и одна функция — pandas pivot_table, как раньше. Несколько —
+    одна группировка groupby().agg по всем полям и функциям сразу
+    (pivot_table не умеет итоги для словаря функций).
+    """
+    if flat:
+        (value_field, (agg_func,)), = aggregates.items()
+        pivot_params = {
+            'values': value_field,
+            'index': rows,
+            'aggfunc': agg_func,
+        }
+
+        if cols:
+            pivot_params['columns'] = cols
+
+        if margins:
+            pivot_params['margins'] = True
+            pivot_params['margins_name'] = PIVOT_TOTAL_LABEL
+
+        return df.pivot_table(**pivot_params)
+
+    def totals(levels):
+        if levels is None:
+            result = df[list(aggregates)].agg(aggregates)
+            return pd.Series({(field, func): result.at[func, field]
+                              for field, funcs in aggregates.items() for func in funcs})
+        return df.groupby(levels, observed=True).agg(aggregates)
+
+    cells = df.groupby(rows + cols, observed=True).agg(aggregates)
+    return _pivot_layout(cells, rows, cols, totals, margins, flat)
+
+
+def _chunked_pivot(filepath: Path, plan: Dict[str, Any], rows: list, cols: list,
+                   aggregates: Dict[str, List[str]], margins: bool, flat: bool) -> tuple:
+    """Сводная по таблице больше бюджета памяти: (pivot, число кусков, сбросов на диск)."""
+    keys = rows + cols
+    needed = list(dict.fromkeys(keys + list(aggregates)))
+    SPILL_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=SPILL_DIR) as tmp:
+        partials = _PartialAggregates(DATA_MEMORY_BUDGET_BYTES // 4, Path(tmp))
+        chunks = 0
+        for chunk in _iter_table_chunks(filepath, columns=needed, chunk_rows=plan["chunk_rows"]):
+            partials.add(_pivot_partial(chunk, keys, aggregates))
+            chunks += 1
+            logger.info(f"Сводная {filepath.name}: часть {chunks}, сбросов на диск {partials.spills}")
+        stats = partials.result()
+    if stats.empty:
+        raise ValueError("в таблице нет строк с заполненными полями группировки")
+    return _pivot_from_stats(stats, rows, cols, aggregates, margins, flat), chunks, partials.spills
+
+
+def _decomposable(aggregates: Dict[str, List[str]]) -> bool:
+    return all(func in CHUNKED_AGG_FUNCS for funcs in aggregates.values() for func in funcs)
+
+
+def _pivot_file_partial(filepath: Path, keys: list, aggregates: Dict[str, List[str]],
+                        chunk_rows: int, budget: int) -> "pd.DataFrame":
+    """Задача пула: частичные итоги сводной по одному файлу (кусками, в пределах budget).
+
+    Для функций, которые не собираются из частичных итогов (median), —
+    сами нужные колонки файла.
+    """
+    needed = list(dict.fromkeys(keys + list(aggregates)))
+    try:
+        chunks = _iter_table_chunks(filepath, columns=needed, chunk_rows=chunk_rows)
+        if not _decomposable(aggregates):
+            frames = list(chunks)
+            return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=needed)
+        SPILL_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=SPILL_DIR) as tmp:
+            partials = _PartialAggregates(budget // 4, Path(tmp))
+            for chunk in chunks:
+                partials.add(_pivot_partial(chunk, keys, aggregates))
+            return partials.result()
+    except Exception as e:
+        raise ValueError(f"{filepath.name}: {e}") from e
+
+
+def _multi_file_pivot(paths: List[Path], rows: list, cols: list, aggregates: Dict[str, List[str]],
+                      margins: bool, flat: bool) -> tuple:
+    """Сводная по нескольким файлам одной структуры: (pivot, строка режима).
+
+    Map — каждый файл разбирается и сворачивается в частичные итоги в пуле
+    процессов (бюджет памяти делится между процессами), reduce — итоги
+    сливаются через _PartialAggregates в основном процессе.
+    """
+    keys = rows + cols
+    needed = list(dict.fromkeys(keys + list(aggregates)))
+    parallel = sum(p.stat().st_size for p in paths) >= PARALLEL_MIN_BYTES
+    workers = min(PROCESS_POOL_WORKERS, len(paths)) if parallel else 1
+    budget = DATA_MEMORY_BUDGET_BYTES // workers
+    chunk_rows = _chunk_rows_for(_estimate_row_bytes(paths[0], columns=needed), budget)
+    args = (keys, aggregates, chunk_rows, budget)
+
+    futures = {}
+    if parallel:
+        pool = _get_process_pool()
+        futures = {path: pool.submit(_pivot_file_partial, path, *args) for path in paths}
+        logger.info(f"Сводная: {len(paths)} файлов разбираются в {workers} процессах")
+
+    decomposable = _decomposable(aggregates)
+    frames, frames_bytes = [], 0
+    SPILL_DIR.mkdir(parents=True, exist_ok=True)
+    try:
+        with tempfile.TemporaryDirectory(dir=SPILL_DIR) as tmp:
+            partials = _PartialAggregates(DATA_MEMORY_BUDGET_BYTES // 4, Path(tmp))
+            for path in paths:
+                local = lambda path=path: _pivot_file_partial(path, *args)
+                part = _pool_result(futures[path], local) if path in futures else local()
+                if decomposable:
+                    partials.add(part)
+                    continue
+                frames_bytes += int(part.memory_usage(deep=True).sum())
+                if frames_bytes > DATA_MEMORY_BUDGET_BYTES:
+                    raise ValueError(
+                        f"median нельзя собрать из частичных итогов, а данные файлов больше "
+                        f"бюджета памяти ({_format_bytes(DATA_MEMORY_BUDGET_BYTES)}). "
+                        f"Доступно: {', '.join(sorted(CHUNKED_AGG_FUNCS))} или увеличьте DATA_MEMORY_BUDGET_MB"
+                    )
+                frames.append(part)
+            stats = partials.result() if decomposable else None
+    finally:
+        for future in futures.values():
+            future.cancel()
+
+    if decomposable:
+        if stats.empty:
+            raise ValueError("в файлах нет строк с заполненными полями группировки")
+        pivot = _pivot_from_stats(stats, rows, cols, aggregates, margins, flat)
+    else:
+        pivot = _pivot_frame(pd.concat(frames, ignore_index=True), rows, cols, aggregates, margins, flat)
+
+    line = f"Режим: файлов — {len(paths)}, " + (
+        f"частичные итоги в {workers} процессах" if parallel else "частичные итоги последовательно"
+    )
+    if partials.spills:
+        line += f", сброшены на диск {partials.spills} раз"
+    return pivot, line
+
+
 @tool
 def excel_create_pivot(
     source_file: str,
@@ -924,124 +6076,127 @@ def excel_create_pivot(
     column_fields: str = None,
     value_field: str = None,
     agg_func: str = "sum",
-    show_totals: bool = True
+    show_totals: bool = True,
+    aggregates: str = None,
 ) -> str:
     """
     Создать сводную таблицу (pivot table) из данных Excel.
 
+    Несколько файлов одной структуры (выгрузки по месяцам, регионам)
+    сводятся в одну таблицу: каждый файл сворачивается параллельно
+    в пуле процессов, частичные итоги сливаются в конце.
+
     Args:
-        source_file: Имя исходного файла
+        source_file: Имя исходного файла, glob-шаблон ("sales_*.xlsx")
+            или JSON список файлов: ["jan.xlsx", "feb.xlsx"]
         output_file: Имя файла для сохранения сводной
         row_fields: JSON список полей для строк: ["Категория", "Продукт"]
         column_fields: JSON список полей для столбцов: ["Месяц"] (опционально)
         value_field: Поле для агрегации ("Сумма", "Количество")
-        agg_func: Функция: "sum", "mean", "count", "min", "max"
+        agg_func: Функция: "sum", "mean", "count", "min", "max", "median", "std"
         show_totals: Показывать итоги
+        aggregates: Несколько полей и функций за один проход вместо
+            value_field/agg_func — JSON {"поле": "функция" или ["функции"]}:
+            {"Выручка": ["sum", "mean"], "Заказы": "count"}
     """
     if not EXCEL_AVAILABLE:
         return "Ошибка: pandas не установлен"
 
-    # Валидация agg_func
-    allowed_funcs = {"sum", "mean", "count", "min", "max", "median", "std"}
-    if agg_func not in allowed_funcs:
-        return f"Ошибка: agg_func должна быть одной из: {', '.join(allowed_funcs)}"
-
     try:
-        source_path = _resolve_file(source_file)
-        if not source_path:
+        agg_spec = _parse_pivot_aggregates(value_field, agg_func, aggregates)
+        # Валидация функций
+        bad_funcs = {f for funcs in agg_spec.values() for f in funcs} - PIVOT_AGG_FUNCS
+        if bad_funcs:
+            return f"Ошибка: agg_func должна быть одной из: {', '.join(sorted(PIVOT_AGG_FUNCS))}"
+        flat = not aggregates
+        value_fields = [f for f in agg_spec if f is not None]
+
+        # Прошлая сводная может подходить под тот же шаблон — её не читаем
+        output_path = OUTPUT_DIR / output_file
+        sources = [p for p in _resolve_files(source_file) if p != output_path]
+        if not sources:
             return f"Файл не найден: {source_file}"
-
-        df = pd.read_excel(source_path)
+        source_path = sources[0]
 
         # Парсим поля
         rows = json.loads(row_fields) if isinstance(row_fields, str) else row_fields
         cols = json.loads(column_fields) if column_fields and isinstance(column_fields, str) else column_fields
+        cols = cols or []
 
         # Валидация полей
-        missing_fields = [f for f in rows if f not in df.columns]
-        if value_field and value_field not in df.columns:
-            missing_fields.append(value_field)
-        if cols:
-            missing_fields.extend(f for f in cols if f not in df.columns)
+        available = _table_columns(source_path)
+        missing_fields = [f for f in rows + cols + value_fields if f not in available]
         if missing_fields:
             return (
                 f"Поля не найдены в данных: {', '.join(missing_fields)}\n"
-                f"Доступные колонки: {', '.join(df.columns)}"
+                f"Доступные колонки: {', '.join(available)}"
             )
 
-        # Создаём сводную
-        pivot_params = {
-            'values': value_field,
-            'index': rows,
-            'aggfunc': agg_func,
-        }
-
-        if cols:
-            pivot_params['columns'] = cols
-
-        if show_totals:
-            pivot_params['margins'] = True
-            pivot_params['margins_name'] = 'Итого'
-
-        pivot = df.pivot_table(**pivot_params)
+        # Нужны только поля сводной — по ним же оценивается объём
+        needed = list(dict.fromkeys(rows + cols + value_fields)) if value_fields else None
+        plan = _table_plan(source_path, columns=needed) if len(sources) == 1 else None
+
+        if plan is None:
+            if not value_fields:
+                return "Ошибка: для сводной по нескольким файлам укажите value_field"
+            pivot, mode_line = _multi_file_pivot(sources, rows, cols, agg_spec, show_totals, flat)
+        elif plan["mode"] == "chunked":
+            if not value_fields:
+                return "Ошибка: таблица больше бюджета памяти — укажите value_field для сводной по частям"
+            if not _decomposable(agg_spec):
+                return (
+                    f"Ошибка: median нельзя собрать из частичных итогов, а таблица больше "
+                    f"бюджета памяти ({_format_bytes(DATA_MEMORY_BUDGET_BYTES)}). "
+                    f"Доступно: {', '.join(sorted(CHUNKED_AGG_FUNCS))} или увеличьте DATA_MEMORY_BUDGET_MB"
+                )
+            pivot, chunks, spills = _chunked_pivot(source_path, plan, rows, cols, agg_spec, show_totals, flat)
+            mode_line = _plan_line(plan, chunks, spills)
+        else:
+            df = _read_table(source_path, columns=needed)
+            pivot = _pivot_frame(df, rows, cols, agg_spec, show_totals, flat)
+            mode_line = _plan_line(plan)
 
         # Сохраняем с форматированием
-        output_path = OUTPUT_DIR / output_file
-
+        _discard_appends(output_path)
         with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
             pivot.to_excel(writer, sheet_name='Сводная')
             ws = writer.sheets['Сводная']
 
-            # Форматирование заголовков
-            header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-            header_font = Font(bold=True, color="FFFFFF")
-
-            for cell in ws[1]:
-                cell.fill = header_fill
-                cell.font = header_font
-                cell.alignment = Alignment(horizontal="center", vertical="center")
-
-            for row in ws.iter_rows(min_row=2, max_row=ws.max_row, min_col=1, max_col=1):
-                for cell in row:
-                    cell.font = Font(bold=True)
-
-            # Форматирование итогов
+            # Форматирование: шапка, подписи строк, итоги — именованные стили
+            wb = writer.book
+            n_rows, n_cols = ws.max_row, ws.max_column
+            # MultiIndex в столбцах: по строке на уровень + строка с именами индекса
+            levels = pivot.columns.nlevels
+            header_rows = levels + 1 if levels > 1 else 1
+            index_cols = pivot.index.nlevels
+            last_body = n_rows - 1 if show_totals else n_rows
+
+            _style_range(ws, _register_style(wb, "header"), 1, header_rows, 1, n_cols)
+            if last_body > header_rows:
+                _style_range(ws, _register_style(wb, "rowhead"), header_rows + 1, last_body, 1, index_cols)
+                if n_cols > index_cols:
+                    _style_range(ws, _register_style(wb, "body"), header_rows + 1, last_body, index_cols + 1, n_cols)
             if show_totals:
-                last_row = ws.max_row
-                total_fill = PatternFill(start_color="FFD966", end_color="FFD966", fill_type="solid")
-                for cell in ws[last_row]:
-                    cell.fill = total_fill
-                    cell.font = Font(bold=True)
-
-            # Границы
-            thin_border = Border(
-                left=Side(style='thin'), right=Side(style='thin'),
-                top=Side(style='thin'), bottom=Side(style='thin')
-            )
+                _style_range(ws, _register_style(wb, "total"), n_rows, n_rows, 1, n_cols)
 
-            for row in ws.iter_rows(min_row=1, max_row=ws.max_row):
-                for cell in row:
-                    cell.border = thin_border
+            # Автоширина — по данным сводной, без обхода ячеек листа
+            for col_idx, width in enumerate(_frame_column_widths(pivot), 1):
+                ws.column_dimensions[get_column_letter(col_idx)].width = min(width + 2, 40)
 
-            # Автоширина
-            for column in ws.columns:
-                max_length = 0
-                column_letter = column[0].column_letter
-                for cell in column:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                ws.column_dimensions[column_letter].width = min(max_length + 2, 40)
+        _workbook_cache.invalidate(output_path)
 
         total_rows = len(pivot)
         total_cols = len(pivot.columns) if hasattr(pivot, 'columns') else 1
 
         return (
             f"✓ Сводная таблица: {output_file}\n\n"
-            f"Строки: {', '.join(rows)}\n"
+            + (f"Файлы ({len(sources)}): {', '.join(p.name for p in sources)}\n" if len(sources) > 1 else "")
+            + f"Строки: {', '.join(rows)}\n"
             f"Столбцы: {', '.join(cols) if cols else 'нет'}\n"
-            f"Агрегация: {agg_func}({value_field})\n"
+            f"Агрегация: {', '.join(f'{func}({field})' for field, funcs in agg_spec.items() for func in funcs)}\n"
             f"Размер: {total_rows} × {total_cols}\n"
-            f"Итоги: {'да' if show_totals else 'нет'}"
+            f"Итоги: {'да' if show_totals else 'нет'}\n"
+            f"{mode_line}"
         )
 
     except json.JSONDecodeError as e:
@@ -1066,32 +6221,45 @@ def excel_pivot_analyze(source_file: str) -> str:
         if not source_path:
             return f"Файл не найден: {source_file}"
 
-        df = pd.read_excel(source_path)
+        profile = _profile_table(source_path)
+        columns = profile["columns"]
 
         analysis = []
         analysis.append(f"Файл: {source_path.name}")
-        analysis.append(f"Строк: {len(df)}, Колонок: {len(df.columns)}\n")
+        analysis.append(f"Строк: {profile['rows']}, Колонок: {len(columns)}")
+        analysis.append(profile["mode"])
+        if profile["sample_rows"]:
+            analysis.append(
+                f"Профиль по выборке из {profile['sample_rows']} строк, "
+                f"число уникальных — оценка"
+            )
+        analysis.append("")
 
         analysis.append("Поля:")
-        for col in df.columns:
-            dtype = df[col].dtype
-            unique = df[col].nunique()
-            nulls = df[col].isnull().sum()
-
-            if unique < 50 and dtype == 'object':
+        for info in columns:
+            if info["kind"] == "text" and info["distinct"] < PROFILE_CATEGORICAL_MAX:
                 tip = "→ для группировки (строки/столбцы)"
-            elif dtype in ['int64', 'float64']:
+            elif info["kind"] == "numeric" and info["distinct"]:
                 tip = "→ для агрегации (значения)"
             else:
                 tip = ""
 
-            analysis.append(
-                f"  • {col}: тип={dtype}, уникальных={unique}, пустых={nulls} {tip}"
+            line = (
+                f"  • {info['column']}: тип={info['dtype']}, уникальных≈{info['distinct']}, "
+                f"пустых={info['nulls']}"
             )
+            if info["min"] is not None and not pd.isna(info["min"]):
+                line += f", min={info['min']}, max={info['max']}"
+            if info["top"]:
+                line += ", топ: " + ", ".join(f"{v} ({n})" for v, n in info["top"])
+            analysis.append(f"{line} {tip}")
 
         # Рекомендации
-        categorical = [c for c in df.columns if df[c].dtype == 'object' and df[c].nunique() < 50]
-        numeric = [c for c in df.columns if df[c].dtype in ['int64', 'float64']]
+        categorical = [
+            c["column"] for c in columns
+            if c["kind"] == "text" and c["distinct"] < PROFILE_CATEGORICAL_MAX
+        ]
+        numeric = [c["column"] for c in columns if c["kind"] == "numeric" and c["distinct"]]
 
         analysis.append("\nРекомендации:")
         if categorical and numeric:
@@ -1115,6 +6283,43 @@ def excel_pivot_analyze(source_file: str) -> str:
 
 # ============ PDF TOOLS ============
 
+# С этого числа страниц текст извлекается в пуле процессов
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "16"))
+# Задач на процесс: диапазоны поменьше выравнивают нагрузку, побольше —
+# реже открывают документ заново
+PDF_TASKS_PER_WORKER = 4
+
+
+def _pdf_pages_text(filepath: Path, start: int, stop: int) -> list:
+    """Текст страниц [start, stop). Процесс пула открывает документ сам —
+    объекты PyMuPDF между процессами не передаются."""
+    with pymupdf.open(str(filepath)) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+
+def _pdf_text(filepath: Path, pages: int) -> list:
+    """Текст первых pages страниц в порядке страниц.
+
+    Длинный документ делится на диапазоны страниц для пула процессов;
+    результаты раскладываются по местам по мере готовности.
+    """
+    if pages < max(PDF_PARALLEL_MIN_PAGES, 2):
+        return _pdf_pages_text(filepath, 0, pages)
+
+    step = math.ceil(pages / (PROCESS_POOL_WORKERS * PDF_TASKS_PER_WORKER))
+    pool = _get_process_pool()
+    futures = {
+        pool.submit(_pdf_pages_text, filepath, start, min(start + step, pages)): start
+        for start in range(0, pages, step)
+    }
+    texts = [""] * pages
+    for future in as_completed(futures):
+        start = futures[future]
+        stop = min(start + step, pages)
+        texts[start:stop] = _pool_result(future, lambda: _pdf_pages_text(filepath, start, stop))
+    return texts
+
+
 @tool
 def pdf_read(filename: str, max_pages: int = 50) -> str:
     """Прочитать текст из PDF-файла.
@@ -1131,18 +6336,15 @@ def pdf_read(filename: str, max_pages: int = 50) -> str:
         if not filepath:
             return f"Файл не найден: {filename}"
 
-        doc = pymupdf.open(str(filepath))
-        total = len(doc)
+        with pymupdf.open(str(filepath)) as doc:
+            total = len(doc)
         pages_to_read = min(total, max_pages)
 
-        text_parts = []
-        for i in range(pages_to_read):
-            page = doc[i]
-            text = page.get_text()
-            if text.strip():
-                text_parts.append(f"--- Страница {i + 1} ---\n{text.strip()}")
-
-        doc.close()
+        text_parts = [
+            f"--- Страница {i + 1} ---\n{text.strip()}"
+            for i, text in enumerate(_pdf_text(filepath, pages_to_read))
+            if text.strip()
+        ]
 
         if not text_parts:
             return f"PDF {filepath.name}: {total} страниц, но текст не извлечён (возможно, скан)"
@@ -1911,8 +7113,10 @@ ALL_TOOLS = [
     web_search, fetch_url, bash_execute, create_file, view_file, list_files, python_execute,
     # Excel
     excel_create, excel_add_formulas, excel_style,
-    excel_read, excel_read_structured, excel_edit_cell, excel_from_csv,
-    excel_create_pivot, excel_pivot_analyze,
+    excel_read, excel_read_structured, excel_edit_cell, excel_edit_cells, excel_from_csv,
+    excel_create_pivot, excel_pivot_analyze, excel_query, excel_append_rows,
+    # CSV и таблицы
+    csv_read, csv_stats, table_join, catalog_search,
     # PDF
     pdf_read, pdf_info, pdf_extract_pages,
     # Word
@@ -1965,6 +7169,9 @@ def create_claude_agent(
 
     checkpointer = MemorySaver() if use_memory else None
 
+    # Каталог таблиц строится в фоне, пока пользователь формулирует запрос
+    _catalog.start()
+
     agent = create_agent(
         model=model_instance, tools=ALL_TOOLS,
         system_prompt=SYSTEM_PROMPT, checkpointer=checkpointer,
@@ -2041,6 +7248,7 @@ def run_agent_stream(
 # ============ MAIN ============
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     print("🤖 Инициализация агента v3 (с доработками)...\n")
 
     if not EXCEL_AVAILABLE:
@@ -0,0 +1,32 @@
+"""Общие фикстуры: агент работает в отдельной временной папке."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import claude_agent_v3 as agent  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def workspace(tmp_path, monkeypatch):
+    """OUTPUT_DIR, WORK_DIR и кэши — во временной папке, кэши в памяти пусты."""
+    output, work = tmp_path / "outputs", tmp_path / "work"
+    output.mkdir()
+    work.mkdir()
+    cache = work / ".cache"
+    monkeypatch.setattr(agent, "OUTPUT_DIR", output)
+    monkeypatch.setattr(agent, "WORK_DIR", work)
+    monkeypatch.setattr(agent, "CACHE_DIR", cache)
+    monkeypatch.setattr(agent, "SPILL_DIR", cache / "spill")
+    monkeypatch.setattr(agent, "APPEND_DIR", cache / "append")
+    monkeypatch.setattr(agent._frame_store, "root", cache / "frames")
+    agent._workbook_cache.clear()
+    agent._row_indexes.clear()
+    agent._content_hashes.clear()
+    agent._table_size_estimates.clear()
+    yield output
+    agent._workbook_cache.clear()
+    agent._row_indexes.clear()
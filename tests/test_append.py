@@ -0,0 +1,41 @@
+"""excel_append_rows: журнал строк не переживает пересоздание книги."""
+
+import json
+
+import pandas as pd
+
+import claude_agent_v3 as agent
+
+
+def _append(filename, rows):
+    result = agent.excel_append_rows.invoke({"filename": filename, "rows": json.dumps(rows)})
+    assert result.startswith("✓"), result
+
+
+def test_buffered_rows_are_flushed_on_read(workspace):
+    agent.excel_create.invoke({"filename": "log.xlsx", "data": json.dumps([["Name", "N"], ["a", 1]])})
+    _append("log.xlsx", [["b", 2], ["c", 3]])
+    assert agent._has_pending_appends(workspace / "log.xlsx")
+    assert "c" in agent.excel_read.invoke({"filename": "log.xlsx"})
+    assert pd.read_excel(workspace / "log.xlsx")["Name"].tolist() == ["a", "b", "c"]
+
+
+def test_create_discards_pending_rows(workspace):
+    _append("log.xlsx", [["old", 1], ["old", 2]])
+    agent.excel_create.invoke({"filename": "log.xlsx", "data": json.dumps([["Name", "N"], ["new", 9]])})
+    assert not agent._has_pending_appends(workspace / "log.xlsx")
+    assert "old" not in agent.excel_read.invoke({"filename": "log.xlsx"})
+    assert pd.read_excel(workspace / "log.xlsx")["Name"].tolist() == ["new"]
+
+    _append("log.xlsx", [["next", 10]])
+    agent._flush_appends(workspace / "log.xlsx")
+    assert pd.read_excel(workspace / "log.xlsx")["Name"].tolist() == ["new", "next"]
+
+
+def test_csv_conversion_discards_pending_rows(workspace):
+    _append("data.xlsx", [["old", 1]])
+    pd.DataFrame({"Name": ["csv"], "N": [5]}).to_csv(workspace / "data.csv", index=False)
+    result = agent.excel_from_csv.invoke({"csv_filename": "data.csv", "excel_filename": "data.xlsx"})
+    assert result.startswith("✓"), result
+    assert not agent._has_pending_appends(workspace / "data.xlsx")
+    assert pd.read_excel(workspace / "data.xlsx")["Name"].tolist() == ["csv"]
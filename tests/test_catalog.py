@@ -0,0 +1,92 @@
+"""Каталог таблиц: фоновое обновление и поиск без разбора файлов."""
+
+from concurrent.futures import Future
+
+import pandas as pd
+import pytest
+
+import claude_agent_v3 as agent
+
+
+class _RecordingPool:
+    """Пул, выполняющий задачи сразу и записывающий порядок submit/result."""
+
+    def __init__(self):
+        self.events = []
+
+    def submit(self, fn, *args):
+        self.events.append("submit")
+        future = Future()
+        future.set_result(fn(*args))
+        original = future.result
+
+        def result(timeout=None):
+            self.events.append("result")
+            return original(timeout)
+
+        future.result = result
+        return future
+
+
+@pytest.fixture
+def catalog(workspace, monkeypatch, tmp_path):
+    catalog = agent._Catalog(tmp_path / "catalog.sqlite3")
+    monkeypatch.setattr(agent, "_catalog", catalog)
+    monkeypatch.setattr(catalog, "start", lambda: None)
+    pool = _RecordingPool()
+    monkeypatch.setattr(agent, "_get_process_pool", lambda: pool)
+    catalog.pool = pool
+    return catalog
+
+
+def _csv(workspace, name, columns):
+    path = workspace / name
+    pd.DataFrame({c: [1, 2, 3] for c in columns}).to_csv(path, index=False)
+    return path
+
+
+def test_refresh_submits_all_files_before_collecting(workspace, catalog):
+    for i in range(4):
+        _csv(workspace, f"part_{i}.csv", ["Регион", f"Сумма_{i}"])
+
+    stats = catalog.refresh()
+
+    assert stats == {"files": 4, "changed": 4, "removed": 0}
+    assert catalog.pool.events == ["submit"] * 4 + ["result"] * 4
+    results, total = catalog.search(["регион"], 10)
+    assert total == 4 and len(results) == 4
+
+
+def test_refresh_is_incremental(workspace, catalog):
+    _csv(workspace, "a.csv", ["Регион"])
+    catalog.refresh()
+    catalog.pool.events.clear()
+
+    assert catalog.refresh()["changed"] == 0
+    assert catalog.pool.events == []
+
+    (workspace / "a.csv").unlink()
+    assert catalog.refresh()["removed"] == 1
+    assert catalog.search([], 10) == ([], 0)
+
+
+def test_search_does_not_refresh(workspace, catalog, monkeypatch):
+    _csv(workspace, "sales.csv", ["Регион", "Выручка"])
+    catalog.refresh()
+    _csv(workspace, "costs.csv", ["Регион", "Затраты"])
+
+    def fail():
+        raise AssertionError("catalog_search не должен обновлять каталог")
+
+    monkeypatch.setattr(catalog, "refresh", fail)
+    text = agent.catalog_search.invoke({"query": "Регион"})
+
+    assert "sales.csv" in text and "costs.csv" not in text
+    assert "Каталог обновлён" in text
+
+
+def test_search_before_first_refresh(workspace, catalog):
+    _csv(workspace, "sales.csv", ["Регион"])
+    text = agent.catalog_search.invoke({"query": ""})
+    assert "Таблиц в каталоге: 0" in text
+    assert "ещё строится" in text
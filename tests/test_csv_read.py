@@ -0,0 +1,53 @@
+"""csv_read: число строк и хвост без загрузки файла — и когда строка файла не равна записи."""
+
+import pandas as pd
+import pytest
+
+import claude_agent_v3 as agent
+
+
+def _frame(n=30, note=lambda i: f"заметка {i}"):
+    return pd.DataFrame({"id": range(n), "note": [note(i) for i in range(n)]})
+
+
+def _rows(result):
+    return int(result.split("Строк: ")[1].split()[0])
+
+
+def test_plain_csv_counted_by_lines(workspace):
+    _frame(note=lambda i: f'"цитата" {i}').to_csv(workspace / "plain.csv", index=False)
+    result = agent.csv_read.invoke({"filename": "plain.csv", "head": 3, "tail": 2})
+    assert _rows(result) == 30
+    assert "по переводам строк" in result
+    assert result.rstrip().endswith('"цитата" 29')
+
+
+def test_quoted_newlines(workspace):
+    _frame(note=lambda i: f"line1\nline2 {i}").to_csv(workspace / "multi.csv", index=False)
+    result = agent.csv_read.invoke({"filename": "multi.csv", "head": 3, "tail": 2})
+    assert _rows(result) == 30
+    tail = result.split("Последние строки:")[1]
+    assert "29" in tail and "28" in tail and "NaN" not in tail
+
+
+def test_utf16(workspace):
+    _frame().to_csv(workspace / "wide.csv", index=False, encoding="utf-16")
+    result = agent.csv_read.invoke({"filename": "wide.csv", "head": 3, "tail": 2})
+    assert "utf-16" in result
+    assert _rows(result) == 30
+    assert result.rstrip().endswith("заметка 29")
+
+
+@pytest.mark.parametrize("block", [7, 64, 1 << 20])
+def test_quote_parity_across_blocks(workspace, monkeypatch, block):
+    # Кавычка открывается в одном блоке, перевод строки — в следующем
+    monkeypatch.setattr(agent, "CSV_COUNT_BLOCK_BYTES", block)
+    monkeypatch.setattr(agent, "CSV_QUOTE_BLOCK_BYTES", max(block // 2, 1))
+    path = workspace / "blocks.csv"
+    _frame(n=40, note=lambda i: "длинная ячейка " * 3 + ("\nвторая строка" if i == 25 else "")).to_csv(
+        path, index=False)
+    assert agent._count_newlines(path) is None
+    assert agent._count_lines(path) == 41
+
+    _frame(n=40, note=lambda i: f'"x" {i}').to_csv(path, index=False)
+    assert agent._count_newlines(path) == 41
@@ -0,0 +1,49 @@
+"""excel_style: шапка и рамки через именованные стили."""
+
+import json
+
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Border, Side
+
+import claude_agent_v3 as agent
+
+
+def _book(path, header_border=None):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Регион", "Сумма"])
+    ws.append(["Север", 10])
+    if header_border:
+        for cell in ws[1]:
+            cell.border = header_border
+    wb.save(path)
+
+
+def _style(path, **styles):
+    result = agent.excel_style.invoke({"filename": path.name, "styles": json.dumps(styles)})
+    assert result.startswith("✓"), result
+    return load_workbook(path).active
+
+
+def test_header_without_borders_keeps_existing_border(workspace):
+    path = workspace / "styled.xlsx"
+    _book(path, Border(bottom=Side(style="double")))
+
+    ws = _style(path, header_row=1, header_color="FF0000")
+
+    for cell in ws[1]:
+        assert cell.font.b
+        assert cell.fill.fgColor.rgb.endswith("FF0000")
+        assert cell.border.bottom.style == "double"
+
+
+def test_header_with_borders(workspace):
+    path = workspace / "styled.xlsx"
+    _book(path)
+
+    ws = _style(path, header_row=1, borders=True)
+
+    for row in ws.iter_rows():
+        for cell in row:
+            assert cell.border.left.style == "thin"
+    assert ws["A1"].font.b and not ws["A2"].font.b
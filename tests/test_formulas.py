@@ -0,0 +1,59 @@
+"""Движок формул: разбор, приоритет операторов, функции."""
+
+import pytest
+from openpyxl import Workbook
+
+import claude_agent_v3 as agent
+
+
+def _evaluate(*formulas, **cells):
+    """Значения формул, записанных в колонку B; cells — значения вида A1=…"""
+    wb = Workbook()
+    ws = wb.active
+    for address, value in cells.items():
+        ws[address] = value
+    for row, formula in enumerate(formulas, start=1):
+        ws.cell(row=row, column=2, value=formula)
+    engine = agent._recalculate_workbook(wb)
+    return [engine.values[(ws.title, row, 2)] for row in range(1, len(formulas) + 1)]
+
+
+@pytest.mark.parametrize("formula, expected", [
+    ("=2^3^2", 64),            # ^ левоассоциативен
+    ("=-2^2", 4),              # унарный минус сильнее ^
+    ("=2*3^2", 18),
+    ("=1+2*3", 7),
+    ("=(1+2)*3", 9),
+    ("=10-4-3", 3),
+    ("=64/4/2", 8),
+    ("=2^-1", 0.5),
+    ("=50%*4", 2),
+    ("=1+2&3", "33"),          # & слабее арифметики
+    ("=1+1=2", True),          # сравнение слабее всего
+    ('="a"&1+1', "a2"),
+])
+def test_operator_precedence(formula, expected):
+    assert _evaluate(formula) == [pytest.approx(expected) if isinstance(expected, float) else expected]
+
+
+def test_cell_references():
+    assert _evaluate("=A1^A2^A3", "=SUM(A1:A3)", A1=2, A2=3, A3=2) == [64, 7]
+
+
+@pytest.mark.parametrize("value, digits, expected", [
+    (1.005, 2, 1.01),
+    (2.675, 2, 2.68),
+    (0.285, 2, 0.29),
+    (-1.005, 2, -1.01),
+    (2.5, 0, 3),
+    (-2.5, 0, -3),
+    (1234.5678, -2, 1200),
+    (0.1 + 0.2, 1, 0.3),
+    (1e30, 2, 1e30),
+])
+def test_round_half_up_on_decimal_digits(value, digits, expected):
+    assert agent._xl_round(value, digits) == expected
+
+
+def test_round_in_formula():
+    assert _evaluate("=ROUND(A1, 2)", "=ROUND(A1*100, 0)", A1=1.005) == [1.01, 101]
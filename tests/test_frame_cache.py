@@ -0,0 +1,48 @@
+"""Кэш разобранных таблиц: Feather на диске и проекция колонок."""
+
+import pandas as pd
+import pytest
+
+import claude_agent_v3 as agent
+
+pytestmark = pytest.mark.skipif(not agent.ARROW_AVAILABLE, reason="pyarrow не установлен")
+
+
+@pytest.fixture
+def table(workspace):
+    path = workspace / "sales.csv"
+    pd.DataFrame({"Регион": ["Север", "Юг", "Запад"], "Сумма": [10, 20, 30],
+                  "Кол-во": [1, 2, 3]}).to_csv(path, index=False)
+    agent._read_table(path)  # полный разбор ложится в Feather
+    agent._workbook_cache.clear()
+    return path
+
+
+def test_projection_from_feather(table):
+    df = agent._read_table(table, columns=["Сумма"])
+    assert list(df.columns) == ["Сумма"]
+    assert df["Сумма"].tolist() == [10, 20, 30]
+
+
+def test_corrupt_feather_rereads_file(table):
+    sidecar = agent._frame_store._path_for(table, ("pandas", 0))
+    sidecar.write_bytes(sidecar.read_bytes()[:100])
+
+    df = agent._read_table(table, columns=["Регион", "Сумма"])
+
+    assert df.to_dict("list") == {"Регион": ["Север", "Юг", "Запад"], "Сумма": [10, 20, 30]}
+    # Проекция не записывается в кэш полного разбора
+    assert not sidecar.exists()
+    agent._workbook_cache.clear()
+    assert list(agent._read_table(table).columns) == ["Регион", "Сумма", "Кол-во"]
+
+
+def test_projection_survives_eviction_after_contains(table, monkeypatch):
+    agent._read_table(table)
+    # Запись вытеснена другим потоком сразу после проверки contains
+    monkeypatch.setattr(agent._workbook_cache, "contains", lambda *args: True)
+    agent._workbook_cache.clear()
+
+    df = agent._read_table(table, columns=["Сумма"])
+
+    assert df["Сумма"].tolist() == [10, 20, 30]
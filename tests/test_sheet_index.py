@@ -0,0 +1,164 @@
+"""Индекс строк xlsx: постраничное чтение совпадает с разбором листа целиком."""
+
+import re
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+from openpyxl.styles import PatternFill
+
+import claude_agent_v3 as agent
+
+FILL = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+
+
+@pytest.fixture(params=["openpyxl", "calamine"])
+def engine(request, monkeypatch):
+    if request.param == "calamine" and not agent.CALAMINE_AVAILABLE:
+        pytest.skip("python-calamine не установлен")
+    monkeypatch.setattr(agent, "EXCEL_READER_ENGINE", request.param)
+    return request.param
+
+
+def _merged_title(path):
+    """Шапка — объединённая A1:C1, под ней три колонки данных."""
+    wb = Workbook()
+    ws = wb.active
+    ws["A1"] = "Отчёт"
+    ws.merge_cells("A1:C1")
+    for r in range(2, 32):
+        ws.append([f"n{r}", r, r * 1.5])
+    wb.save(path)
+
+
+def _styled_gaps(path):
+    """Пустые строки с оформлением, пустая колонка «Total», вертикальный merge."""
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Код", "Имя", "Total", "Группа"])
+    for r in range(2, 33):
+        if r in (10, 20):
+            for col in range(1, 5):
+                ws.cell(row=r, column=col).fill = FILL
+            continue
+        ws.append([f"n{r}", f"имя {r}", None, None])
+        ws.cell(row=r, column=3).fill = FILL
+    ws["D5"] = "А"
+    ws.merge_cells("D5:D8")
+    wb.save(path)
+
+
+def _full_table(path):
+    agent._workbook_cache.clear()
+    return agent._sheet_table(path)
+
+
+def _index_table(path):
+    page, total = agent._indexed_page(path, None, 0, 10_000)
+    return page.reset_index(drop=True), total
+
+
+@pytest.mark.parametrize("build", [_merged_title, _styled_gaps])
+def test_index_matches_full_read(workspace, engine, build):
+    path = workspace / "sheet.xlsx"
+    build(path)
+    full = _full_table(path)
+    page, total = _index_table(path)
+
+    assert total == len(full)
+    assert list(page.columns) == list(full.columns)
+    assert page.astype(object).where(page.notna(), None).values.tolist() == \
+        full.astype(object).where(full.notna(), None).values.tolist()
+
+
+def test_merged_header_columns(workspace):
+    path = workspace / "sheet.xlsx"
+    _merged_title(path)
+    page, total = _index_table(path)
+    assert list(page.columns) == ["Отчёт", "Отчёт.1", "Отчёт.2"]
+    assert total == 30
+    assert page.iloc[0].tolist() == ["n2", 2, 3.0]
+
+
+def test_styled_gaps_layout(workspace):
+    path = workspace / "sheet.xlsx"
+    _styled_gaps(path)
+    page, total = _index_table(path)
+    assert total == 29
+    assert list(page.columns) == ["Код", "Имя", "Группа"]
+    group = [None if pd.isna(v) else v for v in page["Группа"]]
+    assert group[:8] == [None, None, None, "А", "А", "А", "А", None]
+
+
+def _paged_rows(path, limit):
+    """Все строки листа: превью excel_read, затем страницы по курсору."""
+    text = agent.excel_read.invoke({"filename": path.name})
+    summary = agent._read_sheet_summaries(path, agent._parse_sheet_spec(path, None))[0]
+    rows = [list(r) for r in summary["preview"].itertuples(index=False)]
+    columns = list(summary["columns"])
+    token = re.search(r'cursor="(\w+)"', text)
+    while token:
+        state = agent._cursors.get(token.group(1))
+        page, _ = agent._sheet_page(state["path"], state["sheet"], state["position"], limit)
+        assert list(page.columns) == columns
+        rows += [list(r) for r in page.itertuples(index=False)]
+        text = agent.excel_read.invoke({"filename": "", "cursor": token.group(1), "limit": limit})
+        token = re.search(r'cursor="(\w+)"', text)
+    return columns, rows
+
+
+@pytest.mark.parametrize("limit", [7, 50])
+def test_cursor_pages_across_summary_and_index(workspace, engine, limit):
+    path = workspace / "sheet.xlsx"
+    _styled_gaps(path)
+
+    columns, rows = _paged_rows(path, limit)
+
+    full = _full_table(path)
+    assert columns == list(full.columns)
+    assert [r[0] for r in rows] == full["Код"].tolist()
+
+
+@pytest.mark.parametrize("general_regex", [False, True])
+def test_rows_split_across_chunks(workspace, monkeypatch, general_regex):
+    """Строки и теги на границах чанков распаковки не теряются."""
+    monkeypatch.setattr(agent, "_ZIP_READ_CHUNK", 512)
+    if general_regex:
+        monkeypatch.setattr(agent, "_VALUE_CELL_FAST_RE", agent._VALUE_CELL_RE)
+    path = workspace / "sheet.xlsx"
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Код", "Текст", "Пусто", "Число"])
+    for r in range(2, 2002):
+        ws.append([f"n{r}", "x" * (r % 300), None, r if r % 3 else None])
+        if r % 97 == 0:
+            ws.cell(row=r, column=3).fill = FILL
+    wb.save(path)
+
+    full = _full_table(path)
+    page, total = _index_table(path)
+
+    assert total == len(full) == 2000
+    assert list(page.columns) == list(full.columns) == ["Код", "Текст", "Число"]
+    assert page["Код"].tolist() == full["Код"].tolist()
+    sample, sample_total = agent._indexed_sample(path, None, 50)
+    assert sample_total == 2000 and len(sample) == 50
+    assert set(sample["Код"]) <= set(full["Код"])
+
+
+def test_index_reloaded_from_disk(workspace):
+    path = workspace / "sheet.xlsx"
+    _styled_gaps(path)
+    first = _index_table(path)
+    agent._row_indexes.clear()
+    second = _index_table(path)
+    assert second[1] == first[1]
+    assert list(second[0].columns) == list(first[0].columns)
+    assert second[0]["Код"].tolist() == first[0]["Код"].tolist()
+
+
+def test_excel_read_offset_on_merged_title(workspace):
+    path = workspace / "sheet.xlsx"
+    _merged_title(path)
+    text = agent.excel_read.invoke({"filename": path.name, "offset": 5, "limit": 3})
+    assert "Отчёт.2" in text and "n7" in text and "10.5" in text
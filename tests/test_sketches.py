@@ -0,0 +1,83 @@
+"""Скетчи профиля таблиц: HyperLogLog, t-digest, моменты по кускам."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import claude_agent_v3 as agent
+
+
+@pytest.mark.parametrize("n", [50, 1_000, 20_000, 300_000])
+def test_hll_relative_error(n):
+    # Ошибка HLL при p=12 ~1.6%; три σ — с запасом
+    values = pd.Series(np.arange(n)).astype(str)
+    estimate = agent._HyperLogLog().add_series(values).estimate()
+    assert abs(estimate - n) / n < 0.05
+
+
+def test_hll_merge_equals_union():
+    left = pd.Series(np.arange(0, 60_000))
+    right = pd.Series(np.arange(40_000, 100_000))
+    merged = agent._HyperLogLog().add_series(left).merge(agent._HyperLogLog().add_series(right))
+    union = agent._HyperLogLog().add_series(pd.concat([left, right]))
+    assert np.array_equal(merged.registers, union.registers)
+    assert abs(merged.estimate() - 100_000) / 100_000 < 0.05
+
+
+def test_hll_ignores_duplicates_and_nulls():
+    values = pd.Series(["a", "b", None, "a", "c"] * 1000)
+    assert agent._HyperLogLog().add_series(values).estimate() == 3
+
+
+QUANTILES = [0.001, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 0.999]
+
+
+def _rank_errors(digest, values):
+    ordered = np.sort(values)
+    estimates = digest.quantiles(QUANTILES)
+    ranks = np.searchsorted(ordered, estimates) / len(ordered)
+    return np.abs(ranks - np.asarray(QUANTILES))
+
+
+@pytest.mark.parametrize("distribution", ["normal", "lognormal", "uniform"])
+def test_tdigest_rank_error_in_chunks(distribution):
+    rng = np.random.default_rng(7)
+    values = getattr(rng, distribution)(size=200_000)
+    digest = agent._TDigest()
+    for chunk in np.array_split(values, 40):
+        digest.add(chunk)
+
+    assert _rank_errors(digest, values).max() < 2e-3
+    assert digest.quantiles([0, 1]) == [values.min(), values.max()]
+    assert len(digest.means) <= 2 * digest.compression
+
+
+def test_tdigest_merge_of_parts():
+    rng = np.random.default_rng(3)
+    parts = [rng.exponential(scale=s, size=30_000) for s in (1, 5, 20)]
+    digest = agent._TDigest()
+    for part in parts:
+        digest.merge(agent._TDigest().add(part))
+    assert _rank_errors(digest, np.concatenate(parts)).max() < 2e-3
+
+
+def test_tdigest_skips_non_finite_and_empty():
+    assert agent._TDigest().quantiles([0.5]) == [None]
+    digest = agent._TDigest().add(np.array([1.0, np.nan, np.inf, 3.0]))
+    assert digest.quantiles([0, 0.5, 1]) == [1.0, 2.0, 3.0]
+
+
+def test_profile_chunks_moments_match_numpy():
+    rng = np.random.default_rng(11)
+    df = pd.DataFrame({"x": rng.normal(100, 15, 50_000), "g": rng.choice(list("abc"), 50_000)})
+    chunks = (df.iloc[i:i + 7_000] for i in range(0, len(df), 7_000))
+
+    total, profile, n_chunks = agent._profile_chunks(chunks, digests=True)
+
+    x = next(entry for entry in profile if entry["column"] == "x")
+    assert total == 50_000 and n_chunks == 8
+    assert x["mean"] == pytest.approx(df["x"].mean(), rel=1e-12)
+    assert x["std"] == pytest.approx(df["x"].std(), rel=1e-9)
+    assert abs(x["distinct"] - 50_000) / 50_000 < 0.05
+    g = next(entry for entry in profile if entry["column"] == "g")
+    assert g["distinct"] == 3 and sum(count for _, count in g["top"]) == 50_000
@@ -0,0 +1,135 @@
+"""table_join: все виды соединений в памяти и с разбиением на диске."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import claude_agent_v3 as agent
+
+
+@pytest.fixture
+def tables(workspace):
+    rng = np.random.default_rng(5)
+    left = pd.DataFrame({
+        "Клиент": rng.integers(0, 3_000, 12_000),
+        "Сумма": rng.integers(1, 1_000, 12_000),
+    })
+    right = pd.DataFrame({
+        "Код": np.concatenate([np.arange(1_500, 4_500), np.arange(1_500, 1_700)]),
+        "Регион": [f"р{i % 7}" for i in range(3_200)],
+    })
+    left.to_csv(workspace / "orders.csv", index=False)
+    right.to_csv(workspace / "clients.csv", index=False)
+    return left, right
+
+
+@pytest.fixture(params=["memory", "grace"])
+def mode(request, monkeypatch):
+    monkeypatch.setattr(agent, "TABLE_CHUNK_MIN_ROWS", 1_000)
+    if request.param == "grace":
+        # Бюджет меньше любой из таблиц — обе раскладываются по частям на диске
+        monkeypatch.setattr(agent, "DATA_MEMORY_BUDGET_BYTES", 64 * 1024)
+    else:
+        monkeypatch.setattr(agent, "DATA_MEMORY_BUDGET_BYTES", 256 * 1024)
+    return request.param
+
+
+def _canonical(df):
+    """Строки без учёта порядка; числа — float, пропуски — None."""
+    return sorted(
+        repr(tuple(None if pd.isna(v) else v if isinstance(v, str) else float(v) for v in row))
+        for row in df.itertuples(index=False)
+    )
+
+
+@pytest.mark.parametrize("how", ["inner", "left", "right", "outer"])
+def test_join_matches_pandas(workspace, tables, mode, how):
+    left, right = tables
+    result = agent.table_join.invoke({
+        "left_file": "orders.csv", "right_file": "clients.csv", "on": "Клиент",
+        "right_on": "Код", "output_file": f"{how}.csv", "how": how,
+    })
+    assert result.startswith("✓"), result
+    assert ("по частям на диске" in result) == (mode == "grace")
+
+    joined = pd.read_csv(workspace / f"{how}.csv")
+    expected = left.merge(right, left_on="Клиент", right_on="Код", how=how)
+    assert list(joined.columns) == ["Клиент", "Сумма", "Код", "Регион"]
+    assert len(joined) == len(expected)
+    assert _canonical(joined) == _canonical(expected[joined.columns])
+
+
+def test_join_same_key_name_to_feather(workspace, tables):
+    if not agent.ARROW_AVAILABLE:
+        pytest.skip("pyarrow не установлен")
+    left, right = tables
+    right = right.rename(columns={"Код": "Клиент"})
+    right.to_csv(workspace / "clients.csv", index=False)
+
+    result = agent.table_join.invoke({
+        "left_file": "orders.csv", "right_file": "clients.csv", "on": "Клиент",
+        "output_file": "joined.feather", "how": "left",
+    })
+    assert result.startswith("✓"), result
+
+    joined = pd.read_feather(workspace / "joined.feather")
+    expected = left.merge(right, on="Клиент", how="left")
+    assert len(joined) == len(expected)
+    assert joined["Регион"].isna().sum() == expected["Регион"].isna().sum()
+
+
+def test_join_rejects_bad_arguments(workspace, tables):
+    args = {"left_file": "orders.csv", "right_file": "clients.csv", "on": "Клиент",
+            "right_on": "Код", "output_file": "out.csv"}
+    assert "how должен" in agent.table_join.invoke({**args, "how": "cross"})
+    assert "не найдены" in agent.table_join.invoke({**args, "right_on": "Нет"})
+    assert "сохраняется в" in agent.table_join.invoke({**args, "output_file": "out.json"})
+
+
+def _text_keys(df):
+    """Ключ — как текст, остальное — числами (int с пропусками пишутся как float)."""
+    return df.astype({"Сумма": float, "Курс": float}).assign(Ключ=df["Ключ"].astype(str))
+
+
+@pytest.fixture(params=["date", "code"])
+def keyed_tables(request, workspace):
+    """Ключи, которые читаются не числом: даты "2024-01-05" и коды "00012".
+    В одной части продаж встречается "н/д" — эта часть остаётся текстом."""
+    rng = np.random.default_rng(11)
+    # Строки весят больше дат — кодов меньше, чтобы в режиме memory
+    # справочник уместился в бюджет
+    n = 3_000 if request.param == "date" else 600
+    if request.param == "date":
+        keys = pd.date_range("2015-01-01", periods=2 * n).strftime("%Y-%m-%d")
+    else:
+        keys = pd.Index([f"{i:05d}" for i in range(2 * n)])
+    sales = pd.DataFrame({
+        "Ключ": keys[rng.integers(0, 5 * n // 3, 12_000)],
+        "Сумма": rng.integers(1, 1_000, 12_000).astype(str),
+    })
+    sales.loc[5_000, "Ключ"] = "н/д"
+    rates = pd.DataFrame({
+        "Ключ": keys[n:],
+        "Курс": [str(90 + i % 7) for i in range(n)],
+    })
+    sales.to_csv(workspace / "sales.csv", index=False)
+    rates.to_csv(workspace / "rates.csv", index=False)
+    return sales, rates
+
+
+@pytest.mark.parametrize("how", ["inner", "left", "right", "outer"])
+def test_join_on_text_keys(workspace, keyed_tables, mode, how):
+    sales, rates = keyed_tables
+    result = agent.table_join.invoke({
+        "left_file": "sales.csv", "right_file": "rates.csv", "on": "Ключ",
+        "output_file": f"{how}.csv", "how": how,
+    })
+    assert result.startswith("✓"), result
+    assert ("по частям на диске" in result) == (mode == "grace")
+
+    joined = pd.read_csv(workspace / f"{how}.csv", dtype={"Ключ": str}, keep_default_na=False,
+                         na_values={"Сумма": [""], "Курс": [""]})
+    expected = sales.merge(rates, on="Ключ", how=how)
+    assert list(joined.columns) == ["Ключ", "Сумма", "Курс"]
+    assert len(joined) == len(expected)
+    assert _canonical(_text_keys(joined)) == _canonical(_text_keys(expected[joined.columns]))
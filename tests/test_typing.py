@@ -0,0 +1,77 @@
+"""Типизация таблиц: все типы выводит _infer_column, текст не портится."""
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import claude_agent_v3 as agent
+
+
+def _values(series):
+    return [None if pd.isna(v) else v for v in series]
+
+
+@pytest.fixture(params=["xlsx", "csv"])
+def codes_table(request, workspace):
+    rows = [["Артикул", "Кол-во", "Цена", "Активен"],
+            ["00012", 5, 1.5, True], ["00112", 7, 2.25, False], ["04200", 9, 3.0, True]]
+    path = workspace / f"codes.{request.param}"
+    if request.param == "xlsx":
+        wb = Workbook()
+        for row in rows:
+            wb.active.append(row)
+        wb.save(path)
+    else:
+        pd.DataFrame(rows[1:], columns=rows[0]).to_csv(path, index=False)
+    return path
+
+
+def test_leading_zero_codes_stay_text(codes_table):
+    df = agent._read_table(codes_table)
+    assert df["Артикул"].tolist() == ["00012", "00112", "04200"]
+    assert pd.api.types.is_integer_dtype(df["Кол-во"])
+    assert pd.api.types.is_float_dtype(df["Цена"])
+    assert str(df["Активен"].dtype) == "boolean"
+
+
+def test_leading_zero_codes_in_chunks_and_projection(codes_table):
+    chunks = list(agent._iter_table_chunks(codes_table, chunk_rows=2))
+    assert sum((c["Артикул"].tolist() for c in chunks), []) == ["00012", "00112", "04200"]
+    assert all(pd.api.types.is_integer_dtype(c["Кол-во"]) for c in chunks)
+    agent._workbook_cache.clear()
+    assert agent._read_table(codes_table, columns=["Артикул"])["Артикул"].tolist() == \
+        ["00012", "00112", "04200"]
+
+
+@pytest.mark.parametrize("values", [
+    [True, False, True, None],
+    [True, False, True, float("nan")],
+    ["True", "false", "TRUE", None],
+])
+def test_bool_column_with_blanks(values):
+    series = agent._infer_column(pd.Series(values, dtype=object))
+    assert str(series.dtype) == "boolean"
+    assert _values(series) == [True, False, True, None]
+
+
+def test_mixed_bool_and_numbers_are_not_coerced():
+    series = agent._infer_column(pd.Series([True, 2, 3.5], dtype=object))
+    assert series.tolist() == [True, 2, 3.5]
+
+
+@pytest.mark.parametrize("values, dtype", [
+    (["1", "2", None], "int"),
+    (["1.5", "2", None], "float"),
+    (["007", "8"], "object"),
+    (["2024-01-05", "2024-02-10"], "datetime"),
+])
+def test_text_values_from_csv(values, dtype):
+    series = agent._infer_column(pd.Series(values, dtype=object))
+    if dtype == "int":
+        assert pd.api.types.is_numeric_dtype(series) and _values(series) == [1, 2, None]
+    elif dtype == "float":
+        assert _values(series) == [1.5, 2.0, None]
+    elif dtype == "object":
+        assert series.tolist() == values
+    else:
+        assert pd.api.types.is_datetime64_any_dtype(series)